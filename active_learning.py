@@ -0,0 +1,332 @@
+"""
+Active-learning mining of uncertain production frames.
+
+Every served prediction already has its raw score, calibrated P(Faulty) and
+threshold, and the TTA spread when TTA ran. The miner only looks at those
+numbers: there is no second model pass. A frame is a labelling candidate
+when its P(Faulty) lies within `band` of the threshold it was judged
+against, or when its TTA / ensemble scores disagree (score_std >=
+min_disagreement). Its priority is the larger of the two signals, each on a
+0-1 scale: closeness to the threshold, and the spread.
+
+Candidates go from the request path to a bounded in-memory queue. A
+background thread then hashes them with the perceptual hash from
+src/data/dedup.py and drops near-duplicates of data/raw or of frames
+already queued. The rest are written to data/label_queue, at most
+`capacity` frames; when it is full, a new frame only gets in by evicting a
+lower-priority one.
+
+Queued frames use the data/raw naming convention, named after the
+prediction: cracked_mined_<hash>.jpg or normal_mined_<hash>.jpg. Each has a
+.json sidecar with the scores and capture metadata. A reviewer fixes the
+prefix where the model was wrong, then promotes the frames into data/raw,
+where src/data/prepare_data.py picks them up:
+
+    python active_learning.py list
+    python active_learning.py label normal_mined_3fa2c1d09b7e.jpg cracked
+    python active_learning.py promote [NAME ...]
+"""
+import os
+import io
+import sys
+import json
+import glob
+import heapq
+import queue
+import random
+import shutil
+import hashlib
+import argparse
+import threading
+from collections import defaultdict
+
+from PIL import Image
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), 'src', 'data'))
+from dedup import (phash, hamming, hash_file, band_keys, probe_keys, check_bands, BANDS, MAX_DISTANCE,  # noqa: E402
+                   IMAGE_EXTENSIONS)
+
+QUEUE_DIR = os.path.join('data', 'label_queue')
+RAW_DIR = os.path.join('data', 'raw')
+LABELS = ('cracked', 'normal')
+FORMAT_EXTENSIONS = {'JPEG': '.jpg', 'PNG': '.png', 'GIF': '.gif'}
+
+
+class _HashIndex:
+    """Incremental multi-index over 64-bit perceptual hashes, the same scheme as dedup.find_duplicate_clusters"""
+
+    def __init__(self, max_distance=MAX_DISTANCE, bands=BANDS):
+        check_bands(bands, max_distance)
+        self.max_distance = max_distance
+        self.bands = bands
+        self.buckets = defaultdict(set)
+
+    def add(self, h):
+        for key in band_keys(h, self.bands):
+            self.buckets[key].add(h)
+
+    def remove(self, h):
+        for key in band_keys(h, self.bands):
+            self.buckets[key].discard(h)
+
+    def near(self, h):
+        """Whether any indexed hash is within max_distance of h"""
+        return any(hamming(h, other) <= self.max_distance
+                   for key in probe_keys(h, self.max_distance, self.bands)
+                   for other in self.buckets.get(key, ()))
+
+
+def label_of(name):
+    return next((label for label in LABELS if os.path.basename(name).lower().startswith(label + '_')), None)
+
+
+class FrameMiner:
+    def __init__(self, queue_dir=QUEUE_DIR, capacity=500, band=0.1, min_disagreement=0.1,
+                 sample_rate=1.0, raw_dir=RAW_DIR, max_pending=64):
+        self.queue_dir = queue_dir
+        self.capacity = capacity
+        self.band = band
+        self.min_disagreement = min_disagreement
+        self.sample_rate = sample_rate
+        self.raw_dir = raw_dir
+        self.counts = {'offered': 0, 'candidates': 0, 'queued': 0, 'duplicates': 0,
+                       'evicted': 0, 'below_queue': 0, 'dropped': 0, 'errors': 0}
+        self._pending = queue.Queue(maxsize=max_pending)
+        self._lock = threading.Lock()
+
+        os.makedirs(queue_dir, exist_ok=True)
+        # Known frames: everything labelled in data/raw plus what is already queued
+        self._index = _HashIndex()
+        self._heap = []  # (priority, name, phash), lowest priority first
+        for path in self._raw_images():
+            h = hash_file(path)
+            if h is not None:
+                self._index.add(h)
+        for meta in self._queued_meta():
+            self._index.add(meta['phash'])
+            heapq.heappush(self._heap, (meta['priority'], meta['name'], meta['phash']))
+
+        self._worker = threading.Thread(target=self._write_loop, name='frame-miner', daemon=True)
+        self._worker.start()
+
+    def _raw_images(self):
+        return [p for p in glob.glob(os.path.join(self.raw_dir, '*')) if p.lower().endswith(IMAGE_EXTENSIONS)]
+
+    def _queued_meta(self):
+        metas = []
+        for path in sorted(glob.glob(os.path.join(self.queue_dir, '*.json'))):
+            try:
+                with open(path) as f:
+                    meta = json.load(f)
+                # The sidecar's file name follows relabelling; the name inside it does not
+                meta['name'] = os.path.basename(path)[:-len('.json')]
+                if os.path.exists(os.path.join(self.queue_dir, meta['name'])):
+                    metas.append(meta)
+            except (OSError, ValueError, KeyError):
+                continue
+        return metas
+
+    # ------------------------------------------------------------------
+    # Request path
+    # ------------------------------------------------------------------
+
+    def priority(self, result):
+        """0-1 labelling value of a served verdict, or None when it is not a candidate"""
+        margin = abs(result['probability_faulty'] - result['threshold'])
+        spread = (result.get('tta') or {}).get('score_std') or 0.0
+        uncertain = margin <= self.band
+        disagreeing = self.min_disagreement > 0 and spread >= self.min_disagreement
+        if not (uncertain or disagreeing):
+            return None
+        return round(max(1 - margin / self.band if uncertain else 0.0,
+                         min(1.0, spread / (2 * self.min_disagreement)) if disagreeing else 0.0), 4)
+
+    def offer(self, fileobj, result, **metadata):
+        """
+        Consider a served frame for labelling. Only the verdict is inspected
+        here; candidates are copied and handed to the background thread, and
+        dropped (and counted) when it is behind.
+        """
+        self.counts['offered'] += 1
+        priority = self.priority(result)
+        if priority is None or random.random() >= self.sample_rate:
+            return False
+        self.counts['candidates'] += 1
+        with self._lock:
+            if len(self._heap) >= self.capacity and priority <= self._heap[0][0]:
+                self.counts['below_queue'] += 1
+                return False
+        fileobj.seek(0)
+        item = (priority, fileobj.read(), result, metadata)
+        try:
+            self._pending.put_nowait(item)
+        except queue.Full:
+            self.counts['dropped'] += 1
+            return False
+        return True
+
+    # ------------------------------------------------------------------
+    # Background writer
+    # ------------------------------------------------------------------
+
+    def _write_loop(self):
+        while True:
+            item = self._pending.get()
+            if item is None:
+                return
+            try:
+                self._store(*item)
+            except Exception as e:
+                self.counts['errors'] += 1
+                print(f"⚠️  Frame miner could not store a frame: {e}")
+
+    def _store(self, priority, data, result, metadata):
+        with Image.open(io.BytesIO(data)) as img:
+            h = phash(img)
+            image_format = img.format
+            if image_format not in FORMAT_EXTENSIONS:
+                buffer = io.BytesIO()
+                img.convert('RGB').save(buffer, 'PNG')
+                data, image_format = buffer.getvalue(), 'PNG'
+
+        with self._lock:
+            if self._index.near(h):
+                self.counts['duplicates'] += 1
+                return
+            if len(self._heap) >= self.capacity:
+                if priority <= self._heap[0][0]:
+                    self.counts['below_queue'] += 1
+                    return
+                _, evicted, evicted_hash = heapq.heappop(self._heap)
+                self._index.remove(evicted_hash)
+                self._delete(evicted)
+                self.counts['evicted'] += 1
+
+            label = 'cracked' if result['has_crack'] else 'normal'
+            digest = hashlib.sha256(data).hexdigest()[:12]
+            name = f"{label}_mined_{digest}{FORMAT_EXTENSIONS[image_format]}"
+            meta = dict(metadata, name=name, priority=priority, phash=h, predicted=label,
+                        raw_score=result['raw_score'], probability_faulty=result['probability_faulty'],
+                        threshold=result['threshold'], operating_point=result.get('operating_point'),
+                        score_std=(result.get('tta') or {}).get('score_std'),
+                        model_version=result.get('model_version'))
+            path = os.path.join(self.queue_dir, name)
+            with open(path + '.tmp', 'wb') as f:
+                f.write(data)
+            os.replace(path + '.tmp', path)
+            with open(path + '.json', 'w') as f:
+                json.dump(meta, f, indent=2)
+            self._index.add(h)
+            heapq.heappush(self._heap, (priority, name, h))
+            self.counts['queued'] += 1
+
+    def _delete(self, name):
+        # Under either prefix, in case a reviewer relabelled it meanwhile
+        current = label_of(name)
+        for label in LABELS:
+            for suffix in ('', '.json'):
+                try:
+                    os.remove(os.path.join(self.queue_dir, label + name[len(current):] + suffix))
+                except FileNotFoundError:
+                    pass
+
+    def close(self, timeout=10.0):
+        """Write the frames still pending and stop"""
+        try:
+            self._pending.put(None, timeout=timeout)
+        except queue.Full:
+            return
+        self._worker.join(timeout)
+
+    def stats(self):
+        with self._lock:
+            size = len(self._heap)
+            floor = self._heap[0][0] if self._heap else None
+        return dict(self.counts, queue_size=size, capacity=self.capacity, pending=self._pending.qsize(),
+                    lowest_priority=floor)
+
+
+# ----------------------------------------------------------------------------
+# Review
+# ----------------------------------------------------------------------------
+
+def queued(queue_dir=QUEUE_DIR):
+    """Sidecars of the queued frames, highest priority first"""
+    metas = []
+    for path in glob.glob(os.path.join(queue_dir, '*.json')):
+        with open(path) as f:
+            meta = json.load(f)
+        meta['name'] = os.path.basename(path)[:-len('.json')]
+        metas.append(meta)
+    return sorted(metas, key=lambda m: -m['priority'])
+
+
+def relabel(name, label, queue_dir=QUEUE_DIR):
+    """Set a queued frame's label by renaming it to the other class prefix"""
+    if label not in LABELS:
+        raise ValueError(f"Label must be one of {', '.join(LABELS)}")
+    current = label_of(name)
+    if current is None:
+        raise ValueError(f"{name} has no {' or '.join(LABELS)} prefix")
+    new_name = label + name[len(current):]
+    if new_name != name:
+        for suffix in ('', '.json'):
+            os.replace(os.path.join(queue_dir, name + suffix), os.path.join(queue_dir, new_name + suffix))
+    return new_name
+
+
+def promote(names=None, queue_dir=QUEUE_DIR, raw_dir=RAW_DIR):
+    """Move reviewed frames (all by default) into data/raw; their sidecars go to promoted.jsonl"""
+    names = names or [m['name'] for m in queued(queue_dir)]
+    os.makedirs(raw_dir, exist_ok=True)
+    with open(os.path.join(queue_dir, 'promoted.jsonl'), 'a') as log:
+        for name in names:
+            label = label_of(name)
+            if label is None:
+                print(f"⚠️  Skipping {name}: no {' or '.join(LABELS)} prefix")
+                continue
+            # A frame relabelled by hand keeps its sidecar under the old prefix
+            meta = {}
+            for prefix in (label,) + tuple(l for l in LABELS if l != label):
+                sidecar = os.path.join(queue_dir, prefix + name[len(label):] + '.json')
+                if os.path.exists(sidecar):
+                    with open(sidecar) as f:
+                        meta = json.load(f)
+                    os.remove(sidecar)
+                    break
+            shutil.move(os.path.join(queue_dir, name), os.path.join(raw_dir, name))
+            log.write(json.dumps(dict(meta, name=name, label=label)) + '\n')
+            print(f"✅ {name} -> {raw_dir}")
+    return names
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Review the active-learning labelling queue")
+    parser.add_argument('--queue-dir', default=QUEUE_DIR)
+    sub = parser.add_subparsers(dest='command', required=True)
+    show = sub.add_parser('list', help="Queued frames, most uncertain first")
+    show.add_argument('--limit', type=int, default=50)
+    fix = sub.add_parser('label', help="Set a queued frame's label")
+    fix.add_argument('name')
+    fix.add_argument('label', choices=LABELS)
+    move = sub.add_parser('promote', help="Move reviewed frames into data/raw")
+    move.add_argument('names', nargs='*')
+    move.add_argument('--raw-dir', default=RAW_DIR)
+    args = parser.parse_args()
+
+    if args.command == 'list':
+        metas = queued(args.queue_dir)
+        print(f"{len(metas)} frames queued in {args.queue_dir}\n")
+        print(f"{'Priority':>8} {'P(Faulty)':>9} {'Thr':>6} {'Spread':>6}  Name")
+        for m in metas[:args.limit]:
+            spread = f"{m['score_std']:.3f}" if m.get('score_std') is not None else '-'
+            print(f"{m['priority']:>8.3f} {m['probability_faulty']:>9.3f} {m['threshold']:>6.3f} "
+                  f"{spread:>6}  {m['name']}")
+    elif args.command == 'label':
+        print(f"✅ {relabel(args.name, args.label, args.queue_dir)}")
+    else:
+        promote(args.names, args.queue_dir, args.raw_dir)
+
+
+if __name__ == '__main__':
+    main()
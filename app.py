@@ -1,15 +1,42 @@
 import uvicorn
 from fastapi import FastAPI
 import tensorflow as tf
-from fastapi import File, UploadFile
+from fastapi import File, UploadFile, Header, HTTPException, Request, Query, Form
+from fastapi.concurrency import run_in_threadpool
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import JSONResponse, StreamingResponse, Response
 from PIL import Image
-import io
 import os
+import hmac
+import json
+import time
+import atexit
+import asyncio
+import threading
 import numpy as np
-from tensorflow.keras.applications.inception_resnet_v2 import preprocess_input
+from typing import List
+from contextlib import asynccontextmanager
 
-app = FastAPI()
+import model_registry
+import tta
+from results_store import ResultsStore
+from defect_events import DefectEventAggregator
+from active_learning import FrameMiner
+from explain import GradCamExplainer
+from scheduler import InferenceScheduler, DeadlineExceeded, QueueFull
+import verdict_format
+from preprocessing import resize_for_model, preprocess_image
+import rail_roi
+
+@asynccontextmanager
+async def lifespan(app):
+    # Runs once in each process that serves requests. Importing the module
+    # (a spawned worker re-runs this script as __mp_main__ before importing
+    # app) or the multi-worker supervisor never starts anything
+    start_services()
+    yield
+
+app = FastAPI(lifespan=lifespan)
 
 # Load model - crack detection
 import tensorflow.keras.backend as K
@@ -49,30 +76,165 @@ class CustomScaleLayer(tf.keras.layers.Layer):
         return config
 
 # Load model - crack detection
-model_path = 'models/model.tflite'
-interpreter = None
-input_details = None
-output_details = None
+# The active version comes from models/registry/registry.json, falling back
+# to models/model.tflite when nothing has been registered yet
+ADMIN_TOKEN = os.getenv("ADMIN_TOKEN")
 
-def load_prediction_model():
-    global interpreter, input_details, output_details
-    if os.path.exists(model_path):
+# Every batch shape the server invokes at, and synthetic invokes per shape
+# before the model is marked ready
+SERVING_BATCH_SIZES = [int(b) for b in os.getenv("SERVING_BATCH_SIZES", "1").split(",")]
+WARMUP_RUNS = int(os.getenv("WARMUP_RUNS", "3"))
+
+# Multi-worker serving: WEB_CONCURRENCY worker processes share the
+# memory-mapped model file; INTERPRETER_THREADS defaults to an even split of
+# the cores so workers don't oversubscribe the CPU
+WORKERS = int(os.getenv("WEB_CONCURRENCY", "1"))
+# Seconds a starting worker has to answer the supervisor; TensorFlow's import takes several
+WORKER_HEALTHCHECK_TIMEOUT = int(os.getenv("WORKER_HEALTHCHECK_TIMEOUT", "60"))
+INTERPRETER_THREADS = int(os.getenv("INTERPRETER_THREADS", str(max(1, (os.cpu_count() or 1) // WORKERS))))
+SHARED_WEIGHTS = os.getenv("SHARED_WEIGHTS", "0") == "1"
+
+# tflite, onnxruntime, openvino, or auto (fastest installed backend that
+# matches TFLite on data/processed/test); see inference_backends.py
+INFERENCE_BACKEND = os.getenv("INFERENCE_BACKEND", "tflite")
+
+# Test-time augmentation / ensembling, only for frames whose first-pass
+# calibrated P(Faulty) lands inside TTA_BAND
+TTA_ENABLED = os.getenv("TTA", "0") == "1"
+TTA_VARIANTS = tta.parse_variants(os.getenv("TTA_VARIANTS", ",".join(tta.DEFAULT_VARIANTS)))
+TTA_BAND = tuple(float(x) for x in os.getenv("TTA_BAND", "0.35,0.65").split(","))
+# e.g. models/final_model.tflite (python convert_to_tflite.py --model models/final_model.h5 --output ...)
+ENSEMBLE_MODELS = [p for p in os.getenv("ENSEMBLE_MODELS", "").split(",") if p]
+augmenter = tta.TestTimeAugmenter(TTA_VARIANTS, TTA_BAND) if TTA_ENABLED else None
+if augmenter is not None and augmenter.primary_batch_size:
+    SERVING_BATCH_SIZES = sorted(set(SERVING_BATCH_SIZES) | {augmenter.primary_batch_size})
+
+# Upload limits, enforced from headers before the body is read
+MAX_UPLOAD_BYTES = int(os.getenv("MAX_UPLOAD_BYTES", str(20 * 1024 * 1024)))
+# Endpoints that take an image body, and so fall under MAX_UPLOAD_BYTES
+UPLOAD_PATHS = ('/upload', '/explain')
+MAX_IMAGE_PIXELS = int(os.getenv("MAX_IMAGE_PIXELS", str(40_000_000)))
+Image.MAX_IMAGE_PIXELS = MAX_IMAGE_PIXELS
+
+# Every prediction is persisted to an embedded SQLite store by a background
+# writer; RESULTS_DB= (empty) turns it off
+RESULTS_DB = os.getenv("RESULTS_DB", os.path.join("data", "results.db"))
+results_store = None
+
+# Consecutive detections from one camera are merged into defect events when
+# they are within EVENT_GAP_M along the track (or EVENT_MAX_GAP_S in time)
+EVENT_GAP_M = float(os.getenv("EVENT_GAP_M", "1.0"))
+EVENT_MAX_GAP_S = float(os.getenv("EVENT_MAX_GAP_S", "2.0"))
+EVENT_MIN_FRAMES = int(os.getenv("EVENT_MIN_FRAMES", "1"))
+event_aggregator = None
+
+# Requests waiting for inference, per priority class (interactive / bulk)
+SCHEDULER_MAX_QUEUE = int(os.getenv("SCHEDULER_MAX_QUEUE", "256"))
+# Seconds a client is told to wait (Retry-After) while no model is serving yet
+MODEL_RETRY_AFTER = '5'
+
+# Active learning: served frames near the threshold, or with a wide TTA
+# spread, are copied to a bounded labelling queue (see active_learning.py)
+MINING = os.getenv("MINING", "0") == "1"
+MINING_DIR = os.getenv("MINING_DIR", os.path.join("data", "label_queue"))
+MINING_CAPACITY = int(os.getenv("MINING_CAPACITY", "500"))
+MINING_BAND = float(os.getenv("MINING_BAND", "0.1"))
+MINING_MIN_DISAGREEMENT = float(os.getenv("MINING_MIN_DISAGREEMENT", "0.1"))
+MINING_SAMPLE_RATE = float(os.getenv("MINING_SAMPLE_RATE", "1.0"))
+frame_miner = None
+
+# Grad-CAM heatmaps on /explain/, from the Keras model (loaded on first use);
+# off by default, so serving never loads it
+EXPLAIN = os.getenv("EXPLAIN", "0") == "1"
+EXPLAIN_MODEL = os.getenv("EXPLAIN_MODEL", os.path.join("models", "best_model.h5"))
+EXPLAIN_MAX_BATCH = int(os.getenv("EXPLAIN_MAX_BATCH", "8"))
+EXPLAIN_CACHE_SIZE = int(os.getenv("EXPLAIN_CACHE_SIZE", "256"))
+explainer = GradCamExplainer(
+    EXPLAIN_MODEL,
+    {'focal_loss_fixed': focal_loss(gamma=2.0, alpha=0.25), 'CustomScaleLayer': CustomScaleLayer},
+    EXPLAIN_MAX_BATCH, EXPLAIN_CACHE_SIZE
+) if EXPLAIN else None
+
+def warm_request_path(model):
+    """Run a synthetic frame through preprocessing and prediction"""
+    noise = np.random.default_rng(0).integers(0, 255, (480, 640, 3), dtype=np.uint8)
+    _predict_with(model, Image.fromarray(noise))
+
+backend_options = {'num_threads': INTERPRETER_THREADS, 'shared_weights': SHARED_WEIGHTS}
+
+model_manager = model_registry.ModelManager(
+    batch_sizes=SERVING_BATCH_SIZES,
+    warmup_runs=WARMUP_RUNS,
+    warmup_fn=warm_request_path,
+    backend=INFERENCE_BACKEND,
+    backend_options=backend_options
+)
+
+def load_ensemble():
+    """Ensemble members for TTA, each allocated at the stacked-variants batch size"""
+    for path in ENSEMBLE_MODELS:
         try:
-            # Load TFLite model
-            interpreter = tf.lite.Interpreter(model_path=model_path)
-            interpreter.allocate_tensors()
-            
-            input_details = interpreter.get_input_details()
-            output_details = interpreter.get_output_details()
-            
-            print(f"✅ TFLite Model loaded from {model_path}")
+            member = model_registry.LoadedModel(os.path.basename(path), path, (augmenter.ensemble_batch_size,),
+                                                INFERENCE_BACKEND, backend_options)
+            member.warm_up(WARMUP_RUNS)
+            augmenter.ensemble.append(member)
+            print(f"✅ Ensemble member {path} loaded")
         except Exception as e:
-            print(f"❌ Error loading TFLite model: {e}")
-    else:
-        print(f"⚠️  Model not found at {model_path}. Please run convert_to_tflite.py first.")
+            print(f"❌ Error loading ensemble member {path}: {e}")
 
-# Initial load
-load_prediction_model()
+def load_prediction_model():
+    # Loads and warms in the background; /ready goes green when it's done
+    def startup():
+        if augmenter is not None:
+            load_ensemble()
+        model_manager.load_active()
+    threading.Thread(target=startup, name='model-loader', daemon=True).start()
+    model_manager.start_watcher()
+
+def open_results_store():
+    global results_store
+    if not RESULTS_DB:
+        return
+    try:
+        results_store = ResultsStore(RESULTS_DB)
+        # Flush whatever is still queued when the worker shuts down
+        atexit.register(results_store.close)
+        print(f"✅ Results store at {RESULTS_DB}")
+    except Exception as e:
+        print(f"❌ Error opening results store {RESULTS_DB}: {e}")
+
+def on_defect_event(event):
+    position = f" at {event['start_position_m']:.1f}-{event['end_position_m']:.1f} m" \
+        if event['start_position_m'] is not None else ""
+    print(f"🚨 Defect event {event['event_id'][:8]} on {event['stream']}{position}: "
+          f"{event['frame_count']} frames, peak P(Faulty) {event['peak_probability']:.3f}")
+    if results_store is not None:
+        results_store.record_event(event)
+
+def start_event_aggregation():
+    global event_aggregator
+    event_aggregator = DefectEventAggregator(on_defect_event, EVENT_GAP_M, EVENT_MAX_GAP_S, EVENT_MIN_FRAMES)
+
+    # Close events on cameras that stopped sending frames
+    def expire_loop():
+        while True:
+            time.sleep(1.0)
+            event_aggregator.expire()
+    threading.Thread(target=expire_loop, name='event-expiry', daemon=True).start()
+    # Registered after the store, so it runs first at exit and its events still get written
+    atexit.register(event_aggregator.flush)
+
+def start_frame_mining():
+    global frame_miner
+    if not MINING:
+        return
+    try:
+        frame_miner = FrameMiner(MINING_DIR, MINING_CAPACITY, MINING_BAND, MINING_MIN_DISAGREEMENT,
+                                 MINING_SAMPLE_RATE)
+        atexit.register(frame_miner.close)
+        print(f"✅ Mining uncertain frames into {MINING_DIR} (capacity {MINING_CAPACITY})")
+    except Exception as e:
+        print(f"❌ Error starting frame mining: {e}")
 
 @app.get('/')
 def index():
@@ -80,10 +242,65 @@ def index():
 
 @app.get('/health')
 def health():
+    current = model_manager.current
     return {
         'status': 'healthy', 
-        'model_loaded': interpreter is not None
+        'model_loaded': current is not None,
+        'model_version': current.version if current else None,
+        'results_store': results_store.stats() if results_store else None,
+        'defect_events': event_aggregator.stats() if event_aggregator else None,
+        'mining': frame_miner.stats() if frame_miner else None,
+        'explain': explainer.stats() if explainer else None
+    }
+
+@app.get('/ready')
+def ready():
+    """Readiness: only 200 once the model has been loaded and warmed at every batch shape"""
+    current = model_manager.current
+    body = {
+        'ready': model_manager.ready.is_set(),
+        'model_version': current.version if current else None,
+        'backend': current.backend.name if current else None,
+        'rail_roi': rail_roi.ENABLED,
+        'batch_sizes': SERVING_BATCH_SIZES,
+        'warmup_runs': WARMUP_RUNS,
+        'warmup_seconds': model_manager.warmup_seconds,
+        'last_error': model_manager.last_error
     }
+    return JSONResponse(body, status_code=200 if body['ready'] else 503)
+
+def require_admin(token):
+    # Admin endpoints stay disabled unless ADMIN_TOKEN is configured
+    # Constant-time comparison, so response timing doesn't leak the token
+    if not ADMIN_TOKEN or not hmac.compare_digest((token or '').encode(), ADMIN_TOKEN.encode()):
+        raise HTTPException(status_code=403, detail="Admin access denied")
+
+@app.get('/admin/models')
+def list_models(x_admin_token: str = Header(None)):
+    require_admin(x_admin_token)
+    return model_manager.status()
+
+@app.post('/admin/models/{version}/activate')
+def activate_model(version: str, x_admin_token: str = Header(None)):
+    """Activate a registered version; it is loaded and warmed in the background"""
+    require_admin(x_admin_token)
+    current = model_manager.current
+    try:
+        model_registry.activate_version(version)
+    except ValueError as e:
+        return {'error': True, 'message': str(e)}
+    model_manager.load_active_async()
+    return {'message': f'Activating {version}', 'previous_version': current.version if current else None}
+
+@app.post('/admin/models/rollback')
+def rollback_model(x_admin_token: str = Header(None)):
+    require_admin(x_admin_token)
+    try:
+        version = model_registry.rollback()
+    except ValueError as e:
+        return {'error': True, 'message': str(e)}
+    model_manager.load_active_async()
+    return {'message': f'Rolling back to {version}'}
 
 # CORS configuration
 ALLOWED_ORIGINS = [
@@ -101,85 +318,212 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-def preprocess_image(image: Image.Image):
-    """Preprocess image for InceptionResNetV2 input (300, 300)"""
-    target_size = (300, 300)
-    
-    # Resize image to target size
-    image = image.resize(target_size, Image.Resampling.LANCZOS)
-    
-    # Convert to RGB if needed
-    if image.mode != 'RGB':
-        image = image.convert('RGB')
-    
-    # Convert to array
-    img_array = np.array(image, dtype=np.float32)
+class ModelUnavailable(Exception):
+    """No model is serving yet: still loading, or the last load failed"""
+
+def model_unavailable():
+    if model_manager.last_error is None:
+        return ModelUnavailable('Model is still loading, try again shortly.')
+    return ModelUnavailable('Model not loaded correctly.')
+
+async def predict_crack(image: Image.Image, operating_point=None, site=None,
+                        priority='interactive', deadline_ms=None):
+    """Crack detection using TFLite, queued through the inference scheduler"""
+    arrived = time.monotonic()
+    # Decode and resize off the event loop; the scheduler only sees model-sized frames
+    resized = await run_in_threadpool(resize_for_model, image)
     
-    # Preprocess input (same as training)
-    img_array = np.expand_dims(img_array, axis=0)
-    img_array = preprocess_input(img_array)
+    remaining = None
+    if deadline_ms is not None:
+        remaining = deadline_ms / 1000 - (time.monotonic() - arrived)
+        if remaining <= 0:
+            raise DeadlineExceeded("Deadline passed before the request was queued")
     
-    return img_array
+    future = inference_scheduler.submit((resized, operating_point, site), priority, remaining)
+    try:
+        return await asyncio.wait_for(asyncio.wrap_future(future), remaining)
+    except asyncio.TimeoutError:
+        # Cancelling the wait cancels the job, so it is dropped before invoke
+        raise DeadlineExceeded("Deadline passed while queued")
+
+def run_scheduled_batch(payloads):
+    """Score one scheduled batch with a single invoke, then finish each request"""
+    with model_manager.use() as model:
+        if model is None:
+            return [model_unavailable() for _ in payloads]
+        scores = model.score_batch([resized for resized, _, _ in payloads])
+        results = []
+        for (resized, operating_point, site), score in zip(payloads, scores):
+            try:
+                results.append(finish_prediction(model, resized, float(score), operating_point, site))
+            except Exception as e:
+                results.append(e)
+        return results
 
-def predict_crack(image: Image.Image):
-    """Crack detection using TFLite"""
-    if interpreter is None:
-        return {'error': True, 'message': 'Model not loaded correctly.'}
+inference_scheduler = InferenceScheduler(run_scheduled_batch, SERVING_BATCH_SIZES, SCHEDULER_MAX_QUEUE)
 
+def _predict_with(model, image: Image.Image, operating_point=None, site=None):
     try:
-        # Preprocess
-        img_array = preprocess_image(image)
-        
-        # Set input tensor
-        interpreter.set_tensor(input_details[0]['index'], img_array)
-        
-        # Run inference
-        interpreter.invoke()
-        
-        # Get output tensor
-        prediction = interpreter.get_tensor(output_details[0]['index'])
-        score = float(prediction[0][0])
-        
-        # Probability logic (assuming 0=Faulty, 1=Normal based on previous findings)
-        probability_faulty = 1 - score
-        
-        # Threshold 0.5
-        is_faulty = probability_faulty > 0.5
-        
-        confidence = probability_faulty if is_faulty else score
-        confidence_percent = confidence * 100
-        
-        # Confidence Level
-        if confidence_percent >= 90:
-            confidence_level = "Very High"
-        elif confidence_percent >= 75:
-            confidence_level = "High"
-        elif confidence_percent >= 60:
-            confidence_level = "Moderate"
-        else:
-            confidence_level = "Low"
-        
-        message = ("Crack detected" if is_faulty else "No crack detected") + \
-                  f" with {confidence_percent:.1f}% confidence ({confidence_level})"
-        
-        # For compatibility with frontend that might expect "has_crack"
-        return {
-            'has_crack': is_faulty,
-            'confidence': round(confidence_percent, 2),
-            'confidence_level': confidence_level,
-            'message': message,
-            'probability': round(score, 4), # Raw probability of Class 1 (Normal)
-            'class': 'Faulty' if is_faulty else 'Normal'
-        }
+        # Decode and resize outside the lock; only the buffer fill and invoke are serialised
+        resized = resize_for_model(image)
+        score = float(model.score_batch([resized])[0])
+        return finish_prediction(model, resized, score, operating_point, site)
     except Exception as e:
         import traceback
         print(f"Error in prediction: {e}")
         traceback.print_exc()
         raise
 
+def finish_prediction(model, resized, score, operating_point=None, site=None):
+    # Borderline frame: re-score flips/crops (and ensemble members) in one batched invoke each
+    tta_report = None
+    if augmenter is not None and augmenter.should_refine(model.calibration.probability_faulty(score)):
+        score, tta_report = augmenter.refine(model, resized, score)
+    
+    result = build_result(model, score, operating_point, site)
+    if tta_report is not None:
+        result['tta'] = tta_report
+    return result
+
+def build_result(model, score, operating_point=None, site=None):
+    """Turn a raw score into a verdict; cheap enough to redo for any operating point"""
+    # Probability logic (assuming 0=Faulty, 1=Normal based on previous findings)
+    # The model's calibration maps this onto a calibrated P(Faulty)
+    probability_faulty = model.calibration.probability_faulty(score)
+    
+    # Threshold from the requested operating point, the site's, or the default (0.5 uncalibrated)
+    point_name, threshold = model.calibration.resolve(operating_point, site)
+    is_faulty = probability_faulty >= threshold
+    
+    confidence = probability_faulty if is_faulty else 1 - probability_faulty
+    confidence_percent = confidence * 100
+    
+    # Confidence Level
+    if confidence_percent >= 90:
+        confidence_level = "Very High"
+    elif confidence_percent >= 75:
+        confidence_level = "High"
+    elif confidence_percent >= 60:
+        confidence_level = "Moderate"
+    else:
+        confidence_level = "Low"
+    
+    message = ("Crack detected" if is_faulty else "No crack detected") + \
+              f" with {confidence_percent:.1f}% confidence ({confidence_level})"
+    
+    # For compatibility with frontend that might expect "has_crack"
+    return {
+        'has_crack': is_faulty,
+        'confidence': round(confidence_percent, 2),
+        'confidence_level': confidence_level,
+        'message': message,
+        'probability': round(score, 4), # Raw probability of Class 1 (Normal)
+        'class': 'Faulty' if is_faulty else 'Normal',
+        'model_version': model.version,
+        'raw_score': score,
+        'probability_faulty': round(probability_faulty, 4),
+        'operating_point': point_name,
+        'threshold': round(threshold, 4)
+    }
+
+@app.middleware("http")
+async def limit_upload_size(request: Request, call_next):
+    """Reject oversized uploads from the Content-Length header, before the body is read"""
+    if request.method == "POST" and request.url.path.startswith(UPLOAD_PATHS):
+        length = request.headers.get("content-length")
+        if length is None:
+            return JSONResponse({'message': 'Content-Length required.', 'error': True}, status_code=411)
+        try:
+            length = int(length)
+            if length < 0:
+                raise ValueError(length)
+        except ValueError:
+            return JSONResponse({'message': 'Invalid Content-Length.', 'error': True}, status_code=400)
+        if length > MAX_UPLOAD_BYTES:
+            return JSONResponse(
+                {'message': f'Upload too large; limit is {MAX_UPLOAD_BYTES} bytes.', 'error': True},
+                status_code=413
+            )
+    return await call_next(request)
+
+def open_upload(file: UploadFile):
+    """
+    Open the upload lazily from its spooled temp file, without reading it
+    into a bytes object first. Only the header is parsed here, so the pixel
+    limit is checked before anything is decoded.
+    """
+    file.file.seek(0)
+    image = Image.open(file.file)
+    width, height = image.size
+    if width * height > MAX_IMAGE_PIXELS:
+        raise ValueError(f'Image is {width}x{height}; limit is {MAX_IMAGE_PIXELS} pixels.')
+    return image
+
+def scheduling_error(e):
+    """Status-coded responses for requests the scheduler refused or dropped, or that found no model"""
+    if isinstance(e, QueueFull):
+        return JSONResponse({'message': str(e), 'error': True}, status_code=503, headers={'Retry-After': '1'})
+    if isinstance(e, ModelUnavailable):
+        return JSONResponse({'message': str(e), 'error': True}, status_code=503,
+                            headers={'Retry-After': MODEL_RETRY_AFTER})
+    return JSONResponse({'message': str(e), 'error': True}, status_code=504)
+
+def record_prediction(result, timestamp=None, site=None, camera_id=None, segment=None,
+                      frame_id=None, lat=None, lon=None, odometer_m=None):
+    """Feed a verdict to defect-event aggregation and the results store"""
+    if timestamp is None:
+        timestamp = time.time()
+    if event_aggregator is not None:
+        event = event_aggregator.add(
+            timestamp, result['has_crack'], result['probability_faulty'], site, camera_id, segment,
+            frame_id, odometer_m, lat, lon, result['model_version']
+        )
+        if event is not None:
+            result['event'] = event
+    
+    if results_store is not None:
+        extra = {k: v for k, v in (('tta', result.get('tta')),
+                                   ('event_id', result.get('event', {}).get('event_id'))) if v}
+        results_store.record(
+            ts=timestamp, site=site, camera_id=camera_id, segment=segment, frame_id=frame_id,
+            lat=lat, lon=lon, odometer_m=odometer_m,
+            model_version=result['model_version'], raw_score=result['raw_score'],
+            probability_faulty=result['probability_faulty'], has_crack=int(result['has_crack']),
+            operating_point=result['operating_point'], threshold=result['threshold'],
+            extra=extra or None
+        )
+
+def wants_compact(accept):
+    """Compact binary verdicts only when the client asks for them; JSON stays the default"""
+    return bool(accept) and verdict_format.MEDIA_TYPE in accept
+
 @app.post("/upload/")
-async def upload_image(file: UploadFile = File(...)):
-    """Upload and process image for crack detection"""
+async def upload_image(file: UploadFile = File(...),
+                       operating_point: str = Query(None),
+                       site: str = Query(None),
+                       camera_id: str = Query(None),
+                       segment: str = Query(None),
+                       frame_id: str = Query(None),
+                       timestamp: float = Query(None),
+                       lat: float = Query(None),
+                       lon: float = Query(None),
+                       odometer_m: float = Query(None),
+                       priority: str = Query('interactive'),
+                       deadline_ms: float = Query(None, gt=0),
+                       accept: str = Header(None)):
+    """
+    Upload and process image for crack detection.
+    
+    operating_point (e.g. high-recall, balanced) or site selects the decision
+    threshold; both reuse the same single inference. The remaining parameters
+    (capture time as unix seconds, camera, track segment, position) are
+    stored with the verdict and used to merge consecutive detections into
+    defect events. priority (interactive or bulk) and deadline_ms control
+    scheduling; a request still queued at its deadline gets a 504.
+    
+    Accept: application/vnd.crack-verdict returns a compact binary record
+    (see verdict_format.py) instead of JSON.
+    """
     try:
         # Validate file type
         if not file.content_type or not file.content_type.startswith('image/'):
@@ -188,14 +532,24 @@ async def upload_image(file: UploadFile = File(...)):
                 'error': True
             }
         
-        # Read image
-        contents = await file.read()
-        image = Image.open(io.BytesIO(contents))
+        # Decode straight from the spooled upload
+        image = open_upload(file)
         
         # Predict crack
-        result = predict_crack(image)
+        result = await predict_crack(image, operating_point, site, priority, deadline_ms)
+        
+        if frame_id is not None:
+            result['frame_id'] = frame_id
+        record_prediction(result, timestamp, site, camera_id, segment, frame_id, lat, lon, odometer_m)
+        if frame_miner is not None:
+            frame_miner.offer(file.file, result, ts=timestamp or time.time(), site=site, camera_id=camera_id,
+                              segment=segment, frame_id=frame_id, lat=lat, lon=lon, odometer_m=odometer_m)
         
+        if wants_compact(accept):
+            return Response(verdict_format.encode_verdict(result), media_type=verdict_format.MEDIA_TYPE)
         return result
+    except (DeadlineExceeded, QueueFull, ModelUnavailable) as e:
+        return scheduling_error(e)
     except Exception as e:
         import traceback
         return {
@@ -204,5 +558,176 @@ async def upload_image(file: UploadFile = File(...)):
             'details': str(traceback.format_exc())
         }
 
+@app.post("/upload/batch/")
+async def upload_batch(files: List[UploadFile] = File(...),
+                       metadata: str = Form(None),
+                       operating_point: str = Query(None),
+                       site: str = Query(None),
+                       camera_id: str = Query(None),
+                       segment: str = Query(None),
+                       priority: str = Query('bulk'),
+                       deadline_ms: float = Query(None, gt=0),
+                       accept: str = Header(None)):
+    """
+    Several frames in one request, scheduled as bulk work by default so they
+    are batched into shared invokes. metadata is an optional JSON list with
+    one object per file (frame_id, timestamp, lat, lon, odometer_m).
+    Results come back in upload order; each is a verdict or an error, as
+    JSON or, for Accept: application/vnd.crack-verdict, as binary records.
+    """
+    try:
+        frames_meta = json.loads(metadata) if metadata else [{} for _ in files]
+        if len(frames_meta) != len(files):
+            return {'message': f'metadata has {len(frames_meta)} entries for {len(files)} files.', 'error': True}
+        
+        async def predict_one(file, meta):
+            if not file.content_type or not file.content_type.startswith('image/'):
+                return {'message': 'Invalid file type. Please upload an image.', 'error': True}
+            try:
+                result = await predict_crack(open_upload(file), operating_point, site, priority, deadline_ms)
+            except (DeadlineExceeded, QueueFull, ModelUnavailable) as e:
+                return {'message': str(e), 'error': True, 'status': 504 if isinstance(e, DeadlineExceeded) else 503}
+            except Exception as e:
+                return {'message': f'Error processing image: {str(e)}', 'error': True}
+            result['frame_id'] = meta.get('frame_id', file.filename)
+            return result
+        
+        results = await asyncio.gather(*(predict_one(f, m) for f, m in zip(files, frames_meta)))
+        # Recorded in upload order, so event aggregation sees the frames in sequence
+        for file, result, meta in zip(files, results, frames_meta):
+            if not result.get('error'):
+                record_prediction(result, meta.get('timestamp'), site, camera_id, segment, result['frame_id'],
+                                  meta.get('lat'), meta.get('lon'), meta.get('odometer_m'))
+                if frame_miner is not None:
+                    frame_miner.offer(file.file, result, ts=meta.get('timestamp') or time.time(), site=site,
+                                      camera_id=camera_id, segment=segment, frame_id=result['frame_id'],
+                                      lat=meta.get('lat'), lon=meta.get('lon'), odometer_m=meta.get('odometer_m'))
+        
+        if wants_compact(accept):
+            return Response(verdict_format.encode_batch(results), media_type=verdict_format.MEDIA_TYPE)
+        return {'results': results, 'count': len(results)}
+    except Exception as e:
+        import traceback
+        return {
+            'message': f'Error processing batch: {str(e)}',
+            'error': True,
+            'details': str(traceback.format_exc())
+        }
+
+@app.post("/explain/")
+async def explain_image(file: UploadFile = File(...),
+                        format: str = Query('png'),
+                        level: float = Query(0.5, ge=0, le=1)):
+    """
+    Grad-CAM heatmap for an image (EXPLAIN=1). format=png returns the heatmap
+    blended over the frame the model saw; format=json returns the coarse
+    heatmap, its peak and the bounding box of cells at or above level, in
+    original image pixels. Concurrent requests share one backbone pass, and
+    repeated images are answered from a cache keyed by their hash.
+    """
+    if explainer is None:
+        return {'error': True, 'message': 'Explanations are disabled; start the server with EXPLAIN=1.'}
+    if format not in ('png', 'json'):
+        return {'error': True, 'message': "format must be 'png' or 'json'."}
+    try:
+        if not file.content_type or not file.content_type.startswith('image/'):
+            return {'message': 'Invalid file type. Please upload an image.', 'error': True}
+        image = open_upload(file)
+        file.file.seek(0)
+        key = explainer.key(file.file.read())
+        
+        entry = explainer.cached(key)
+        if entry is None:
+            if not explainer.loaded:
+                await run_in_threadpool(explainer.load)
+            frame = await run_in_threadpool(explainer.prepare, image)
+            entry = await asyncio.wrap_future(explainer.submit(key, frame))
+        
+        if format == 'json':
+            return await run_in_threadpool(explainer.regions, entry, level)
+        png = await run_in_threadpool(explainer.overlay_png, entry)
+        return Response(png, media_type='image/png',
+                        headers={'X-Probability-Faulty': f"{entry['probability_faulty']:.4f}"})
+    except QueueFull as e:
+        return scheduling_error(e)
+    except Exception as e:
+        import traceback
+        return {
+            'message': f'Error explaining image: {str(e)}',
+            'error': True,
+            'details': str(traceback.format_exc())
+        }
+
+@app.get('/scheduler')
+def scheduler_status():
+    """Queue depth and latency percentiles per priority class"""
+    return inference_scheduler.status()
+
+RESULTS_PAGE_LIMIT = 1000
+
+def results_filters(start, end, site, camera_id, segment, defects_only):
+    return {'start': start, 'end': end, 'site': site, 'camera_id': camera_id,
+            'segment': segment, 'defects_only': defects_only}
+
+@app.get('/results')
+def query_results(start: float = Query(None), end: float = Query(None),
+                  site: str = Query(None), camera_id: str = Query(None), segment: str = Query(None),
+                  defects_only: bool = Query(False), cursor: str = Query(None),
+                  limit: int = Query(100, ge=1, le=RESULTS_PAGE_LIMIT)):
+    """
+    Stored predictions, oldest first, filtered by time range (unix seconds,
+    end exclusive) and location. Pass next_cursor back as cursor for the next page.
+    """
+    if results_store is None:
+        return {'error': True, 'message': 'Results store is disabled.'}
+    try:
+        results, next_cursor = results_store.query(
+            limit=limit, cursor=cursor,
+            **results_filters(start, end, site, camera_id, segment, defects_only)
+        )
+    except ValueError:
+        return JSONResponse({'error': True, 'message': 'Invalid cursor.'}, status_code=400)
+    return {'results': results, 'count': len(results), 'next_cursor': next_cursor}
+
+@app.get('/results/stream')
+def stream_results(start: float = Query(None), end: float = Query(None),
+                   site: str = Query(None), camera_id: str = Query(None), segment: str = Query(None),
+                   defects_only: bool = Query(False)):
+    """Every matching prediction as newline-delimited JSON, read from the store page by page"""
+    if results_store is None:
+        return {'error': True, 'message': 'Results store is disabled.'}
+    rows = results_store.iter_query(**results_filters(start, end, site, camera_id, segment, defects_only))
+    return StreamingResponse((json.dumps(row) + '\n' for row in rows), media_type='application/x-ndjson')
+
+@app.get('/events')
+def query_events(start: float = Query(None), end: float = Query(None),
+                 site: str = Query(None), camera_id: str = Query(None), segment: str = Query(None),
+                 cursor: str = Query(None), limit: int = Query(100, ge=1, le=RESULTS_PAGE_LIMIT)):
+    """Closed defect events, filtered on start time and location, paginated like /results"""
+    if results_store is None:
+        return {'error': True, 'message': 'Results store is disabled.'}
+    try:
+        events, next_cursor = results_store.query_events(
+            limit=limit, cursor=cursor, start=start, end=end, site=site, camera_id=camera_id, segment=segment
+        )
+    except ValueError:
+        return JSONResponse({'error': True, 'message': 'Invalid cursor.'}, status_code=400)
+    return {'events': events, 'count': len(events), 'next_cursor': next_cursor}
+
+def start_services():
+    """Initial load, once everything the warm-up path needs is defined"""
+    open_results_store()
+    start_event_aggregation()
+    start_frame_mining()
+    inference_scheduler.start()
+    load_prediction_model()
+
 if __name__ == '__main__':
-    uvicorn.run(app, host='0.0.0.0', port=8080)
+    if WORKERS > 1:
+        # Workers are spawned, not forked, so each one loads its own
+        # interpreters (TensorFlow isn't fork-safe) over the shared mapping.
+        # Importing TensorFlow alone outlasts uvicorn's 5 s worker health check
+        uvicorn.run('app:app', host='0.0.0.0', port=8080, workers=WORKERS,
+                    timeout_worker_healthcheck=WORKER_HEALTHCHECK_TIMEOUT)
+    else:
+        uvicorn.run(app, host='0.0.0.0', port=8080)
@@ -0,0 +1,189 @@
+"""
+Throughput and memory benchmark for multi-worker serving.
+
+For each worker count, starts `uvicorn app:app --workers N` on a local port,
+waits for /ready, drives /upload/ from concurrent clients for a fixed time and
+records requests/s, latency percentiles and the memory of the whole process
+tree. RSS counts shared pages once per process; PSS splits them between the
+processes sharing them, so the PSS total is the real footprint and shows
+whether the memory-mapped model is actually shared. Linux only (/proc).
+
+Usage:
+    python benchmark_workers.py --max-workers 4 [--shared-weights] [--duration 30]
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import subprocess
+import threading
+import numpy as np
+import requests
+
+DEFAULT_IMAGE = os.path.join('data', 'processed', 'test', 'Faulty', 'cracked_bing_16.jpg')
+
+
+def process_tree(root_pid):
+    """root_pid plus all of its descendants"""
+    children = {}
+    for entry in os.listdir('/proc'):
+        if not entry.isdigit():
+            continue
+        try:
+            with open(f'/proc/{entry}/stat') as f:
+                # ppid is the 2nd field after the parenthesised command name
+                ppid = int(f.read().rsplit(')', 1)[1].split()[1])
+        except (OSError, IndexError, ValueError):
+            continue
+        children.setdefault(ppid, []).append(int(entry))
+
+    pids, stack = [], [root_pid]
+    while stack:
+        pid = stack.pop()
+        pids.append(pid)
+        stack.extend(children.get(pid, []))
+    return pids
+
+
+def memory_mb(pids):
+    """Summed RSS and PSS (MB) over a set of processes"""
+    rss = pss = 0
+    for pid in pids:
+        try:
+            with open(f'/proc/{pid}/smaps_rollup') as f:
+                for line in f:
+                    if line.startswith('Rss:'):
+                        rss += int(line.split()[1])
+                    elif line.startswith('Pss:'):
+                        pss += int(line.split()[1])
+        except OSError:
+            continue
+    return rss / 1024, pss / 1024
+
+
+def wait_ready(base_url, workers, timeout):
+    """Wait until /ready answers 200 several times in a row, so every worker is warm"""
+    deadline = time.time() + timeout
+    streak = 0
+    while time.time() < deadline:
+        try:
+            ok = requests.get(f'{base_url}/ready', timeout=2).status_code == 200
+        except requests.RequestException:
+            ok = False
+        streak = streak + 1 if ok else 0
+        if streak >= workers * 3:
+            return True
+        time.sleep(0.2)
+    return False
+
+
+def drive_load(base_url, image_bytes, concurrency, duration):
+    latencies, errors = [], 0
+    lock = threading.Lock()
+    stop_at = time.time() + duration
+
+    def client():
+        nonlocal errors
+        session = requests.Session()
+        while time.time() < stop_at:
+            start = time.perf_counter()
+            try:
+                r = session.post(f'{base_url}/upload/',
+                                 files={'file': ('frame.jpg', image_bytes, 'image/jpeg')}, timeout=30)
+                failed = r.status_code != 200 or r.json().get('error')
+            except requests.RequestException:
+                failed = True
+            elapsed = (time.perf_counter() - start) * 1000
+            with lock:
+                if failed:
+                    errors += 1
+                else:
+                    latencies.append(elapsed)
+
+    threads = [threading.Thread(target=client) for _ in range(concurrency)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    return latencies, errors
+
+
+def run(workers, args, image_bytes):
+    port = args.port
+    base_url = f'http://127.0.0.1:{port}'
+    env = dict(os.environ, WEB_CONCURRENCY=str(workers), SHARED_WEIGHTS='1' if args.shared_weights else '0')
+    server = subprocess.Popen(
+        [sys.executable, '-m', 'uvicorn', 'app:app', '--host', '127.0.0.1', '--port', str(port),
+         '--workers', str(workers), '--timeout-worker-healthcheck', '60', '--log-level', 'warning'],
+        env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+    )
+    try:
+        if not wait_ready(base_url, workers, args.startup_timeout):
+            print(f"❌ Server with {workers} workers never became ready")
+            return None
+
+        idle_rss, idle_pss = memory_mb(process_tree(server.pid))
+        concurrency = args.concurrency or workers * 2
+        latencies, errors = drive_load(base_url, image_bytes, concurrency, args.duration)
+        rss, pss = memory_mb(process_tree(server.pid))
+
+        return {
+            'workers': workers,
+            'concurrency': concurrency,
+            'requests': len(latencies),
+            'errors': errors,
+            'throughput_rps': round(len(latencies) / args.duration, 2),
+            'latency_p50_ms': round(float(np.percentile(latencies, 50)), 1) if latencies else None,
+            'latency_p95_ms': round(float(np.percentile(latencies, 95)), 1) if latencies else None,
+            'idle_rss_mb': round(idle_rss, 1),
+            'idle_pss_mb': round(idle_pss, 1),
+            'loaded_rss_mb': round(rss, 1),
+            'loaded_pss_mb': round(pss, 1),
+        }
+    finally:
+        server.terminate()
+        try:
+            server.wait(timeout=30)
+        except subprocess.TimeoutExpired:
+            server.kill()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark throughput and memory against worker count")
+    parser.add_argument('--max-workers', type=int, default=os.cpu_count() or 1)
+    parser.add_argument('--duration', type=float, default=30.0, help="Seconds of load per worker count")
+    parser.add_argument('--concurrency', type=int, help="Concurrent clients (default: 2 per worker)")
+    parser.add_argument('--image', default=DEFAULT_IMAGE)
+    parser.add_argument('--port', type=int, default=8091)
+    parser.add_argument('--shared-weights', action='store_true',
+                        help="Run workers with SHARED_WEIGHTS=1 (no XNNPACK weight repacking)")
+    parser.add_argument('--startup-timeout', type=float, default=300.0)
+    parser.add_argument('--output', default='bench_workers.json')
+    args = parser.parse_args()
+
+    with open(args.image, 'rb') as f:
+        image_bytes = f.read()
+
+    results = []
+    for workers in range(1, args.max_workers + 1):
+        print(f"Benchmarking {workers} worker(s)...")
+        result = run(workers, args, image_bytes)
+        if result:
+            results.append(result)
+
+    print(f"\n{'Workers':>7} {'Req/s':>8} {'p50 ms':>8} {'p95 ms':>8} {'Errors':>7} "
+          f"{'RSS MB':>9} {'PSS MB':>9} {'PSS/worker':>11}")
+    print("-" * 75)
+    for r in results:
+        print(f"{r['workers']:>7} {r['throughput_rps']:>8.1f} {r['latency_p50_ms'] or 0:>8.1f} "
+              f"{r['latency_p95_ms'] or 0:>8.1f} {r['errors']:>7} {r['loaded_rss_mb']:>9.1f} "
+              f"{r['loaded_pss_mb']:>9.1f} {r['loaded_pss_mb'] / r['workers']:>11.1f}")
+
+    with open(args.output, 'w') as f:
+        json.dump({'shared_weights': args.shared_weights, 'results': results}, f, indent=2)
+    print(f"\nResults written to {args.output}")
+
+
+if __name__ == '__main__':
+    main()
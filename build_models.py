@@ -0,0 +1,283 @@
+"""
+Reproducible TFLite builds, gated on latency and accuracy.
+
+Every configured variant (float, dynamic, int8, fp16; see
+convert_to_tflite.TFLITE_VARIANTS) is converted from one Keras source. Each
+conversion is cached in models/build_cache under a key made from:
+- the source weights' SHA-256
+- the variant's converter settings
+- the TensorFlow version
+- for int8, the calibration images and the preprocessing settings
+
+So a rebuild with unchanged inputs loads nothing and converts nothing.
+
+A fresh artifact then has to pass a gate before it replaces the variant's
+served file:
+- median batch-1 latency within --max-latency-ms
+- accuracy on data/processed/test at P(Faulty) >= 0.5 of at least
+  --min-accuracy
+
+Accuracy scores come from evaluate.cached_scores, so an artifact is only
+scored once. When an artifact fails, the file already in place stays. When
+one is promoted over a file that has a calibration.json fitted for it, the
+calibration is refitted on the validation split for the new file.
+models/build_manifest.json records, for every variant: the cache key,
+hashes, size, measured latency and accuracy, the gate, and whether the
+artifact was promoted.
+
+Usage:
+    python build_models.py [--source models/best_model.h5] [--variants float,dynamic,int8,fp16]
+                           [--max-latency-ms 500] [--min-accuracy 0.9] [--force]
+"""
+import os
+import json
+import shutil
+import hashlib
+import argparse
+from datetime import datetime, timezone
+
+import evaluate
+import inference_backends
+from calibration import VALIDATION_DIR, Calibration, calibration_path, refit
+from convert_to_tflite import MODEL_PATH, TFLITE_VARIANTS
+
+CACHE_DIR = os.path.join('models', 'build_cache')
+MANIFEST_PATH = os.path.join('models', 'build_manifest.json')
+CALIBRATION_DIR = os.path.join('data', 'processed', 'train')
+
+# Where each variant is served from once promoted; dynamic is what convert_to_tflite.py has always written
+OUTPUTS = {
+    'float': os.path.join('models', 'model_float.tflite'),
+    'dynamic': os.path.join('models', 'model.tflite'),
+    'int8': os.path.join('models', 'model_int8.tflite'),
+    'fp16': os.path.join('models', 'model_fp16.tflite'),
+}
+
+MAX_LATENCY_MS = float(os.getenv('BUILD_MAX_LATENCY_MS', '500'))
+MIN_ACCURACY = float(os.getenv('BUILD_MIN_ACCURACY', '0.9'))
+CALIBRATION_IMAGES = 200
+
+
+def calibration_paths(data_dir=CALIBRATION_DIR, limit=CALIBRATION_IMAGES):
+    """An even spread of training images over both classes, for int8 calibration"""
+    paths, _ = evaluate.dataset_files(data_dir)
+    return paths[::max(1, len(paths) // limit)][:limit]
+
+
+def cache_key(source_hash, variant, calibration=()):
+    """Changes when anything that affects the converted bytes changes"""
+    import tensorflow as tf
+    inputs = {
+        'source_sha256': source_hash,
+        'variant': variant,
+        'converter': TFLITE_VARIANTS[variant],
+        'tensorflow': tf.__version__,
+    }
+    if TFLITE_VARIANTS[variant].get('int8_ops'):
+        # dataset_hash also covers RAIL_ROI, which changes the calibration inputs
+        inputs['calibration'] = evaluate.dataset_hash(calibration)
+    return hashlib.sha256(json.dumps(inputs, sort_keys=True).encode()).hexdigest()
+
+
+class _SourceModel:
+    """The Keras source, loaded on first use so fully cached builds never load it"""
+
+    def __init__(self, path):
+        self.path = path
+        self._model = None
+
+    def get(self):
+        if self._model is None:
+            from convert_to_tflite import load_keras_model
+            print(f"Loading Keras model from {self.path}...")
+            self._model = load_keras_model(self.path)
+        return self._model
+
+
+def build_variant(source, source_hash, variant, calibration=(), cache_dir=CACHE_DIR, force=False):
+    """(artifact path, cache key, cached) for one variant, converting only on a cache miss"""
+    from convert_to_tflite import convert_tflite
+    key = cache_key(source_hash, variant, calibration)
+    path = os.path.join(cache_dir, f"{variant}-{key[:16]}.tflite")
+    if os.path.exists(path) and not force:
+        print(f"✅ {variant}: inputs unchanged, using {path}")
+        return path, key, True
+
+    print(f"Converting {variant}...")
+    flatbuffer = convert_tflite(source.get(), variant, calibration)
+    os.makedirs(cache_dir, exist_ok=True)
+    tmp = path + '.tmp'
+    with open(tmp, 'wb') as f:
+        f.write(flatbuffer)
+    os.replace(tmp, path)
+    print(f"✅ {variant}: {len(flatbuffer) / (1024 * 1024):.2f} MB written to {path}")
+    return path, key, False
+
+
+def gate(path, max_latency_ms, min_accuracy, data_dir=evaluate.TEST_DIR, num_threads=None, runs=20):
+    """Latency and accuracy of one artifact, and the reasons it fails the gate (empty when it passes)"""
+    backend = inference_backends.TFLiteBackend(path, num_threads=num_threads)
+    latency = inference_backends.benchmark(backend, runs)
+    scores, labels, _, _ = evaluate.cached_scores(path, data_dir)
+    at_half = evaluate.threshold_metrics(1.0 - scores, labels, [0.5])
+    accuracy = float(at_half['accuracy'][0])
+    curve = evaluate.curves(1.0 - scores, labels)
+
+    failures = []
+    if latency > max_latency_ms:
+        failures.append(f"latency {latency:.1f} ms > {max_latency_ms:g} ms")
+    if accuracy < min_accuracy:
+        failures.append(f"accuracy {accuracy:.4f} < {min_accuracy:g}")
+    return {
+        'latency_ms': round(latency, 3),
+        'accuracy': round(accuracy, 4),
+        'f1': round(float(at_half['f1'][0]), 4),
+        'auc_roc': round(curve['auc_roc'], 4),
+        'images': int(len(labels)),
+    }, failures
+
+
+def promote(path, output):
+    """Copy an artifact into place atomically; False when the same bytes are already there"""
+    replaced = evaluate.artifact_hash(output) if os.path.exists(output) else None
+    if replaced == evaluate.artifact_hash(path):
+        return False
+    tmp = output + '.tmp'
+    shutil.copyfile(path, tmp)
+    os.replace(tmp, output)
+    refresh_calibration(output, replaced)
+    return True
+
+
+def refresh_calibration(output, replaced_hash, data_dir=VALIDATION_DIR):
+    """
+    Refit the calibration.json that was fitted for the file just replaced, so
+    its thresholds follow the new model; removed if it can't be refitted
+    """
+    path = calibration_path(output)
+    if not os.path.exists(path):
+        return
+    previous = Calibration.load(path)
+    # Fitted for another file in the same directory, e.g. the dynamic variant next to int8
+    if not previous.model_sha256 or previous.model_sha256 != replaced_hash:
+        return
+    try:
+        refitted, model_hash, labels = refit(output, previous, data_dir)
+    except Exception as e:
+        os.remove(path)
+        print(f"⚠️  Removed {path}, which was fitted for the replaced model ({e}); "
+              f"re-run calibration.py --model {output}")
+        return
+    refitted.save(path, model_sha256=model_hash, fitted_on=data_dir, samples=len(labels))
+    print(f"✅ Calibration refitted for {output} on {data_dir}")
+
+
+def load_manifest(manifest_path=MANIFEST_PATH):
+    if not os.path.exists(manifest_path):
+        return {'variants': {}}
+    with open(manifest_path) as f:
+        return json.load(f)
+
+
+def save_manifest(manifest, manifest_path=MANIFEST_PATH):
+    tmp = manifest_path + '.tmp'
+    with open(tmp, 'w') as f:
+        json.dump(manifest, f, indent=2)
+    os.replace(tmp, manifest_path)
+
+
+def build(source_path=MODEL_PATH, variants=tuple(OUTPUTS), max_latency_ms=MAX_LATENCY_MS,
+          min_accuracy=MIN_ACCURACY, data_dir=evaluate.TEST_DIR, num_threads=None, runs=20,
+          calibration_images=CALIBRATION_IMAGES, force=False, manifest_path=MANIFEST_PATH):
+    """Build, gate and promote every variant; returns the manifest entries for this run"""
+    source_hash = evaluate.artifact_hash(source_path)
+    source = _SourceModel(source_path)
+    calibration = ()
+    if any(TFLITE_VARIANTS[v].get('int8_ops') for v in variants):
+        calibration = calibration_paths(limit=calibration_images)
+
+    manifest = load_manifest(manifest_path)
+    results = {}
+    for variant in variants:
+        path, key, cached = build_variant(source, source_hash, variant, calibration, force=force)
+        metrics, failures = gate(path, max_latency_ms, min_accuracy, data_dir, num_threads, runs)
+        output = OUTPUTS[variant]
+        promoted = not failures and promote(path, output)
+        if failures:
+            print(f"❌ {variant} not promoted: {'; '.join(failures)}")
+        elif promoted:
+            print(f"✅ {variant} promoted to {output}")
+        else:
+            print(f"✅ {variant}: {output} already up to date")
+
+        results[variant] = {
+            'artifact': path,
+            'sha256': evaluate.artifact_hash(path),
+            'size_bytes': os.path.getsize(path),
+            'cache_key': key,
+            'cached': cached,
+            'converter': TFLITE_VARIANTS[variant],
+            'calibration_images': len(calibration) if TFLITE_VARIANTS[variant].get('int8_ops') else 0,
+            **metrics,
+            'gate': {'max_latency_ms': max_latency_ms, 'min_accuracy': min_accuracy,
+                     'threshold': 0.5, 'data_dir': data_dir, 'runs': runs, 'num_threads': num_threads},
+            'passed': not failures,
+            'failures': failures,
+            'output': output,
+            'promoted': promoted,
+            'built_at': datetime.now(timezone.utc).isoformat(),
+            # What is actually being served, which a rejected build leaves as it was
+            'serving_sha256': evaluate.artifact_hash(output) if os.path.exists(output) else None,
+        }
+
+    manifest.update({'source': source_path, 'source_sha256': source_hash})
+    manifest['variants'].update(results)
+    save_manifest(manifest, manifest_path)
+    print(f"✅ Manifest written to {manifest_path}")
+    return results
+
+
+def print_summary(results):
+    print(f"\n{'Variant':<9} {'Size MB':>8} {'Latency ms':>11} {'Accuracy':>9} {'AUC':>7}  Result")
+    print("-" * 62)
+    for variant, r in results.items():
+        status = ('promoted' if r['promoted'] else 'up to date') if r['passed'] else 'rejected'
+        print(f"{variant:<9} {r['size_bytes'] / (1024 * 1024):>8.2f} {r['latency_ms']:>11.2f} "
+              f"{r['accuracy']:>9.2%} {r['auc_roc']:>7.4f}  {'✅' if r['passed'] else '❌'} {status}"
+              f"{' (cached)' if r['cached'] else ''}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Build, gate and promote TFLite model variants")
+    parser.add_argument('--source', default=MODEL_PATH, help="Keras .h5 model to convert")
+    parser.add_argument('--variants', default=','.join(OUTPUTS),
+                        help=f"Comma-separated variants: {', '.join(TFLITE_VARIANTS)}")
+    parser.add_argument('--max-latency-ms', type=float, default=MAX_LATENCY_MS,
+                        help="Median batch-1 latency budget (env BUILD_MAX_LATENCY_MS)")
+    parser.add_argument('--min-accuracy', type=float, default=MIN_ACCURACY,
+                        help="Accuracy floor on the test split at P(Faulty) >= 0.5 (env BUILD_MIN_ACCURACY)")
+    parser.add_argument('--data-dir', default=evaluate.TEST_DIR)
+    parser.add_argument('--threads', type=int, default=None, help="Interpreter threads for the latency check")
+    parser.add_argument('--runs', type=int, default=20, help="Timed runs for the latency check")
+    parser.add_argument('--calibration-images', type=int, default=CALIBRATION_IMAGES)
+    parser.add_argument('--force', action='store_true', help="Convert even when a cached artifact exists")
+    parser.add_argument('--manifest', default=MANIFEST_PATH)
+    args = parser.parse_args()
+
+    variants = tuple(v.strip() for v in args.variants.split(',') if v.strip())
+    unknown = [v for v in variants if v not in TFLITE_VARIANTS]
+    if unknown:
+        parser.error(f"Unknown variant(s): {', '.join(unknown)}")
+    if not os.path.exists(args.source):
+        print(f"❌ Model file not found: {args.source}")
+        exit(1)
+
+    results = build(args.source, variants, args.max_latency_ms, args.min_accuracy, args.data_dir,
+                    args.threads, args.runs, args.calibration_images, args.force, args.manifest)
+    print_summary(results)
+    if not all(r['passed'] for r in results.values()):
+        exit(1)
+
+
+if __name__ == '__main__':
+    main()
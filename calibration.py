@@ -0,0 +1,240 @@
+"""
+Score calibration and named operating points.
+
+The model outputs a raw score, P(Normal). Calibration maps the derived
+P(Faulty) = 1 - score onto a calibrated probability, using a Platt or
+isotonic fit on data/processed/validation. Operating points are thresholds
+on the calibrated probability, such as high-recall or balanced. Applying them
+costs a few arithmetic operations per request, so any point can be selected
+per request or per site without another invoke.
+
+A calibration.json sits next to the model it was fitted for
+(models/calibration.json for models/model.tflite, or
+models/registry/<v>/calibration.json) and records that model's SHA-256. A
+calibration whose hash doesn't match the model file (the model was rebuilt in
+place after fitting) is ignored with a warning. Without one, the server falls
+back to models/optimal_threshold.npy if present, and otherwise to the fixed 0.5.
+
+Usage:
+    python calibration.py [--model models/model.tflite] [--method platt|isotonic]
+                          [--target-recall 0.95] [--site depot-a=high-recall]
+"""
+import os
+import json
+import numpy as np
+
+DEFAULT_POINT = 'default'
+LEGACY_THRESHOLD_PATH = os.path.join('models', 'optimal_threshold.npy')
+VALIDATION_DIR = os.path.join('data', 'processed', 'validation')
+CLASSES = ('Faulty', 'Normal')
+
+
+def _logit(p):
+    p = np.clip(p, 1e-6, 1 - 1e-6)
+    return np.log(p) - np.log(1 - p)
+
+
+class Calibration:
+    def __init__(self, method='identity', params=None, operating_points=None,
+                 default_point=DEFAULT_POINT, sites=None, source=None, model_sha256=None):
+        self.method = method
+        self.params = params or {}
+        self.operating_points = operating_points or {DEFAULT_POINT: {'threshold': 0.5}}
+        self.default_point = default_point
+        self.sites = sites or {}
+        self.source = source
+        # Hash of the model file this was fitted for, when known
+        self.model_sha256 = model_sha256
+
+    def probability_faulty(self, raw_score):
+        """Calibrated P(Faulty) from the raw model score, P(Normal)"""
+        p = 1.0 - raw_score
+        if self.method == 'platt':
+            return float(1.0 / (1.0 + np.exp(-(self.params['a'] * _logit(p) + self.params['b']))))
+        if self.method == 'isotonic':
+            return float(np.interp(p, self.params['x'], self.params['y']))
+        return float(p)
+
+    def resolve(self, operating_point=None, site=None):
+        """(name, threshold) for an explicit point, else the site's point, else the default"""
+        name = operating_point or self.sites.get(site) or self.default_point
+        if name not in self.operating_points:
+            raise ValueError(f"Unknown operating point '{name}'; "
+                             f"available: {', '.join(sorted(self.operating_points))}")
+        return name, self.operating_points[name]['threshold']
+
+    def to_dict(self):
+        return {
+            'method': self.method,
+            'params': self.params,
+            'operating_points': self.operating_points,
+            'default_point': self.default_point,
+            'sites': self.sites,
+        }
+
+    def save(self, path, **extra):
+        with open(path, 'w') as f:
+            json.dump(dict(self.to_dict(), **extra), f, indent=2)
+
+    @classmethod
+    def load(cls, path):
+        with open(path) as f:
+            data = json.load(f)
+        return cls(data['method'], data.get('params'), data.get('operating_points'),
+                   data.get('default_point', DEFAULT_POINT), data.get('sites'), source=path,
+                   model_sha256=data.get('model_sha256'))
+
+    @classmethod
+    def for_model(cls, model_path):
+        """Calibration for a model file, with the legacy fallbacks"""
+        path = calibration_path(model_path)
+        if os.path.exists(path):
+            calibration = cls.load(path)
+            if calibration.model_sha256 and os.path.exists(model_path):
+                from evaluate import artifact_hash
+                model_hash = artifact_hash(model_path)
+                if model_hash != calibration.model_sha256:
+                    print(f"⚠️  {path} was fitted for another model (sha256 {calibration.model_sha256[:12]}, "
+                          f"{model_path} is {model_hash[:12]}); using uncalibrated scores. "
+                          f"Re-run calibration.py --model {model_path}")
+                    return cls()
+            return calibration
+        if os.path.exists(LEGACY_THRESHOLD_PATH):
+            # railway_inference.py applies optimal_threshold.npy to P(crack)
+            threshold = float(np.load(LEGACY_THRESHOLD_PATH))
+            return cls(operating_points={DEFAULT_POINT: {'threshold': threshold}},
+                       source=LEGACY_THRESHOLD_PATH)
+        return cls()
+
+
+def calibration_path(model_path):
+    return os.path.join(os.path.dirname(model_path) or '.', 'calibration.json')
+
+
+# ----------------------------------------------------------------------------
+# Offline fitting
+# ----------------------------------------------------------------------------
+
+def fit_platt(p_faulty, labels):
+    from sklearn.linear_model import LogisticRegression
+    lr = LogisticRegression(C=1e4)
+    lr.fit(_logit(p_faulty).reshape(-1, 1), labels)
+    return {'a': float(lr.coef_[0][0]), 'b': float(lr.intercept_[0])}
+
+
+def fit_isotonic(p_faulty, labels):
+    from sklearn.isotonic import IsotonicRegression
+    iso = IsotonicRegression(y_min=0.0, y_max=1.0, out_of_bounds='clip')
+    iso.fit(p_faulty, labels)
+    return {'x': iso.X_thresholds_.tolist(), 'y': iso.y_thresholds_.tolist()}
+
+
+def threshold_sweep(probs, labels):
+    """Precision / recall / F1 at every distinct threshold, vectorised"""
+    order = np.argsort(-probs)
+    sorted_probs, sorted_labels = probs[order], labels[order]
+    tp = np.cumsum(sorted_labels)
+    fp = np.cumsum(1 - sorted_labels)
+    # Keep the last index of each run of equal scores
+    last = np.r_[np.nonzero(np.diff(sorted_probs))[0], len(sorted_probs) - 1]
+    tp, fp, thresholds = tp[last], fp[last], sorted_probs[last]
+
+    positives = max(int(labels.sum()), 1)
+    precision = tp / np.maximum(tp + fp, 1)
+    recall = tp / positives
+    f1 = 2 * precision * recall / np.maximum(precision + recall, 1e-12)
+    return thresholds, precision, recall, f1
+
+
+def operating_points(probs, labels, target_recall=0.95, target_precision=0.95):
+    """Named thresholds on calibrated P(Faulty); a frame is Faulty when p >= threshold"""
+    thresholds, precision, recall, f1 = threshold_sweep(probs, labels)
+
+    def point(i):
+        return {'threshold': float(thresholds[i]), 'precision': round(float(precision[i]), 4),
+                'recall': round(float(recall[i]), 4), 'f1': round(float(f1[i]), 4)}
+
+    points = {DEFAULT_POINT: {'threshold': 0.5}, 'balanced': point(int(np.argmax(f1)))}
+
+    # Highest threshold still meeting the recall target (fewest false alarms)
+    meets_recall = np.nonzero(recall >= target_recall)[0]
+    points['high-recall'] = point(int(meets_recall[0]) if len(meets_recall) else len(thresholds) - 1)
+    points['high-recall']['target_recall'] = target_recall
+
+    meets_precision = np.nonzero(precision >= target_precision)[0]
+    if len(meets_precision):
+        points['high-precision'] = point(int(meets_precision[-1]))
+        points['high-precision']['target_precision'] = target_precision
+    return points
+
+
+def fit(model_path, data_dir=VALIDATION_DIR, method='platt', target_recall=0.95, target_precision=0.95):
+    """(calibration, model hash, labels) fitted on data_dir; scores come from the evaluate.py cache"""
+    from evaluate import cached_scores
+    scores, labels, _, model_hash = cached_scores(model_path, data_dir)
+    p_faulty = 1.0 - scores
+    params = fit_platt(p_faulty, labels) if method == 'platt' else fit_isotonic(p_faulty, labels)
+    calibration = Calibration(method, params, model_sha256=model_hash)
+    calibrated = np.array([calibration.probability_faulty(s) for s in scores])
+    calibration.operating_points = operating_points(calibrated, labels, target_recall, target_precision)
+    return calibration, model_hash, labels
+
+
+def refit(model_path, previous, data_dir=VALIDATION_DIR):
+    """Fit previous's method and targets again for a new model file, keeping its sites and default point"""
+    points = previous.operating_points
+    calibration, model_hash, labels = fit(
+        model_path, data_dir, previous.method if previous.method in ('platt', 'isotonic') else 'platt',
+        points.get('high-recall', {}).get('target_recall', 0.95),
+        points.get('high-precision', {}).get('target_precision', 0.95))
+    calibration.sites = dict(previous.sites)
+    if previous.default_point in calibration.operating_points:
+        calibration.default_point = previous.default_point
+    return calibration, model_hash, labels
+
+
+def main():
+    import argparse
+    parser = argparse.ArgumentParser(description="Fit score calibration and operating points")
+    parser.add_argument('--model', default=os.path.join('models', 'model.tflite'))
+    parser.add_argument('--data-dir', default=VALIDATION_DIR)
+    parser.add_argument('--method', choices=['platt', 'isotonic'], default='platt')
+    parser.add_argument('--target-recall', type=float, default=0.95)
+    parser.add_argument('--target-precision', type=float, default=0.95)
+    parser.add_argument('--default-point', default='balanced')
+    parser.add_argument('--site', action='append', default=[], metavar='SITE=POINT',
+                        help="Pin a site to an operating point (repeatable)")
+    parser.add_argument('--output', help="Defaults to calibration.json next to the model")
+    args = parser.parse_args()
+
+    output = args.output or calibration_path(args.model)
+    # Scores are shared with evaluate.py, so a model scores each split only once
+    calibration, model_hash, labels = fit(args.model, args.data_dir, args.method, args.target_recall,
+                                          args.target_precision)
+    print(f"{len(labels)} images ({int(labels.sum())} Faulty, {int(len(labels) - labels.sum())} Normal)")
+
+    # Keep site assignments from an earlier calibration of this model
+    if os.path.exists(output):
+        calibration.sites = Calibration.load(output).sites
+    for assignment in args.site:
+        site, point = assignment.split('=', 1)
+        calibration.sites[site] = point
+    for site, point in calibration.sites.items():
+        if point not in calibration.operating_points:
+            print(f"⚠️  Site {site} uses unknown operating point {point}")
+
+    if args.default_point in calibration.operating_points:
+        calibration.default_point = args.default_point
+
+    print(f"\n{'Operating point':<16} {'Threshold':>10} {'Precision':>10} {'Recall':>8} {'F1':>8}")
+    print("-" * 56)
+    for name, p in calibration.operating_points.items():
+        print(f"{name:<16} {p['threshold']:>10.4f} {p.get('precision', float('nan')):>10.4f} "
+              f"{p.get('recall', float('nan')):>8.4f} {p.get('f1', float('nan')):>8.4f}")
+
+    calibration.save(output, model_sha256=model_hash, fitted_on=args.data_dir, samples=len(labels))
+    print(f"\n✅ Calibration written to {output} (default point: {calibration.default_point})")
+
+
+if __name__ == '__main__':
+    main()
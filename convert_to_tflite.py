@@ -1,11 +1,24 @@
 import tensorflow as tf
 import os
 import numpy as np
+import tensorflow.keras.backend as K
 
 # Define custom objects needed for loading
 def focal_loss(gamma=2.0, alpha=0.25):
+    """Focal loss - must match training definition"""
     def focal_loss_fixed(y_true, y_pred):
-        return tf.reduce_mean(-y_true * tf.math.log(y_pred + 1e-7))
+        epsilon = K.epsilon()
+        y_pred = K.clip(y_pred, epsilon, 1.0 - epsilon)
+        
+        cross_entropy = -y_true * K.log(y_pred)
+        weight = alpha * y_true * K.pow((1 - y_pred), gamma)
+        
+        cross_entropy_neg = -(1 - y_true) * K.log(1 - y_pred)
+        weight_neg = (1 - alpha) * (1 - y_true) * K.pow(y_pred, gamma)
+        
+        loss = weight * cross_entropy + weight_neg * cross_entropy_neg
+        return K.mean(loss)
+    
     return focal_loss_fixed
 
 @tf.keras.utils.register_keras_serializable(package="Custom")
@@ -25,48 +38,158 @@ class CustomScaleLayer(tf.keras.layers.Layer):
         config.update({'scale': self.scale, 'offset': self.offset})
         return config
 
-model_path = 'models/best_model.h5'
-tflite_path = 'models/model.tflite'
-
-print(f"Loading Keras model from {model_path}...")
+MODEL_PATH = 'models/best_model.h5'
+TFLITE_PATH = 'models/model.tflite'
+FORMATS = ('tflite', 'onnx', 'openvino')
+ONNX_OPSET = 17
 
-if not os.path.exists(model_path):
-    print("❌ Model file not found!")
-    exit(1)
+# TFLite converter settings per variant. Every variant keeps float32 input and
+# output, so all of them are drop-in replacements for models/model.tflite.
+TFLITE_VARIANTS = {
+    'float': {'optimize': False},
+    'dynamic': {'optimize': True},  # int8 weights, float activations
+    'int8': {'optimize': True, 'int8_ops': True},  # int8 weights and activations, calibrated
+    'fp16': {'optimize': True, 'float16': True},
+}
 
-try:
+def load_keras_model(model_path=MODEL_PATH, compile=True):
+    """Load a trained Keras model with the custom objects it was saved with"""
     custom_objects = {
         'focal_loss_fixed': focal_loss(gamma=2.0, alpha=0.25),
         'CustomScaleLayer': CustomScaleLayer
     }
-    
-    # Load Keras model
-    model = tf.keras.models.load_model(model_path, custom_objects=custom_objects)
-    print("✅ Model loaded successfully.")
+    return tf.keras.models.load_model(model_path, custom_objects=custom_objects, compile=compile)
+
+def export_onnx(model, onnx_path, opset=ONNX_OPSET):
+    """ONNX export with a dynamic batch dimension, for the onnxruntime backend"""
+    import tf2onnx
+    spec = (tf.TensorSpec((None, *model.input_shape[1:]), tf.float32, name='input'),)
+    tf2onnx.convert.from_keras(model, input_signature=spec, opset=opset, output_path=onnx_path)
+
+def export_openvino(model, xml_path):
+    """OpenVINO IR (.xml + .bin) converted straight from the Keras model, kept in FP32"""
+    import openvino as ov
+    ov_model = ov.convert_model(model, input=[(1, *model.input_shape[1:])])
+    ov.save_model(ov_model, xml_path, compress_to_fp16=False)
+
+def representative_dataset(paths):
+    """Calibration samples for full-integer quantization, preprocessed exactly as served"""
+    from PIL import Image
+    from preprocessing import TARGET_SIZE, preprocess_image
 
-    # Convert to TFLite
-    print("Converting to TFLite...")
+    def generator():
+        sample = np.zeros((1,) + TARGET_SIZE + (3,), dtype=np.float32)
+        for path in paths:
+            with Image.open(path) as img:
+                preprocess_image(img, out=sample)
+            yield [sample]
+    return generator
+
+def convert_tflite(model, variant='dynamic', calibration_paths=()):
+    """TFLite flatbuffer bytes for one of TFLITE_VARIANTS"""
+    config = TFLITE_VARIANTS[variant]
     converter = tf.lite.TFLiteConverter.from_keras_model(model)
-    
-    # Optional: Optimizations
-    converter.optimizations = [tf.lite.Optimize.DEFAULT]
-    
-    tflite_model = converter.convert()
+    if config.get('optimize'):
+        converter.optimizations = [tf.lite.Optimize.DEFAULT]
+    if config.get('float16'):
+        converter.target_spec.supported_types = [tf.float16]
+    if config.get('int8_ops'):
+        if not calibration_paths:
+            raise ValueError("The int8 variant needs calibration images")
+        converter.representative_dataset = representative_dataset(calibration_paths)
+        converter.target_spec.supported_ops = [tf.lite.OpsSet.TFLITE_BUILTINS_INT8]
+    return converter.convert()
 
-    # Save
-    with open(tflite_path, 'wb') as f:
-        f.write(tflite_model)
-    
-    print(f"✅ TFLite model saved to {tflite_path}")
-    
-    # Size comparison
-    k_size = os.path.getsize(model_path) / (1024 * 1024)
-    t_size = os.path.getsize(tflite_path) / (1024 * 1024)
-    print(f"Original Size: {k_size:.2f} MB")
-    print(f"TFLite Size:   {t_size:.2f} MB")
-    print(f"Reduction:     {(1 - t_size/k_size)*100:.1f}%")
-
-except Exception as e:
-    print(f"❌ Error during conversion: {e}")
-    import traceback
-    traceback.print_exc()
+def convert_model(model_path=MODEL_PATH, tflite_path=TFLITE_PATH, optimize=True, formats=('tflite',)):
+    """
+    Convert a Keras .h5 model to TFLite and, optionally, ONNX / OpenVINO
+    files next to it (same name, .onnx / .xml); returns True on success
+    """
+    print(f"Loading Keras model from {model_path}...")
+
+    if not os.path.exists(model_path):
+        print("❌ Model file not found!")
+        return False
+
+    try:
+        # Load Keras model
+        model = load_keras_model(model_path)
+        print("✅ Model loaded successfully.")
+
+        if 'tflite' in formats:
+            # Convert to TFLite
+            print("Converting to TFLite...")
+            # Optional: dynamic-range quantization
+            tflite_model = convert_tflite(model, 'dynamic' if optimize else 'float')
+
+            # Save
+            with open(tflite_path, 'wb') as f:
+                f.write(tflite_model)
+            
+            print(f"✅ TFLite model saved to {tflite_path}")
+            
+            # Size comparison
+            k_size = os.path.getsize(model_path) / (1024 * 1024)
+            t_size = os.path.getsize(tflite_path) / (1024 * 1024)
+            print(f"Original Size: {k_size:.2f} MB")
+            print(f"TFLite Size:   {t_size:.2f} MB")
+            print(f"Reduction:     {(1 - t_size/k_size)*100:.1f}%")
+
+        stem = os.path.splitext(tflite_path)[0]
+        if 'onnx' in formats:
+            print("Exporting to ONNX...")
+            export_onnx(model, stem + '.onnx')
+            print(f"✅ ONNX model saved to {stem}.onnx")
+        if 'openvino' in formats:
+            print("Exporting to OpenVINO IR...")
+            export_openvino(model, stem + '.xml')
+            print(f"✅ OpenVINO model saved to {stem}.xml")
+        return True
+
+    except Exception as e:
+        print(f"❌ Error during conversion: {e}")
+        import traceback
+        traceback.print_exc()
+        return False
+
+if __name__ == '__main__':
+    import argparse
+    parser = argparse.ArgumentParser(description="Convert a Keras model to TFLite")
+    parser.add_argument('--model', default=MODEL_PATH, help="Keras .h5 model to convert")
+    parser.add_argument('--output', default=TFLITE_PATH, help="Where to write the .tflite file")
+    parser.add_argument('--no-optimize', action='store_true', help="Skip dynamic-range quantization")
+    parser.add_argument('--format', default='tflite',
+                        help=f"Comma-separated formats to write: {', '.join(FORMATS)}")
+    parser.add_argument('--parity', action='store_true',
+                        help="Benchmark every exported backend and check its scores against TFLite "
+                             "on data/processed/test; fail if any backend disagrees")
+    args = parser.parse_args()
+
+    formats = tuple(f.strip() for f in args.format.split(',') if f.strip())
+    unknown = [f for f in formats if f not in FORMATS]
+    if unknown:
+        parser.error(f"Unknown format(s): {', '.join(unknown)}")
+
+    if not convert_model(args.model, args.output, optimize=not args.no_optimize, formats=formats):
+        exit(1)
+
+    if args.parity:
+        import inference_backends
+        report = inference_backends.compare_backends(args.output)
+        print(f"\n{'Backend':<12} {'Latency ms':>11} {'Max diff':>9} {'Agreement':>10}  Parity")
+        print("-" * 56)
+        failed = False
+        for name, r in report.items():
+            if 'error' in r:
+                print(f"{name:<12} ❌ {r['error']}")
+                failed = True
+                continue
+            parity = r['parity']
+            if parity is None:
+                print(f"{name:<12} {r['latency_ms']:>11.2f} {'-':>9} {'-':>10}  reference")
+                continue
+            failed |= not parity['passed']
+            print(f"{name:<12} {r['latency_ms']:>11.2f} {parity['max_abs_diff']:>9.4f} "
+                  f"{parity['class_agreement']:>10.2%}  {'✅' if parity['passed'] else '❌'}")
+        if failed:
+            exit(1)
@@ -0,0 +1,539 @@
+"""
+Python client for the crack detection API.
+
+One client holds a pooled set of keep-alive connections, so a stream of
+uploads reuses the same TCP (and TLS) connections instead of opening one per
+image. By default it asks for compact binary verdicts (verdict_format.py)
+and falls back to JSON transparently. Pass compact=False to get the full
+JSON responses.
+
+    from crack_client import CrackDetectionClient
+
+    with CrackDetectionClient('http://localhost:8080', camera_id='cam-3') as client:
+        verdict = client.predict('frame_000123.jpg', odometer_m=1520.4, priority='bulk')
+        if verdict['has_crack']:
+            ...
+
+AsyncCrackDetectionClient (httpx) is built for on-train uploaders. It keeps
+many uploads in flight over one connection pool under a concurrency limit,
+and groups frames into /upload/batch/ requests when the server has that
+endpoint. It retries transient failures with jittered exponential backoff,
+and spools frames to disk while the server is unreachable, re-sending them
+once it's back.
+
+    python crack_client.py upload frames/ --url http://server:8080 --camera-id cam-3 --spool-dir spool/
+"""
+import os
+import json
+import time
+import uuid
+import random
+import asyncio
+import mimetypes
+
+import requests
+from requests.adapters import HTTPAdapter
+
+import verdict_format
+
+DEFAULT_URL = os.getenv('CRACK_API_URL', 'http://localhost:8080')
+
+
+class CrackDetectionError(Exception):
+    def __init__(self, message, status_code=None, body=None):
+        super().__init__(message)
+        self.status_code = status_code
+        self.body = body
+
+    @property
+    def retryable(self):
+        # Queue full / deadline passed / model not loaded yet / server unavailable
+        return self.status_code in RETRYABLE_STATUS
+
+
+class ServerUnreachable(CrackDetectionError):
+    retryable = True
+
+
+RETRYABLE_STATUS = (502, 503, 504)
+
+
+def _retryable_frame(verdict):
+    """A frame that failed inside a 200 batch response because the queue was full or its deadline passed"""
+    return bool(verdict and verdict.get('error') and verdict.get('status') in RETRYABLE_STATUS)
+
+
+def _image_part(image, filename=None):
+    """(filename, data, content type) for a path, bytes or file object"""
+    if isinstance(image, (str, os.PathLike)):
+        filename = filename or os.path.basename(image)
+        with open(image, 'rb') as f:
+            data = f.read()
+    elif isinstance(image, (bytes, bytearray, memoryview)):
+        data = bytes(image)
+    else:
+        data = image.read()
+    filename = filename or 'frame.jpg'
+    return filename, data, mimetypes.guess_type(filename)[0] or 'image/jpeg'
+
+
+def _params(defaults, params):
+    return {k: v for k, v in dict(defaults, **params).items() if v is not None}
+
+
+def parse_response(status_code, content_type, content, batch=False):
+    """Decode a compact or JSON response; raises CrackDetectionError for failed requests"""
+    if content_type and content_type.startswith(verdict_format.MEDIA_TYPE):
+        return verdict_format.decode_batch(content) if batch else verdict_format.decode_verdict(content)[0]
+
+    try:
+        body = json.loads(content)
+    except ValueError:
+        raise CrackDetectionError(f"Unexpected response ({status_code})", status_code, content)
+    if status_code >= 400 or body.get('error'):
+        raise CrackDetectionError(body.get('message') or body.get('detail') or f"HTTP {status_code}",
+                                  status_code, body)
+    return body['results'] if batch else body
+
+
+class CrackDetectionClient:
+    def __init__(self, base_url=DEFAULT_URL, compact=True, pool_size=8, timeout=30.0, **defaults):
+        """
+        defaults are query parameters sent with every upload, e.g. site,
+        camera_id, segment, priority, operating_point or deadline_ms.
+        """
+        self.base_url = base_url.rstrip('/')
+        self.timeout = timeout
+        self.defaults = defaults
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+        self.session.headers['Accept'] = (f'{verdict_format.MEDIA_TYPE}, application/json'
+                                          if compact else 'application/json')
+
+    def predict(self, image, filename=None, **params):
+        """Verdict for one image; params as for /upload/ (frame_id, timestamp, odometer_m, ...)"""
+        r = self.session.post(f'{self.base_url}/upload/', params=_params(self.defaults, params),
+                              files={'file': _image_part(image, filename)}, timeout=self.timeout)
+        return parse_response(r.status_code, r.headers.get('content-type'), r.content)
+
+    def predict_batch(self, images, metadata=None, **params):
+        """
+        Verdicts for several images in one request, in order. metadata is an
+        optional list of per-image dicts (frame_id, timestamp, lat, lon,
+        odometer_m). Frames that failed come back as {'error': True, ...}.
+        The server schedules batches as bulk work unless priority is given.
+        """
+        files = [('files', _image_part(image)) for image in images]
+        data = {'metadata': json.dumps(metadata)} if metadata is not None else None
+        r = self.session.post(f'{self.base_url}/upload/batch/', params=_params(self.defaults, params),
+                              files=files, data=data, timeout=self.timeout)
+        return parse_response(r.status_code, r.headers.get('content-type'), r.content, batch=True)
+
+    def _get(self, path, expect_ok=True):
+        r = self.session.get(f'{self.base_url}{path}', timeout=self.timeout,
+                             headers={'Accept': 'application/json'})
+        if expect_ok and r.status_code >= 400:
+            raise CrackDetectionError(f"HTTP {r.status_code}", r.status_code, r.text)
+        return r
+
+    def health(self):
+        return self._get('/health').json()
+
+    def ready(self):
+        return self._get('/ready', expect_ok=False).status_code == 200
+
+    def scheduler(self):
+        return self._get('/scheduler').json()
+
+    def close(self):
+        self.session.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class FrameSpool:
+    """Frames (bytes + upload parameters) kept on disk until the server is reachable again"""
+
+    def __init__(self, directory, max_bytes=1024 ** 3):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        os.makedirs(directory, exist_ok=True)
+        self.size = sum(os.path.getsize(os.path.join(directory, f)) for f in os.listdir(directory)
+                        if f.endswith(('.frame', '.frame.json')))
+
+    def put(self, filename, data, params):
+        if self.size + len(data) > self.max_bytes:
+            return False
+        # Sortable names, so frames are re-sent in capture order
+        name = f"{time.time():.6f}_{uuid.uuid4().hex[:8]}"
+        frame_path = os.path.join(self.directory, name + '.frame')
+        with open(frame_path, 'wb') as f:
+            f.write(data)
+        meta = json.dumps({'filename': filename, 'params': params})
+        # The sidecar is written last and atomically; a frame without one is never picked up
+        with open(frame_path + '.json.tmp', 'w') as f:
+            f.write(meta)
+        os.replace(frame_path + '.json.tmp', frame_path + '.json')
+        self.size += len(data) + len(meta)
+        return True
+
+    def pending(self):
+        return sorted(f[:-len('.json')] for f in os.listdir(self.directory) if f.endswith('.frame.json'))
+
+    def load(self, entry):
+        path = os.path.join(self.directory, entry)
+        with open(path + '.json') as f:
+            meta = json.load(f)
+        with open(path, 'rb') as f:
+            return meta['filename'], f.read(), meta['params']
+
+    def remove(self, entry):
+        path = os.path.join(self.directory, entry)
+        for p in (path, path + '.json'):
+            try:
+                self.size -= os.path.getsize(p)
+                os.remove(p)
+            except OSError:
+                pass
+
+    def reject(self, entry):
+        """Set aside a frame the server refused for good, so it no longer holds up the rest"""
+        path = os.path.join(self.directory, entry)
+        rejected = path[:-len('.frame')] + '.rejected'
+        for src, dst in ((path, rejected), (path + '.json', rejected + '.json')):
+            try:
+                self.size -= os.path.getsize(src)
+                os.replace(src, dst)
+            except OSError:
+                pass
+
+
+class AsyncCrackDetectionClient:
+    def __init__(self, base_url=DEFAULT_URL, compact=True, concurrency=16, batch_size=8,
+                 max_retries=4, backoff=0.25, max_backoff=10.0, spool_dir=None,
+                 spool_max_bytes=1024 ** 3, timeout=30.0, **defaults):
+        """
+        concurrency bounds the requests in flight; batch_size frames go into
+        each /upload/batch/ request (1 disables batching). defaults are query
+        parameters sent with every upload, as for CrackDetectionClient.
+        """
+        import httpx
+        self._httpx = httpx
+        self.base_url = base_url.rstrip('/')
+        self.defaults = defaults
+        self.concurrency = concurrency
+        self.batch_size = batch_size
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.spool = FrameSpool(spool_dir, spool_max_bytes) if spool_dir else None
+        # None until the first batch request tells us whether the server has the endpoint
+        self.batch_available = None if batch_size > 1 else False
+        self._semaphore = asyncio.Semaphore(concurrency)
+        self._drain_task = None
+        accept = f'{verdict_format.MEDIA_TYPE}, application/json' if compact else 'application/json'
+        self.http = httpx.AsyncClient(
+            timeout=timeout, headers={'Accept': accept},
+            limits=httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+        )
+
+    async def _post(self, path, params, files, data=None):
+        """POST with jittered exponential backoff on transport errors and 502/503/504"""
+        for attempt in range(self.max_retries + 1):
+            retry_after = None
+            try:
+                r = await self.http.post(f'{self.base_url}{path}', params=params, files=files, data=data)
+            except self._httpx.TransportError as e:
+                error = ServerUnreachable(f"{type(e).__name__}: {e}")
+            else:
+                if r.status_code not in RETRYABLE_STATUS:
+                    return r
+                error = CrackDetectionError(f"HTTP {r.status_code}", r.status_code, r.text)
+                retry_after = r.headers.get('retry-after')
+            if attempt == self.max_retries:
+                raise error
+            await asyncio.sleep(self._backoff_delay(attempt, retry_after))
+
+    def _backoff_delay(self, attempt, retry_after=None):
+        # Full jitter keeps a fleet of uploaders from retrying in lockstep
+        delay = random.uniform(0, min(self.max_backoff, self.backoff * 2 ** attempt))
+        if retry_after and retry_after.isdigit():
+            delay = max(delay, float(retry_after))
+        return delay
+
+    def _spool(self, filename, data, params, error):
+        if self.spool is None:
+            raise error
+        # Keep the capture time, not the time it finally gets uploaded
+        params = dict(params, timestamp=params.get('timestamp', time.time()))
+        if not self.spool.put(filename, data, params):
+            raise ServerUnreachable(f"{error} (spool {self.spool.directory} is full)")
+        return None
+
+    async def _predict_part(self, filename, data, content_type, params):
+        try:
+            r = await self._post('/upload/', params, {'file': (filename, data, content_type)})
+        except CrackDetectionError as e:
+            # Still unreachable, overloaded or without a model after every retry
+            if not e.retryable:
+                raise
+            return self._spool(filename, data, params, e)
+        self._maybe_drain()
+        return parse_response(r.status_code, r.headers.get('content-type'), r.content)
+
+    async def predict(self, image, filename=None, **params):
+        """
+        Verdict for one image, or None if the server was unreachable and the
+        frame was spooled for later
+        """
+        filename, data, content_type = _image_part(image, filename)
+        async with self._semaphore:
+            return await self._predict_part(filename, data, content_type, _params(self.defaults, params))
+
+    async def _post_batch(self, parts, metadata, params):
+        """
+        One /upload/batch/ request, then the frames that came back as 503/504
+        inside it are sent again, with the same backoff as whole requests
+        """
+        r = await self._post('/upload/batch/', params, [('files', p) for p in parts],
+                             {'metadata': json.dumps(metadata)})
+        if r.status_code in (404, 405):
+            return r, None
+        verdicts = parse_response(r.status_code, r.headers.get('content-type'), r.content, batch=True)
+        for attempt in range(self.max_retries):
+            pending = [i for i, v in enumerate(verdicts) if _retryable_frame(v)]
+            if not pending:
+                break
+            await asyncio.sleep(self._backoff_delay(attempt))
+            try:
+                retry = await self._post('/upload/batch/', params, [('files', parts[i]) for i in pending],
+                                         {'metadata': json.dumps([metadata[i] for i in pending])})
+                retried = parse_response(retry.status_code, retry.headers.get('content-type'),
+                                         retry.content, batch=True)
+            except CrackDetectionError as e:
+                if e.retryable and self.spool is not None:
+                    # Only the frames still waiting are spooled; the rest already have verdicts
+                    for i in pending:
+                        verdicts[i] = self._spool(parts[i][0], parts[i][1], dict(params, **metadata[i]), e)
+                # Otherwise the retry failed as a whole; keep the per-frame errors from the last response
+                break
+            for i, verdict in zip(pending, retried):
+                verdicts[i] = verdict
+        else:
+            # Still turned away after every retry (e.g. the model is still loading): keep them for later
+            pending = [i for i, v in enumerate(verdicts) if _retryable_frame(v)]
+            if pending and self.spool is not None:
+                error = CrackDetectionError(verdicts[pending[0]]['message'], verdicts[pending[0]]['status'])
+                for i in pending:
+                    verdicts[i] = self._spool(parts[i][0], parts[i][1], dict(params, **metadata[i]), error)
+        return r, verdicts
+
+    async def predict_batch(self, images, metadata=None, **params):
+        """
+        Verdicts for several images in order, through /upload/batch/ when the
+        server has it and as individual uploads otherwise. Frames the server
+        turned away inside a batch (queue full, deadline passed) are retried.
+        """
+        parts = [_image_part(image) for image in images]
+        metadata = metadata or [{} for _ in parts]
+        params = _params(self.defaults, params)
+        async with self._semaphore:
+            if self.batch_available is not False:
+                try:
+                    r, verdicts = await self._post_batch(parts, metadata, params)
+                except CrackDetectionError as e:
+                    if not e.retryable:
+                        raise
+                    return [self._spool(p[0], p[1], dict(params, **m), e) for p, m in zip(parts, metadata)]
+                if verdicts is None:
+                    self.batch_available = False
+                else:
+                    self.batch_available = True
+                    self._maybe_drain()
+                    return verdicts
+
+        # No batch endpoint: pipeline the frames individually
+        async def single(part, meta):
+            async with self._semaphore:
+                try:
+                    return await self._predict_part(*part, dict(params, **meta))
+                except CrackDetectionError as e:
+                    return {'error': True, 'message': str(e), 'frame_id': meta.get('frame_id')}
+        return await asyncio.gather(*(single(p, m) for p, m in zip(parts, metadata)))
+
+    async def queue_depth(self):
+        """Requests waiting for inference on the server (all classes), or None if it doesn't say"""
+        try:
+            r = await self.http.get(f'{self.base_url}/scheduler', headers={'Accept': 'application/json'})
+            if r.status_code == 200:
+                return sum(c['queue_depth'] for c in r.json()['classes'].values())
+        except (self._httpx.TransportError, ValueError, KeyError):
+            pass
+        return None
+
+    async def upload_many(self, frames, sampler=None, **params):
+        """
+        Upload an iterable of frames, either images or (image, metadata)
+        pairs, keeping up to `concurrency` requests in flight. Returns the
+        verdicts in input order (None for spooled frames). Only the frames
+        in flight are held in memory.
+        
+        With a frame_sampler.FrameSampler, frames are thinned before upload
+        from their timestamp / odometer_m / speed_mps metadata and the
+        server's queue depth; dropped frames come back as {'skipped': True}.
+        """
+        results = {}
+        tasks = set()
+        window = asyncio.Semaphore(self.concurrency)
+        in_flight = [0]
+
+        async def feed_sampler():
+            while True:
+                server_depth = await self.queue_depth()
+                # Frames this client has in flight are part of the backlog too
+                sampler.update(queue_depth=(server_depth or 0) + in_flight[0])
+                await asyncio.sleep(sampler.interval_s)
+        feeder = asyncio.create_task(feed_sampler()) if sampler is not None else None
+
+        async def send(indices, chunk):
+            metadata = [meta for _, meta in chunk]
+            in_flight[0] += len(chunk)
+            try:
+                verdicts = await self.predict_batch([image for image, _ in chunk], metadata, **params)
+            except CrackDetectionError as e:
+                verdicts = [{'error': True, 'message': str(e), 'frame_id': m.get('frame_id')} for m in metadata]
+            finally:
+                in_flight[0] -= len(chunk)
+                window.release()
+            for index, verdict in zip(indices, verdicts):
+                results[index] = verdict
+
+        chunk, indices, count = [], [], 0
+        try:
+            for i, frame in enumerate(frames):
+                count += 1
+                image, meta = frame if isinstance(frame, tuple) else (frame, {})
+                if sampler is not None and not sampler.offer(meta.get('timestamp'), meta.get('odometer_m'),
+                                                             meta.get('speed_mps')):
+                    results[i] = {'skipped': True, 'frame_id': meta.get('frame_id')}
+                    continue
+                chunk.append((image, meta))
+                indices.append(i)
+                if len(chunk) == max(self.batch_size, 1):
+                    await window.acquire()
+                    tasks.add(asyncio.create_task(send(indices, chunk)))
+                    chunk, indices = [], []
+                    tasks = {t for t in tasks if not t.done()}
+            if chunk:
+                await window.acquire()
+                tasks.add(asyncio.create_task(send(indices, chunk)))
+            await asyncio.gather(*tasks)
+        finally:
+            if feeder is not None:
+                feeder.cancel()
+        return [results.get(i) for i in range(count)]
+
+    def _maybe_drain(self):
+        if self.spool is not None and self.spool.size and (self._drain_task is None or self._drain_task.done()):
+            self._drain_task = asyncio.create_task(self.drain_spool())
+
+    async def drain_spool(self):
+        """Re-send spooled frames oldest first; stops at the first that still can't get through"""
+        sent = 0
+        for entry in self.spool.pending() if self.spool else []:
+            filename, data, params = self.spool.load(entry)
+            async with self._semaphore:
+                try:
+                    r = await self._post('/upload/', params,
+                                         {'file': (filename, data, mimetypes.guess_type(filename)[0] or 'image/jpeg')})
+                    parse_response(r.status_code, r.headers.get('content-type'), r.content)
+                except CrackDetectionError as e:
+                    if e.retryable:
+                        break
+                    # Rejected for good (e.g. not an image): kept on disk, but no longer pending
+                    self.spool.reject(entry)
+                    continue
+            # Only a frame that got a verdict leaves the spool
+            self.spool.remove(entry)
+            sent += 1
+        return sent
+
+    async def close(self):
+        if self._drain_task is not None:
+            await asyncio.gather(self._drain_task, return_exceptions=True)
+        await self.http.aclose()
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        await self.close()
+
+
+def main():
+    import glob
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Upload a directory of frames to the crack detection API")
+    sub = parser.add_subparsers(dest='command', required=True)
+    upload = sub.add_parser('upload')
+    upload.add_argument('directory')
+    upload.add_argument('--url', default=DEFAULT_URL)
+    upload.add_argument('--concurrency', type=int, default=16)
+    upload.add_argument('--batch-size', type=int, default=8)
+    upload.add_argument('--spool-dir')
+    upload.add_argument('--site')
+    upload.add_argument('--camera-id')
+    upload.add_argument('--segment')
+    upload.add_argument('--priority', default='bulk')
+    upload.add_argument('--sample', action='store_true',
+                        help="Thin frames with the feedback sampler (see frame_sampler.py)")
+    upload.add_argument('--camera-fps', type=float, default=120.0)
+    upload.add_argument('--speed', type=float, default=0.0, help="Train speed in m/s for sampling")
+    upload.add_argument('--footprint-m', type=float, default=0.5, help="Track length covered by one frame")
+    upload.add_argument('--min-overlap', type=float, default=0.2)
+    upload.add_argument('--sampler-log', help="Append sampling decisions here as JSON lines")
+    args = parser.parse_args()
+
+    paths = sorted(p for ext in ('jpg', 'jpeg', 'png', 'gif')
+                   for p in glob.glob(os.path.join(args.directory, f'*.{ext}')))
+
+    async def run():
+        async with AsyncCrackDetectionClient(args.url, concurrency=args.concurrency,
+                                             batch_size=args.batch_size, spool_dir=args.spool_dir,
+                                             site=args.site, camera_id=args.camera_id,
+                                             segment=args.segment, priority=args.priority) as client:
+            await client.drain_spool()
+            sampler = None
+            if args.sample:
+                from frame_sampler import FrameSampler
+                sampler = FrameSampler(args.camera_fps, args.footprint_m, args.min_overlap,
+                                       target_queue_depth=args.concurrency, log_path=args.sampler_log)
+                sampler.update(speed_mps=args.speed)
+            # Directory frames are replayed as if captured at the camera rate
+            t0 = time.time()
+            frames = ((p, {'frame_id': os.path.basename(p), 'timestamp': t0 + i / args.camera_fps})
+                      for i, p in enumerate(paths))
+            start = time.perf_counter()
+            verdicts = await client.upload_many(frames, sampler=sampler)
+            if sampler is not None:
+                print(f"Sampler: {sampler.stats()}")
+            return verdicts, time.perf_counter() - start
+
+    verdicts, elapsed = asyncio.run(run())
+    spooled = sum(v is None for v in verdicts)
+    skipped = sum(1 for v in verdicts if v and v.get('skipped'))
+    errors = sum(1 for v in verdicts if v and v.get('error'))
+    cracks = sum(1 for v in verdicts if v and 'has_crack' in v and v['has_crack'])
+    print(f"✅ {len(verdicts)} frames in {elapsed:.1f}s ({len(verdicts) / max(elapsed, 1e-9):.1f}/s): "
+          f"{cracks} with cracks, {errors} errors, {spooled} spooled, {skipped} skipped by sampling")
+
+
+if __name__ == '__main__':
+    main()
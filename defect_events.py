@@ -0,0 +1,232 @@
+"""
+Merge per-frame crack detections into unique defect events.
+
+A crack passing under a 120 FPS camera is detected in dozens of consecutive
+frames. The aggregator keeps at most one open event per stream (site +
+camera). Each positive frame either extends that event or, when it is too
+far from the last detection along the track or in time, closes it and opens
+a new one. Negative frames close the open event once the train has moved
+past the gap. Closed events carry the start and end position, frame count
+and peak P(Faulty), and are passed to a sink such as the results store.
+
+Position comes from the odometer when the request has one. Otherwise it comes
+from GPS, as distance travelled along the stream's own fixes, and otherwise
+the aggregator falls back to time gaps. Memory is bounded: each stream needs
+a constant amount of state, at most max_streams streams are tracked (the
+least recently seen one is evicted and its event closed), and idle streams
+are expired.
+
+Replay stored results offline, e.g. when several workers each saw part of a
+stream:
+    python defect_events.py [--db data/results.db] [--segment S12] [--gap-m 1.0]
+"""
+import math
+import time
+import uuid
+import threading
+from collections import OrderedDict
+
+EARTH_RADIUS_M = 6_371_000
+
+
+def haversine_m(lat1, lon1, lat2, lon2):
+    p1, p2 = math.radians(lat1), math.radians(lat2)
+    dp, dl = p2 - p1, math.radians(lon2 - lon1)
+    a = math.sin(dp / 2) ** 2 + math.cos(p1) * math.cos(p2) * math.sin(dl / 2) ** 2
+    return 2 * EARTH_RADIUS_M * math.asin(math.sqrt(a))
+
+
+class _Stream:
+    """Per-stream state: the GPS track distance and the open event, if any"""
+    __slots__ = ('track_m', 'last_fix', 'event', 'last_seen')
+
+    def __init__(self):
+        self.track_m = 0.0
+        self.last_fix = None
+        self.event = None
+        self.last_seen = time.monotonic()
+
+
+class DefectEventAggregator:
+    def __init__(self, sink=None, gap_m=1.0, max_gap_s=2.0, min_frames=1,
+                 idle_timeout_s=5.0, max_streams=1024):
+        # sink(event) is called once per closed event
+        self.sink = sink
+        self.gap_m = gap_m
+        self.max_gap_s = max_gap_s
+        self.min_frames = min_frames
+        self.idle_timeout_s = idle_timeout_s
+        self.max_streams = max_streams
+        self.closed = 0
+        self.discarded = 0
+        self._streams = OrderedDict()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def stream_key(site=None, camera_id=None):
+        return f"{site or '-'}/{camera_id or '-'}"
+
+    def _position(self, stream, odometer_m, lat, lon):
+        if odometer_m is not None:
+            return odometer_m, 'odometer'
+        if lat is not None and lon is not None:
+            if stream.last_fix is not None:
+                stream.track_m += haversine_m(*stream.last_fix, lat, lon)
+            stream.last_fix = (lat, lon)
+            return stream.track_m, 'gps'
+        return None, None
+
+    def _continues(self, event, ts, position, source):
+        """Whether a frame at (ts, position) is still part of the open event"""
+        if ts - event['last_detection_ts'] > self.max_gap_s:
+            return False
+        if position is not None and source == event['position_source']:
+            return abs(position - event['last_detection_m']) <= self.gap_m
+        return True
+
+    def add(self, ts, has_crack, probability_faulty, site=None, camera_id=None, segment=None,
+            frame_id=None, odometer_m=None, lat=None, lon=None, model_version=None):
+        """
+        Feed one frame verdict. Returns the open event the frame belongs to
+        (None for a negative frame), for the caller to report.
+        """
+        key = self.stream_key(site, camera_id)
+        closed = []
+        with self._lock:
+            stream = self._streams.get(key)
+            if stream is None:
+                stream = self._streams[key] = _Stream()
+                if len(self._streams) > self.max_streams:
+                    _, evicted = self._streams.popitem(last=False)
+                    closed.append(evicted.event)
+            else:
+                self._streams.move_to_end(key)
+            stream.last_seen = time.monotonic()
+
+            position, source = self._position(stream, odometer_m, lat, lon)
+            event = stream.event
+            if event is not None and not self._continues(event, ts, position, source):
+                closed.append(event)
+                event = stream.event = None
+
+            if has_crack:
+                if event is None:
+                    event = stream.event = {
+                        'event_id': uuid.uuid4().hex, 'stream': key, 'site': site,
+                        'camera_id': camera_id, 'segment': segment, 'start_ts': ts,
+                        'position_source': source, 'start_position_m': position,
+                        'start_lat': lat, 'start_lon': lon, 'peak_probability': -1.0,
+                        'frame_count': 0,
+                    }
+                event.update(end_ts=ts, end_position_m=position, end_lat=lat, end_lon=lon,
+                             last_detection_ts=ts, last_detection_m=position,
+                             model_version=model_version)
+                event['frame_count'] += 1
+                if probability_faulty > event['peak_probability']:
+                    event.update(peak_probability=probability_faulty, peak_ts=ts, peak_frame_id=frame_id)
+
+        self._emit(closed)
+        if not has_crack or event is None:
+            return None
+        return {k: event[k] for k in ('event_id', 'frame_count', 'peak_probability', 'start_position_m')}
+
+    def expire(self, now=None):
+        """Close events on streams that have gone quiet; call periodically"""
+        now = time.monotonic() if now is None else now
+        closed = []
+        with self._lock:
+            for key in [k for k, s in self._streams.items() if now - s.last_seen > self.idle_timeout_s]:
+                closed.append(self._streams.pop(key).event)
+        self._emit(closed)
+
+    def flush(self):
+        """Close every open event, e.g. at shutdown or the end of a replay"""
+        with self._lock:
+            closed = [s.event for s in self._streams.values()]
+            self._streams.clear()
+        self._emit(closed)
+
+    def _emit(self, events):
+        for event in events:
+            if event is None:
+                continue
+            if event['frame_count'] < self.min_frames:
+                self.discarded += 1
+                continue
+            event = {k: v for k, v in event.items() if not k.startswith('last_detection')}
+            if event['start_position_m'] is not None and event['end_position_m'] is not None:
+                event['length_m'] = round(abs(event['end_position_m'] - event['start_position_m']), 3)
+            self.closed += 1
+            if self.sink is not None:
+                self.sink(event)
+
+    def stats(self):
+        with self._lock:
+            open_events = sum(1 for s in self._streams.values() if s.event is not None)
+            streams = len(self._streams)
+        return {'streams': streams, 'open_events': open_events, 'closed_events': self.closed,
+                'discarded_events': self.discarded}
+
+
+def replay(store, aggregator, **filters):
+    """
+    Feed stored predictions to the aggregator in capture order; returns the
+    frame count. iter_query pages on (ts, id), so frames that reached the store
+    late or through another worker still arrive in the order they were taken.
+    """
+    frames = 0
+    for row in store.iter_query(**filters):
+        frames += 1
+        aggregator.add(row['ts'], row['has_crack'], row['probability_faulty'], row['site'],
+                       row['camera_id'], row['segment'], row['frame_id'], row['odometer_m'],
+                       row['lat'], row['lon'], row['model_version'])
+    aggregator.flush()
+    return frames
+
+
+def main():
+    import argparse
+    from results_store import DEFAULT_DB_PATH, ResultsStore
+
+    parser = argparse.ArgumentParser(description="Rebuild defect events from stored predictions")
+    parser.add_argument('--db', default=DEFAULT_DB_PATH)
+    parser.add_argument('--start', type=float, help="Unix seconds")
+    parser.add_argument('--end', type=float, help="Unix seconds")
+    parser.add_argument('--site')
+    parser.add_argument('--camera-id')
+    parser.add_argument('--segment')
+    parser.add_argument('--gap-m', type=float, default=1.0)
+    parser.add_argument('--max-gap-s', type=float, default=2.0)
+    parser.add_argument('--min-frames', type=int, default=1)
+    parser.add_argument('--save', action='store_true', help="Write the events to the store")
+    args = parser.parse_args()
+
+    store = ResultsStore(args.db)
+    events = []
+
+    def sink(event):
+        events.append(event)
+        if args.save:
+            store.record_event(event)
+
+    # Replay is driven by capture time, so idle expiry (wall clock) doesn't apply
+    aggregator = DefectEventAggregator(sink, args.gap_m, args.max_gap_s, args.min_frames,
+                                       idle_timeout_s=float('inf'))
+    frames = replay(store, aggregator, start=args.start, end=args.end, site=args.site,
+                    camera_id=args.camera_id, segment=args.segment)
+    store.close()
+
+    print(f"{frames} frames -> {len(events)} defect events")
+    print(f"\n{'Stream':<20} {'Segment':<10} {'Start m':>9} {'End m':>9} {'Frames':>7} {'Peak':>6}")
+    print("-" * 66)
+    for e in events:
+        start_m = f"{e['start_position_m']:.2f}" if e['start_position_m'] is not None else '-'
+        end_m = f"{e['end_position_m']:.2f}" if e['end_position_m'] is not None else '-'
+        print(f"{e['stream']:<20} {str(e['segment'] or '-'):<10} {start_m:>9} {end_m:>9} "
+              f"{e['frame_count']:>7} {e['peak_probability']:>6.3f}")
+    if args.save:
+        print(f"\n✅ Events written to {args.db}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,295 @@
+"""
+Distil the InceptionResNetV2 crack model into a compact student for edge inference.
+
+The teacher (models/best_model.h5) supplies temperature-softened targets for a
+MobileNetV2 student trained on data/processed. The student keeps the served
+model's contract - a (1, 300, 300, 3) input in InceptionResNetV2 [-1, 1] scale
+and a sigmoid output giving P(Normal) - so its TFLite export is a drop-in
+replacement for models/model.tflite. Optional gradual magnitude pruning runs
+as a fine-tuning phase after distillation.
+
+Usage:
+    python distill_model.py [--alpha 0.35] [--epochs 30] [--prune-sparsity 0.5]
+"""
+import os
+import json
+import time
+import argparse
+import numpy as np
+import tensorflow as tf
+from tensorflow.keras import layers
+from tensorflow.keras.applications import MobileNetV2
+from tensorflow.keras.applications.inception_resnet_v2 import preprocess_input
+from tensorflow.keras.models import Model
+
+from convert_to_tflite import load_keras_model, convert_model
+
+TEACHER_PATH = 'models/best_model.h5'
+TEACHER_TFLITE_PATH = 'models/model.tflite'
+STUDENT_PATH = 'models/student_model.h5'
+STUDENT_TFLITE_PATH = 'models/student.tflite'
+REPORT_PATH = 'models/distill_report.json'
+DATA_DIR = 'data/processed'
+IMG_SIZE = (300, 300)
+BATCH_SIZE = 16
+
+# Kernels smaller than this (stem conv, logits) are left dense
+MIN_PRUNABLE_WEIGHTS = 1024
+
+
+def load_split(split, shuffle=False):
+    """Batched (image, label) dataset in InceptionResNetV2 input scale"""
+    ds = tf.keras.utils.image_dataset_from_directory(
+        os.path.join(DATA_DIR, split),
+        label_mode='binary',
+        image_size=IMG_SIZE,
+        batch_size=BATCH_SIZE,
+        shuffle=shuffle,
+        seed=42
+    )
+    return ds.map(lambda x, y: (preprocess_input(x), y)).prefetch(tf.data.AUTOTUNE)
+
+
+def build_student(alpha=0.35):
+    """
+    MobileNetV2 student. Returns (model, logits_model) sharing weights: the
+    logits model is trained, the sigmoid model is what gets exported.
+    """
+    inputs = layers.Input(shape=IMG_SIZE + (3,))
+    # MobileNetV2 expects [-1, 1] inputs, the same scale the server feeds
+    backbone = MobileNetV2(
+        input_shape=IMG_SIZE + (3,),
+        alpha=alpha,
+        include_top=False,
+        weights='imagenet',
+        pooling='avg'
+    )
+    x = backbone(inputs)
+    x = layers.Dropout(0.2)(x)
+    # Keeps the logits kernel under the converter's 1024-weight quantization
+    # cutoff; XNNPACK rejects a dynamic-range quantized 1-unit FULLY_CONNECTED
+    x = layers.Dense(128, activation='swish')(x)
+    logits = layers.Dense(1, name='logits')(x)
+    outputs = layers.Activation('sigmoid', name='probability')(logits)
+    return Model(inputs, outputs, name='crack_student'), Model(inputs, logits)
+
+
+def distillation_loss(y_true, teacher_prob, student_logits, temperature, alpha):
+    """alpha * hard-label BCE + (1 - alpha) * T^2 * BCE against softened teacher targets"""
+    eps = 1e-6
+    teacher_prob = tf.clip_by_value(teacher_prob, eps, 1.0 - eps)
+    teacher_logits = tf.math.log(teacher_prob) - tf.math.log(1.0 - teacher_prob)
+    soft_targets = tf.sigmoid(teacher_logits / temperature)
+
+    hard = tf.nn.sigmoid_cross_entropy_with_logits(labels=y_true, logits=student_logits)
+    soft = tf.nn.sigmoid_cross_entropy_with_logits(labels=soft_targets, logits=student_logits / temperature)
+    return tf.reduce_mean(alpha * hard + (1.0 - alpha) * temperature ** 2 * soft)
+
+
+def prunable_kernels(model):
+    """Conv / depthwise / dense kernels large enough to be worth pruning"""
+    kernels = []
+    for layer in model.layers:
+        if isinstance(layer, Model):
+            kernels.extend(prunable_kernels(layer))
+        elif isinstance(layer, (layers.Conv2D, layers.DepthwiseConv2D, layers.Dense)):
+            if int(np.prod(layer.kernel.shape)) >= MIN_PRUNABLE_WEIGHTS:
+                kernels.append(layer.kernel)
+    return kernels
+
+
+def update_masks(kernels, masks, sparsity):
+    """Zero the smallest-magnitude `sparsity` fraction of each kernel"""
+    for kernel, mask in zip(kernels, masks):
+        values = np.abs(kernel.numpy())
+        threshold = np.quantile(values, sparsity)
+        new_mask = (values > threshold).astype(np.float32)
+        mask.assign(new_mask)
+        kernel.assign(kernel.numpy() * new_mask)
+
+
+def measured_sparsity(kernels):
+    total = sum(int(np.prod(k.shape)) for k in kernels)
+    zeros = sum(int(np.sum(k.numpy() == 0)) for k in kernels)
+    return zeros / total if total else 0.0
+
+
+def accuracy(model, ds):
+    correct, total = 0, 0
+    for x, y in ds:
+        pred = model(x, training=False).numpy() > 0.5
+        correct += int(np.sum(pred == (y.numpy() > 0.5)))
+        total += len(y)
+    return correct / total if total else 0.0
+
+
+def train_student(teacher, student, student_logits, train_ds, val_ds, epochs, temperature, alpha,
+                  learning_rate=1e-3, kernels=None, masks=None, sparsity_schedule=None):
+    """Distillation loop; with masks set, pruned weights are held at zero after every step"""
+    optimizer = tf.keras.optimizers.Adam(learning_rate=learning_rate)
+    augment = tf.keras.Sequential([
+        layers.RandomFlip("horizontal"),
+        layers.RandomRotation(0.05),
+    ])
+    masked = list(zip(kernels, masks)) if masks else []
+
+    @tf.function
+    def train_step(x, y):
+        # Teacher and student see the same augmented batch
+        x = augment(x, training=True)
+        teacher_prob = teacher(x, training=False)
+        with tf.GradientTape() as tape:
+            logits = student_logits(x, training=True)
+            loss = distillation_loss(y, teacher_prob, logits, temperature, alpha)
+        grads = tape.gradient(loss, student_logits.trainable_variables)
+        optimizer.apply_gradients(zip(grads, student_logits.trainable_variables))
+        for kernel, mask in masked:
+            kernel.assign(kernel * mask)
+        return loss
+
+    best_acc, best_weights = -1.0, None
+    for epoch in range(epochs):
+        if sparsity_schedule is not None:
+            update_masks(kernels, masks, sparsity_schedule(epoch))
+
+        losses = [float(train_step(x, y)) for x, y in train_ds]
+        val_acc = accuracy(student, val_ds)
+        print(f"Epoch {epoch + 1}/{epochs} - loss: {np.mean(losses):.4f} - val_accuracy: {val_acc:.4f}")
+
+        # While pruning, keep the last (sparsest) weights rather than the best dense ones
+        if sparsity_schedule is not None or val_acc > best_acc:
+            best_acc, best_weights = val_acc, student.get_weights()
+
+    student.set_weights(best_weights)
+    return best_acc
+
+
+def evaluate_tflite(tflite_path, test_ds, runs_per_image=3):
+    """Accuracy and batch-1 invoke latency of a TFLite model on the test split"""
+    interpreter = tf.lite.Interpreter(model_path=tflite_path)
+    interpreter.allocate_tensors()
+    input_index = interpreter.get_input_details()[0]['index']
+    output_index = interpreter.get_output_details()[0]['index']
+
+    correct, total, latencies = 0, 0, []
+    for x_batch, y_batch in test_ds:
+        for x, y in zip(x_batch.numpy(), y_batch.numpy()):
+            interpreter.set_tensor(input_index, x[np.newaxis].astype(np.float32))
+            interpreter.invoke()  # warm
+            for _ in range(runs_per_image):
+                start = time.perf_counter()
+                interpreter.invoke()
+                latencies.append((time.perf_counter() - start) * 1000)
+            score = float(interpreter.get_tensor(output_index)[0][0])
+            correct += int((score > 0.5) == (y[0] > 0.5))
+            total += 1
+
+    return {
+        'path': tflite_path,
+        'size_mb': round(os.path.getsize(tflite_path) / (1024 * 1024), 2),
+        'accuracy': round(correct / total, 4) if total else None,
+        'latency_mean_ms': round(float(np.mean(latencies)), 2),
+        'latency_p95_ms': round(float(np.percentile(latencies, 95)), 2),
+    }
+
+
+def print_report(report):
+    rows = [('Teacher', report['teacher']), ('Student', report['student'])]
+    print(f"\n{'Model':<10} {'Params':>12} {'Size (MB)':>10} {'Accuracy':>9} {'Mean (ms)':>10} {'p95 (ms)':>9}")
+    print("-" * 65)
+    for name, r in rows:
+        if not r:
+            print(f"{name:<10} {'(not available)':>12}")
+            continue
+        acc = f"{r['accuracy']:.4f}" if r.get('accuracy') is not None else "-"
+        print(f"{name:<10} {r['params']:>12,} {r.get('size_mb', 0):>10.2f} {acc:>9} "
+              f"{r.get('latency_mean_ms', 0):>10.2f} {r.get('latency_p95_ms', 0):>9.2f}")
+    if report['teacher'] and report['student'] and report['student'].get('latency_mean_ms'):
+        speedup = report['teacher']['latency_mean_ms'] / report['student']['latency_mean_ms']
+        print(f"\nStudent speed-up: {speedup:.1f}x")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Distil best_model.h5 into a compact student model")
+    parser.add_argument('--teacher', default=TEACHER_PATH)
+    parser.add_argument('--alpha', type=float, default=0.35, help="MobileNetV2 width multiplier")
+    parser.add_argument('--epochs', type=int, default=30)
+    parser.add_argument('--temperature', type=float, default=4.0)
+    parser.add_argument('--hard-weight', type=float, default=0.3,
+                        help="Weight of the hard-label loss; the rest goes to the teacher targets")
+    parser.add_argument('--prune-sparsity', type=float, default=0.0,
+                        help="Target fraction of zeroed weights; 0 disables pruning")
+    parser.add_argument('--prune-epochs', type=int, default=10)
+    args = parser.parse_args()
+
+    if not os.path.exists(args.teacher):
+        print(f"❌ Teacher model not found at {args.teacher}")
+        exit(1)
+
+    print("Loading datasets...")
+    train_ds = load_split('train', shuffle=True)
+    val_ds = load_split('validation')
+    test_ds = load_split('test')
+
+    print(f"Loading teacher from {args.teacher}...")
+    teacher = load_keras_model(args.teacher)
+    teacher.trainable = False
+
+    print("Building student...")
+    student, student_logits = build_student(args.alpha)
+    print(f"Teacher params: {teacher.count_params():,}")
+    print(f"Student params: {student.count_params():,}")
+
+    print("\nDistilling...")
+    val_acc = train_student(teacher, student, student_logits, train_ds, val_ds,
+                            args.epochs, args.temperature, args.hard_weight)
+    print(f"✅ Best distilled val accuracy: {val_acc:.4f}")
+
+    sparsity = 0.0
+    if args.prune_sparsity > 0:
+        print(f"\nPruning to {args.prune_sparsity:.0%} sparsity over {args.prune_epochs} epochs...")
+        kernels = prunable_kernels(student)
+        masks = [tf.Variable(tf.ones_like(k), trainable=False) for k in kernels]
+
+        def schedule(epoch):
+            # Polynomial ramp: prune fast early, then let the network recover
+            progress = min((epoch + 1) / args.prune_epochs, 1.0)
+            return args.prune_sparsity * (1 - (1 - progress) ** 3)
+
+        val_acc = train_student(teacher, student, student_logits, train_ds, val_ds,
+                                args.prune_epochs, args.temperature, args.hard_weight,
+                                learning_rate=1e-4, kernels=kernels, masks=masks,
+                                sparsity_schedule=schedule)
+        sparsity = measured_sparsity(kernels)
+        print(f"✅ Pruned val accuracy: {val_acc:.4f} (sparsity {sparsity:.1%})")
+
+    student.save(STUDENT_PATH)
+    print(f"✅ Student saved to {STUDENT_PATH}")
+
+    # Same conversion path as the served model
+    if not convert_model(STUDENT_PATH, STUDENT_TFLITE_PATH):
+        exit(1)
+
+    print("\nBenchmarking on the test split...")
+    report = {
+        'student_config': {
+            'backbone': 'MobileNetV2', 'alpha': args.alpha, 'temperature': args.temperature,
+            'hard_weight': args.hard_weight, 'sparsity': round(sparsity, 4),
+        },
+        'teacher': None,
+        'student': dict(evaluate_tflite(STUDENT_TFLITE_PATH, test_ds), params=student.count_params()),
+    }
+    if os.path.exists(TEACHER_TFLITE_PATH):
+        report['teacher'] = dict(evaluate_tflite(TEACHER_TFLITE_PATH, test_ds), params=teacher.count_params())
+    else:
+        print(f"⚠️  {TEACHER_TFLITE_PATH} not found; run convert_to_tflite.py for a teacher baseline.")
+
+    print_report(report)
+    with open(REPORT_PATH, 'w') as f:
+        json.dump(report, f, indent=2)
+    print(f"\nReport written to {REPORT_PATH}")
+    print(f"To serve the student, point the server at {STUDENT_TFLITE_PATH}.")
+
+
+if __name__ == '__main__':
+    main()
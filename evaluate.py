@@ -0,0 +1,326 @@
+"""
+Offline evaluation from cached scores.
+
+Each model artifact (.h5/.keras, .tflite including quantized variants, .onnx,
+.xml) scores a dataset directory once. The raw scores are cached in
+data/eval_cache, keyed by the artifact's hash, the dataset's file list and the
+preprocessing settings. Everything after that works on the cached arrays in
+vectorised NumPy: ROC and PR curves, confusion matrices and metrics at a
+grid of thousands of thresholds, and calibration by confidence bucket. So
+trying another threshold or comparing artifacts never rescores an image.
+
+Metrics use P(Faulty) = 1 - raw score, and a frame counts as Faulty when
+P(Faulty) >= threshold, the same rule the server applies.
+
+Usage:
+    python evaluate.py models/best_model.h5 models/model.tflite [models/model_int8.tflite ...]
+                       [--data-dir data/processed/test] [--thresholds 1001] [--buckets 10]
+                       [--output eval.json] [--plot reports/]
+"""
+import os
+import json
+import time
+import hashlib
+import argparse
+import numpy as np
+
+TEST_DIR = os.path.join('data', 'processed', 'test')
+CACHE_DIR = os.path.join('data', 'eval_cache')
+CLASSES = ('Faulty', 'Normal')
+
+
+# ----------------------------------------------------------------------------
+# Scoring and the score cache
+# ----------------------------------------------------------------------------
+
+def dataset_files(data_dir):
+    """(paths, labels) for data_dir/{Faulty,Normal}, labels 1 for Faulty"""
+    import glob
+    paths, labels = [], []
+    for cls in CLASSES:
+        for path in sorted(glob.glob(os.path.join(data_dir, cls, '*'))):
+            paths.append(path)
+            labels.append(1 if cls == 'Faulty' else 0)
+    return paths, np.array(labels, dtype=np.int64)
+
+
+def artifact_hash(model_path):
+    digest = hashlib.sha256()
+    # OpenVINO keeps the weights in a .bin beside the .xml
+    files = [model_path] + ([os.path.splitext(model_path)[0] + '.bin'] if model_path.endswith('.xml') else [])
+    for path in files:
+        with open(path, 'rb') as f:
+            for chunk in iter(lambda: f.read(1 << 20), b''):
+                digest.update(chunk)
+    return digest.hexdigest()
+
+
+def dataset_hash(paths):
+    """Changes when any file is added, removed, or rewritten, or preprocessing changes"""
+    import rail_roi
+    digest = hashlib.sha256(f"rail_roi={rail_roi.ENABLED}".encode())
+    for path in paths:
+        stat = os.stat(path)
+        digest.update(f"{path}:{stat.st_size}:{stat.st_mtime_ns}".encode())
+    return digest.hexdigest()
+
+
+def load_scorer(model_path, batch_size):
+    """fn(float32 batch of exactly batch_size) -> raw scores, for any supported artifact"""
+    ext = os.path.splitext(model_path)[1].lower()
+    if ext in ('.h5', '.keras'):
+        from convert_to_tflite import load_keras_model
+        # CustomScaleLayer is needed to rebuild the graph; the focal loss isn't needed to predict
+        model = load_keras_model(model_path, compile=False)
+        return lambda batch: np.asarray(model.predict_on_batch(batch))[:, 0]
+
+    from inference_backends import BACKENDS, EXTENSIONS
+    names = {extension: name for name, extension in EXTENSIONS.items()}
+    if ext not in names:
+        raise ValueError(f"Unsupported model file {model_path}; expected .h5, .keras, "
+                         f"{', '.join(EXTENSIONS.values())}")
+    backend = BACKENDS[names[ext]](model_path, batch_sizes=(batch_size,))
+    return lambda batch: backend.run(batch)[:, 0]
+
+
+def score_dataset(model_path, paths, batch_size=32):
+    """Raw scores for every path, in fixed-size batches (the last one zero-padded)"""
+    from PIL import Image
+    from preprocessing import TARGET_SIZE, preprocess_image
+    scorer = load_scorer(model_path, batch_size)
+    batch = np.zeros((batch_size,) + TARGET_SIZE + (3,), dtype=np.float32)
+    scores = []
+    for start in range(0, len(paths), batch_size):
+        chunk = paths[start:start + batch_size]
+        for i, path in enumerate(chunk):
+            with Image.open(path) as img:
+                preprocess_image(img, out=batch[i:i + 1])
+        scores.extend(scorer(batch)[:len(chunk)].tolist())
+    return np.array(scores, dtype=np.float64)
+
+
+def cached_scores(model_path, data_dir=TEST_DIR, batch_size=32, cache_dir=CACHE_DIR):
+    """(scores, labels, paths, model_hash), scoring only if this artifact hasn't seen this dataset"""
+    paths, labels = dataset_files(data_dir)
+    model_hash = artifact_hash(model_path)
+    cache_path = os.path.join(cache_dir, f"{model_hash[:16]}-{dataset_hash(paths)[:16]}.npz")
+    if os.path.exists(cache_path):
+        cache = np.load(cache_path, allow_pickle=False)
+        print(f"Using cached scores for {model_path} from {cache_path}")
+        return cache['scores'], cache['labels'], list(cache['paths']), model_hash
+
+    print(f"Scoring {len(paths)} images in {data_dir} with {model_path}...")
+    started = time.perf_counter()
+    scores = score_dataset(model_path, paths, batch_size)
+    seconds = time.perf_counter() - started
+    print(f"   {seconds:.1f}s ({seconds / max(len(paths), 1) * 1000:.1f} ms/image)")
+
+    os.makedirs(cache_dir, exist_ok=True)
+    tmp = cache_path + '.tmp.npz'
+    np.savez(tmp, scores=scores, labels=labels, paths=np.array(paths), model_path=model_path,
+             model_sha256=model_hash, data_dir=data_dir, seconds=seconds)
+    os.replace(tmp, cache_path)
+    return scores, labels, paths, model_hash
+
+
+# ----------------------------------------------------------------------------
+# Vectorised metrics
+# ----------------------------------------------------------------------------
+
+def threshold_metrics(p_faulty, labels, thresholds):
+    """Confusion counts and metrics at every threshold, from two sorted arrays and searchsorted"""
+    thresholds = np.asarray(thresholds, dtype=np.float64)
+    pos = np.sort(p_faulty[labels == 1])
+    neg = np.sort(p_faulty[labels == 0])
+    tp = len(pos) - np.searchsorted(pos, thresholds, side='left')
+    fp = len(neg) - np.searchsorted(neg, thresholds, side='left')
+    fn, tn = len(pos) - tp, len(neg) - fp
+
+    precision = np.where(tp + fp > 0, tp / np.maximum(tp + fp, 1), 1.0)
+    recall = tp / max(len(pos), 1)
+    return {
+        'threshold': thresholds,
+        'tp': tp, 'fp': fp, 'fn': fn, 'tn': tn,
+        'precision': precision,
+        'recall': recall,
+        'specificity': tn / max(len(neg), 1),
+        'fpr': fp / max(len(neg), 1),
+        'f1': 2 * precision * recall / np.maximum(precision + recall, 1e-12),
+        'accuracy': (tp + tn) / max(len(labels), 1),
+    }
+
+
+def curves(p_faulty, labels):
+    """Exact ROC and PR curves (one point per distinct score), with ROC AUC and average precision"""
+    order = np.argsort(-p_faulty, kind='stable')
+    sorted_p, sorted_labels = p_faulty[order], labels[order]
+    tp = np.cumsum(sorted_labels)
+    fp = np.cumsum(1 - sorted_labels)
+    # Last index of each run of tied scores
+    last = np.r_[np.nonzero(np.diff(sorted_p))[0], len(sorted_p) - 1]
+    tp, fp, thresholds = tp[last], fp[last], sorted_p[last]
+
+    positives, negatives = max(int(labels.sum()), 1), max(int(len(labels) - labels.sum()), 1)
+    tpr = np.r_[0.0, tp / positives]
+    fpr = np.r_[0.0, fp / negatives]
+    precision = tp / np.maximum(tp + fp, 1)
+    recall = tp / positives
+    return {
+        'thresholds': thresholds,
+        'fpr': fpr,
+        'tpr': tpr,
+        'precision': precision,
+        'recall': recall,
+        'auc_roc': float(np.sum(np.diff(fpr) * (tpr[1:] + tpr[:-1]) / 2)),
+        'average_precision': float(np.sum(np.diff(np.r_[0.0, recall]) * precision)),
+    }
+
+
+def confidence_buckets(p_faulty, labels, buckets=10):
+    """Per P(Faulty) bucket: frames, mean predicted and observed Faulty rate; plus expected calibration error"""
+    edges = np.linspace(0.0, 1.0, buckets + 1)
+    index = np.clip(np.searchsorted(edges, p_faulty, side='right') - 1, 0, buckets - 1)
+    count = np.bincount(index, minlength=buckets)
+    mean_p = np.bincount(index, weights=p_faulty, minlength=buckets) / np.maximum(count, 1)
+    faulty_rate = np.bincount(index, weights=labels, minlength=buckets) / np.maximum(count, 1)
+    ece = float(np.sum(count * np.abs(mean_p - faulty_rate)) / max(len(labels), 1))
+    return {
+        'edges': edges,
+        'count': count,
+        'mean_p_faulty': mean_p,
+        'faulty_rate': faulty_rate,
+        'ece': ece,
+    }
+
+
+def summarize(scores, labels, thresholds=1001, buckets=10):
+    """Headline metrics, the threshold grid, curves and buckets for one artifact's scores"""
+    started = time.perf_counter()
+    p_faulty = 1.0 - np.asarray(scores, dtype=np.float64)
+    grid = threshold_metrics(p_faulty, labels, np.linspace(0.0, 1.0, thresholds))
+    curve = curves(p_faulty, labels)
+    calibration = confidence_buckets(p_faulty, labels, buckets)
+    at_half = threshold_metrics(p_faulty, labels, [0.5])
+    best = int(np.argmax(grid['f1']))
+
+    def point(metrics, i):
+        return {k: round(float(v[i]), 4) if v.dtype.kind == 'f' else int(v[i]) for k, v in metrics.items()}
+
+    return {
+        'images': int(len(labels)),
+        'faulty': int(labels.sum()),
+        'auc_roc': round(curve['auc_roc'], 4),
+        'average_precision': round(curve['average_precision'], 4),
+        'ece': round(calibration['ece'], 4),
+        'at_0.5': point(at_half, 0),
+        'best_f1': point(grid, best),
+        'grid': grid,
+        'curves': curve,
+        'buckets': calibration,
+        'metrics_ms': round((time.perf_counter() - started) * 1000, 2),
+    }
+
+
+def agreement(reference, scores):
+    """How closely one artifact's scores track another's on the same images"""
+    diff = np.abs(np.asarray(reference) - np.asarray(scores))
+    return {
+        'max_abs_diff': round(float(diff.max()) if len(diff) else 0.0, 6),
+        'mean_abs_diff': round(float(diff.mean()) if len(diff) else 0.0, 6),
+        'class_agreement': round(float(np.mean((reference >= 0.5) == (scores >= 0.5))) if len(diff) else 1.0, 4),
+    }
+
+
+def evaluate_artifacts(model_paths, data_dir=TEST_DIR, thresholds=1001, buckets=10, batch_size=32):
+    """Summaries for several artifacts on one dataset; the first is the reference for agreement"""
+    reports, reference = {}, None
+    for model_path in model_paths:
+        scores, labels, _, model_hash = cached_scores(model_path, data_dir, batch_size)
+        report = summarize(scores, labels, thresholds, buckets)
+        report['model_sha256'] = model_hash
+        if reference is None:
+            reference = scores
+        else:
+            report['vs_reference'] = agreement(reference, scores)
+        reports[model_path] = report
+    return reports
+
+
+# ----------------------------------------------------------------------------
+# Reporting
+# ----------------------------------------------------------------------------
+
+def _jsonable(value):
+    if isinstance(value, dict):
+        return {k: _jsonable(v) for k, v in value.items()}
+    if isinstance(value, np.ndarray):
+        return value.round(6).tolist() if value.dtype.kind == 'f' else value.tolist()
+    return value
+
+
+def print_report(reports):
+    print(f"\n{'Artifact':<36} {'AUC':>6} {'AP':>6} {'ECE':>6} {'F1@0.5':>7} "
+          f"{'Best F1':>8} {'@thr':>6} {'MaxDiff':>8} {'Agree':>6}")
+    print("-" * 100)
+    for path, r in reports.items():
+        vs = r.get('vs_reference')
+        max_diff = f"{vs['max_abs_diff']:.4f}" if vs else '-'
+        agree = f"{vs['class_agreement']:.1%}" if vs else '-'
+        print(f"{path[-36:]:<36} {r['auc_roc']:>6.3f} {r['average_precision']:>6.3f} {r['ece']:>6.3f} "
+              f"{r['at_0.5']['f1']:>7.3f} {r['best_f1']['f1']:>8.3f} {r['best_f1']['threshold']:>6.3f} "
+              f"{max_diff:>8} {agree:>6}")
+    for path, r in reports.items():
+        m = r['at_0.5']
+        print(f"\n{path}: {r['images']} images, metrics in {r['metrics_ms']} ms")
+        print(f"   Confusion at 0.5    TP {m['tp']}  FP {m['fp']}  FN {m['fn']}  TN {m['tn']}")
+        b = r['buckets']
+        rows = [f"{b['edges'][i]:.1f}-{b['edges'][i + 1]:.1f}: {b['count'][i]} frames, "
+                f"{b['faulty_rate'][i]:.0%} Faulty" for i in range(len(b['count'])) if b['count'][i]]
+        print("   Buckets             " + "\n                       ".join(rows))
+
+
+def plot_reports(reports, out_dir):
+    import matplotlib
+    matplotlib.use('Agg')
+    import matplotlib.pyplot as plt
+    os.makedirs(out_dir, exist_ok=True)
+    fig, (roc, pr) = plt.subplots(1, 2, figsize=(12, 5))
+    for path, r in reports.items():
+        c = r['curves']
+        name = os.path.basename(path)
+        roc.plot(c['fpr'], c['tpr'], label=f"{name} (AUC {r['auc_roc']:.3f})")
+        pr.plot(c['recall'], c['precision'], label=f"{name} (AP {r['average_precision']:.3f})")
+    roc.plot([0, 1], [0, 1], 'k--', linewidth=0.5)
+    roc.set(xlabel='False positive rate', ylabel='True positive rate', title='ROC')
+    pr.set(xlabel='Recall', ylabel='Precision', title='Precision-recall')
+    roc.legend(loc='lower right')
+    pr.legend(loc='lower left')
+    fig.tight_layout()
+    path = os.path.join(out_dir, 'roc_pr.png')
+    fig.savefig(path, dpi=120)
+    print(f"✅ Curves saved to {path}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Evaluate model artifacts from cached scores")
+    parser.add_argument('models', nargs='+', help="Artifacts to compare; the first is the reference")
+    parser.add_argument('--data-dir', default=TEST_DIR)
+    parser.add_argument('--thresholds', type=int, default=1001, help="Points in the threshold grid")
+    parser.add_argument('--buckets', type=int, default=10)
+    parser.add_argument('--batch-size', type=int, default=32)
+    parser.add_argument('--output', help="Write the full report, grid and curves included, as JSON")
+    parser.add_argument('--plot', metavar='DIR', help="Save ROC/PR curves (needs matplotlib)")
+    args = parser.parse_args()
+
+    reports = evaluate_artifacts(args.models, args.data_dir, args.thresholds, args.buckets, args.batch_size)
+    print_report(reports)
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(_jsonable(reports), f)
+        print(f"\n✅ Report written to {args.output}")
+    if args.plot:
+        plot_reports(reports, args.plot)
+
+
+if __name__ == '__main__':
+    main()
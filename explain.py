@@ -0,0 +1,208 @@
+"""
+Grad-CAM crack heatmaps for /explain/.
+
+TFLite has no gradients, so explanations use the Keras model the TFLite file
+was converted from (models/best_model.h5 by default). It is loaded on the
+first explanation request, never before. With explanations off, the serving
+path doesn't load or run anything extra.
+
+Grad-CAM weights each channel of the last convolutional feature map (conv_7b
+in InceptionResNetV2, 8x8 at 300x300 input) by the spatially averaged
+gradient of P(Faulty) = 1 - output with respect to it. The weighted sum,
+clipped at zero and scaled to 0-1, shows where the model sees the crack.
+
+Requests go through their own InferenceScheduler, so explanations waiting
+together share one forward and backward pass. Heatmaps are cached by the
+SHA-256 of the uploaded bytes, so explaining the same frame again costs
+nothing. A result is returned as a palette PNG overlay, or as JSON with the
+coarse heatmap, the peak, and the bounding box of the hot region in
+original image pixels.
+"""
+import io
+import hashlib
+import threading
+from collections import OrderedDict
+
+import numpy as np
+from PIL import Image
+
+import rail_roi
+from scheduler import InferenceScheduler
+
+
+class _Frame:
+    """A frame sized for the Keras model, and how it maps back to the original image"""
+    __slots__ = ('image', 'box')
+
+    def __init__(self, image, box):
+        self.image = image
+        self.box = box  # (left, top, right, bottom) in original pixels
+
+
+def colorize(cam):
+    """Jet-like RGB colormap for values in [0, 1]"""
+    four = 4 * cam[..., None]
+    rgb = np.clip(1.5 - np.abs(four - np.array([3.0, 2.0, 1.0])), 0, 1)
+    return (rgb * 255).astype(np.uint8)
+
+
+class GradCamExplainer:
+    def __init__(self, model_path, custom_objects=None, max_batch=8, cache_size=256, max_queue=64,
+                 layer_name=None):
+        self.model_path = model_path
+        self.custom_objects = custom_objects or {}
+        self.layer_name = layer_name
+        self.cache_size = cache_size
+        self.input_size = None
+        self.requests = 0
+        self.cache_hits = 0
+        self.passes = 0
+        self.explained = 0
+        self._grad_model = None
+        self._load_lock = threading.Lock()
+        self._cache = OrderedDict()
+        self._cache_lock = threading.Lock()
+        # Any batch size up to max_batch: the Keras model has a dynamic batch dimension
+        self.scheduler = InferenceScheduler(self._run_batch, range(1, max_batch + 1), max_queue)
+
+    @property
+    def loaded(self):
+        return self._grad_model is not None
+
+    def load(self):
+        """Load the Keras model and build the Grad-CAM graph; only the first call does any work"""
+        with self._load_lock:
+            if self._grad_model is not None:
+                return
+            import tensorflow as tf
+            model = tf.keras.models.load_model(self.model_path, custom_objects=self.custom_objects, compile=False)
+            if self.layer_name:
+                layer = model.get_layer(self.layer_name)
+            else:
+                # The last layer producing a spatial feature map: conv_7b_ac in InceptionResNetV2
+                layer = next((l for l in reversed(model.layers) if len(l.output.shape) == 4), None)
+                if layer is None:
+                    raise ValueError(f"{self.model_path} has no convolutional feature map to explain")
+            self._grad_model = tf.keras.Model(model.inputs, [layer.output, model.output])
+            self.input_size = tuple(int(d) for d in model.input_shape[1:3])[::-1]
+            self.layer = layer.name
+            self.scheduler.start()
+            print(f"✅ Grad-CAM ready on {self.model_path} (layer {layer.name}, input {self.input_size})")
+
+    # ------------------------------------------------------------------
+    # Cache
+    # ------------------------------------------------------------------
+
+    @staticmethod
+    def key(data):
+        return hashlib.sha256(data).hexdigest()
+
+    def cached(self, key):
+        self.requests += 1
+        with self._cache_lock:
+            entry = self._cache.get(key)
+            if entry is not None:
+                self._cache.move_to_end(key)
+                self.cache_hits += 1
+            return entry
+
+    def _store(self, key, entry):
+        with self._cache_lock:
+            self._cache[key] = entry
+            self._cache.move_to_end(key)
+            while len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+
+    # ------------------------------------------------------------------
+    # Explaining
+    # ------------------------------------------------------------------
+
+    def prepare(self, image: Image.Image):
+        """Crop (with RAIL_ROI) and resize like serving does, remembering the crop in original pixels"""
+        image = image.convert('RGB')
+        box = (0, 0, image.width, image.height)
+        if rail_roi.ENABLED:
+            box = rail_roi.find_rail_box(image) or box
+            image = image.crop(box)
+        image = image.resize(self.input_size, Image.Resampling.LANCZOS)
+        return _Frame(image, box)
+
+    def submit(self, key, frame, priority='interactive'):
+        """Queue a prepared frame; the Future resolves to its cache entry"""
+        return self.scheduler.submit((key, frame), priority)
+
+    def _run_batch(self, payloads):
+        import tensorflow as tf
+        pixels = np.stack([np.asarray(frame.image, dtype=np.float32) for _, frame in payloads]) / 127.5 - 1.0
+        inputs = tf.convert_to_tensor(pixels)
+        with tf.GradientTape() as tape:
+            features, outputs = self._grad_model(inputs, training=False)
+            # Samples are independent at inference, so one gradient of the sum covers the whole batch
+            p_faulty = 1.0 - outputs[:, 0]
+            target = tf.reduce_sum(p_faulty)
+        grads = tape.gradient(target, features)
+        weights = tf.reduce_mean(grads, axis=(1, 2), keepdims=True)
+        cams = tf.nn.relu(tf.reduce_sum(weights * features, axis=-1)).numpy()
+        p_faulty = p_faulty.numpy()
+        self.passes += 1
+        self.explained += len(payloads)
+
+        results = []
+        for (key, frame), cam, p in zip(payloads, cams, p_faulty):
+            peak = cam.max()
+            entry = {'heatmap': (cam / peak if peak > 0 else cam).astype(np.float32),
+                     'probability_faulty': float(p), 'frame': frame}
+            self._store(key, entry)
+            results.append(entry)
+        return results
+
+    # ------------------------------------------------------------------
+    # Rendering
+    # ------------------------------------------------------------------
+
+    def overlay_png(self, entry, alpha=0.45, colors=64):
+        """Heatmap blended over the model's view of the frame, as a palette PNG"""
+        if 'png' not in entry:
+            frame = entry['frame']
+            cam = Image.fromarray(entry['heatmap']).resize(frame.image.size, Image.Resampling.BILINEAR)
+            heat = colorize(np.clip(np.asarray(cam), 0, 1))
+            blended = (np.asarray(frame.image, dtype=np.float32) * (1 - alpha) + heat * alpha).astype(np.uint8)
+            buffer = io.BytesIO()
+            Image.fromarray(blended).quantize(colors).save(buffer, 'PNG', optimize=True)
+            entry['png'] = buffer.getvalue()
+        return entry['png']
+
+    def regions(self, entry, level=0.5):
+        """Coarse heatmap, peak and hot-region bounding box, in original image pixels"""
+        cam, frame = entry['heatmap'], entry['frame']
+        rows, cols = cam.shape
+        left, top, right, bottom = frame.box
+        cell_w, cell_h = (right - left) / cols, (bottom - top) / rows
+        peak_row, peak_col = np.unravel_index(int(np.argmax(cam)), cam.shape)
+        hot_rows, hot_cols = np.nonzero(cam >= level)
+        box = None
+        if len(hot_rows):
+            box = [round(left + hot_cols.min() * cell_w), round(top + hot_rows.min() * cell_h),
+                   round(left + (hot_cols.max() + 1) * cell_w), round(top + (hot_rows.max() + 1) * cell_h)]
+        return {
+            'probability_faulty': round(entry['probability_faulty'], 4),
+            'heatmap': np.round(cam, 3).tolist(),
+            'peak': [round(left + (peak_col + 0.5) * cell_w), round(top + (peak_row + 0.5) * cell_h)],
+            'hot_box': box,
+            'level': level,
+            'frame_box': [round(v) for v in frame.box],
+        }
+
+    def stats(self):
+        with self._cache_lock:
+            cached = len(self._cache)
+        return {
+            'loaded': self.loaded,
+            'model': self.model_path,
+            'requests': self.requests,
+            'cache_hits': self.cache_hits,
+            'cached': cached,
+            'passes': self.passes,
+            'explained': self.explained,
+            'mean_batch': round(self.explained / self.passes, 2) if self.passes else None,
+        }
@@ -0,0 +1,149 @@
+"""
+Feedback-driven frame sampling for on-train uploaders.
+
+Cameras can produce far more frames than the server can score. The sampler
+chooses an effective frame rate between a coverage floor and the camera's
+native rate, and drops the other frames before they are uploaded:
+
+- Coverage floor: consecutive kept frames must overlap on the ground by at
+  least min_overlap. At speed v, with each frame covering footprint_m of
+  track, that needs rate >= v / (footprint_m * (1 - min_overlap)).
+- Feedback: every interval the rate is cut multiplicatively while the
+  inference queue is deeper than target_queue_depth, and raised additively
+  while it is shallow. So overload lowers the frame rate instead of growing
+  a backlog.
+
+If the coverage floor alone exceeds what the server keeps up with, the floor
+wins and the decision is logged as coverage-limited. Kept frames are chosen
+by time (1 / rate apart). When frames carry odometer readings, a frame is
+also force-kept whenever skipping it would leave a gap in coverage, so a
+stale speed estimate can't open holes in the track.
+"""
+import json
+import time
+
+
+class FrameSampler:
+    def __init__(self, camera_fps=120.0, footprint_m=0.5, min_overlap=0.2, target_queue_depth=16,
+                 decrease=0.7, increase_fps=5.0, interval_s=0.5, min_fps=1.0, log_path=None):
+        self.camera_fps = camera_fps
+        self.min_fps = min_fps
+        self.footprint_m = footprint_m
+        self.min_overlap = min_overlap
+        self.target_queue_depth = target_queue_depth
+        self.decrease = decrease
+        self.increase_fps = increase_fps
+        self.interval_s = interval_s
+        self.log_path = log_path
+
+        self.rate = camera_fps
+        self.speed_mps = 0.0
+        self.queue_depth = 0
+        self.decisions = []
+        self.offered = 0
+        self.kept = 0
+        self.forced = 0
+        self._last_update = None
+        self._last_kept_ts = None
+        self._last_kept_m = None
+        self._last_fix = None
+        self._last_reason = None
+
+    @property
+    def max_spacing_m(self):
+        """Largest ground distance between kept frames that still meets the overlap floor"""
+        return self.footprint_m * (1 - self.min_overlap)
+
+    @property
+    def floor_rate(self):
+        # Frames come in whole camera-frame steps, so the floor is the native
+        # rate divided by the largest stride that stays within max_spacing_m
+        if self.speed_mps <= 0:
+            return min(self.camera_fps, self.min_fps)
+        stride = max(1, int(self.max_spacing_m * self.camera_fps / self.speed_mps))
+        return min(self.camera_fps, max(self.min_fps, self.camera_fps / stride))
+
+    def overlap(self, rate=None):
+        rate = rate or self.rate
+        if self.speed_mps <= 0:
+            return 1.0
+        return 1 - (self.speed_mps / rate) / self.footprint_m
+
+    def update(self, speed_mps=None, queue_depth=None, now=None):
+        """Feed the latest train speed and/or inference queue depth; adjusts the rate once per interval"""
+        now = time.monotonic() if now is None else now
+        if speed_mps is not None:
+            self.speed_mps = max(0.0, speed_mps)
+        if queue_depth is not None:
+            self.queue_depth = queue_depth
+        if self._last_update is not None and now - self._last_update < self.interval_s:
+            return self.rate
+        self._last_update = now
+
+        previous = self.rate
+        if self.queue_depth > self.target_queue_depth:
+            rate, reason = self.rate * self.decrease, 'backlog'
+        elif self.queue_depth < self.target_queue_depth / 2:
+            rate, reason = self.rate + self.increase_fps, 'headroom'
+        else:
+            rate, reason = self.rate, 'steady'
+
+        floor = self.floor_rate
+        if rate < floor:
+            rate = floor
+            reason = 'coverage-limited' if self.queue_depth > self.target_queue_depth else 'coverage-floor'
+        self.rate = min(rate, self.camera_fps)
+
+        if abs(self.rate - previous) > 1e-6 or reason == 'coverage-limited':
+            self._log({'ts': time.time(), 'reason': reason, 'rate_fps': round(self.rate, 2),
+                       'previous_fps': round(previous, 2), 'floor_fps': round(floor, 2),
+                       'speed_mps': round(self.speed_mps, 2), 'queue_depth': self.queue_depth,
+                       'overlap': round(self.overlap(), 3)})
+        return self.rate
+
+    def _log(self, decision):
+        self.decisions.append(decision)
+        del self.decisions[:-1000]
+        if decision['reason'] == 'coverage-limited' and self._last_reason != 'coverage-limited':
+            print(f"⚠️  Sampler at coverage floor {decision['rate_fps']} fps with queue depth "
+                  f"{decision['queue_depth']}: server is behind the minimum rate for full coverage")
+        if self.log_path:
+            with open(self.log_path, 'a') as f:
+                f.write(json.dumps(decision) + '\n')
+        self._last_reason = decision['reason']
+
+    def _observe_position(self, ts, odometer_m):
+        # Speed from consecutive odometer readings, smoothed
+        if self._last_fix is not None and ts > self._last_fix[0]:
+            measured = abs(odometer_m - self._last_fix[1]) / (ts - self._last_fix[0])
+            self.speed_mps = 0.8 * self.speed_mps + 0.2 * measured
+        self._last_fix = (ts, odometer_m)
+
+    def offer(self, timestamp=None, odometer_m=None, speed_mps=None):
+        """Whether to upload this frame; call for every frame the camera produces"""
+        ts = time.time() if timestamp is None else timestamp
+        self.offered += 1
+        # The last frame-to-frame step predicts the next one even while the smoothed speed lags
+        step = abs(odometer_m - self._last_fix[1]) if odometer_m is not None and self._last_fix else 0.0
+        if speed_mps is not None:
+            self.speed_mps = speed_mps
+        elif odometer_m is not None:
+            self._observe_position(ts, odometer_m)
+
+        keep = self._last_kept_ts is None or ts - self._last_kept_ts >= 1.0 / self.rate - 1e-9
+        # Keep this frame if waiting for the next one would overshoot the spacing limit
+        next_step = max(step, self.speed_mps / self.camera_fps)
+        if not keep and odometer_m is not None and self._last_kept_m is not None \
+                and abs(odometer_m - self._last_kept_m) + next_step > self.max_spacing_m:
+            keep = True
+            self.forced += 1
+        if keep:
+            self.kept += 1
+            self._last_kept_ts = ts
+            self._last_kept_m = odometer_m
+        return keep
+
+    def stats(self):
+        return {'rate_fps': round(self.rate, 2), 'floor_fps': round(self.floor_rate, 2),
+                'speed_mps': round(self.speed_mps, 2), 'queue_depth': self.queue_depth,
+                'offered': self.offered, 'kept': self.kept, 'forced_for_coverage': self.forced}
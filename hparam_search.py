@@ -0,0 +1,331 @@
+"""
+Parallel hyperparameter search for the crack model, with median pruning.
+
+train_models.py and src/models/train_model.py hand-pick different values for
+the same knobs: input size, batch size, loss, unfrozen layers and dropout.
+This searches them on the production architecture
+(src/models/train_model.build_model) and data/processed:
+
+- Trials run concurrently in a spawned process pool, one trial per process.
+  Each trial gets a bounded number of TensorFlow threads, so the trials
+  together don't oversubscribe the cores.
+- train and validation are decoded and resized once per input size into
+  uint8 .npy files in data/search_cache. Every trial memory-maps them, so no
+  trial decodes an image, and the page cache holds one copy for all
+  processes.
+- After each epoch a trial appends its validation AUC to trials.jsonl. From
+  warmup_epochs on, it stops (is pruned) when its best AUC so far is below
+  the median of the other trials' best at the same epoch.
+- Parameters come from a seeded per-trial RNG and every event is appended
+  to trials.jsonl. So re-running the same command skips finished trials and
+  re-runs interrupted ones with identical parameters.
+
+Usage:
+    python hparam_search.py --trials 24 --workers 4 --threads-per-trial 2 --epochs 12
+    python hparam_search.py --study runs/search --report
+"""
+import os
+import sys
+import json
+import time
+import uuid
+import fcntl
+import hashlib
+import argparse
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import numpy as np
+
+DATA_DIR = os.path.join('data', 'processed')
+CACHE_DIR = os.path.join('data', 'search_cache')
+STUDY_DIR = os.path.join('runs', 'search')
+CLASSES = ('Faulty', 'Normal')
+
+# (kind, choices) or (kind, low, high)
+SEARCH_SPACE = {
+    'img_size': ('choice', [299, 300]),
+    'batch_size': ('choice', [16, 32]),
+    'learning_rate': ('log', 1e-5, 1e-3),
+    'loss': ('choice', ['focal', 'binary_crossentropy']),
+    'focal_gamma': ('uniform', 1.0, 3.0),
+    'focal_alpha': ('uniform', 0.25, 0.75),
+    'unfrozen_layers': ('choice', [0, 50, 150]),
+    'dropout': ('uniform', 0.1, 0.5),
+    'dense_units': ('choice', [512, 1024]),
+}
+
+
+def sample_params(seed, trial):
+    """Parameters for a trial; the same (seed, trial) always gives the same values"""
+    rng = np.random.default_rng([seed, trial])
+    params = {}
+    for name, (kind, *spec) in SEARCH_SPACE.items():
+        if kind == 'choice':
+            value = spec[0][int(rng.integers(len(spec[0])))]
+        elif kind == 'log':
+            value = float(np.exp(rng.uniform(np.log(spec[0]), np.log(spec[1]))))
+        else:
+            value = float(rng.uniform(spec[0], spec[1]))
+        params[name] = value.item() if isinstance(value, np.generic) else value
+    return params
+
+
+# ----------------------------------------------------------------------------
+# Preprocessed data cache
+# ----------------------------------------------------------------------------
+
+def _split_files(split_dir):
+    import glob
+    paths, labels = [], []
+    for label, cls in enumerate(CLASSES):
+        for path in sorted(glob.glob(os.path.join(split_dir, cls, '*'))):
+            paths.append(path)
+            labels.append(label)
+    return paths, np.array(labels, dtype=np.float32)
+
+
+def cached_split(split, img_size, data_dir=DATA_DIR, cache_dir=CACHE_DIR):
+    """(images .npy path, labels .npy path) for a split decoded at img_size, building them if needed"""
+    from PIL import Image
+    import rail_roi
+    paths, labels = _split_files(os.path.join(data_dir, split))
+    digest = hashlib.sha256(f"{img_size}:rail_roi={rail_roi.ENABLED}".encode())
+    for path in paths:
+        stat = os.stat(path)
+        digest.update(f"{path}:{stat.st_size}:{stat.st_mtime_ns}".encode())
+    stem = os.path.join(cache_dir, f"{split}_{img_size}_{digest.hexdigest()[:16]}")
+    images_path, labels_path = stem + '_x.npy', stem + '_y.npy'
+    if os.path.exists(images_path) and os.path.exists(labels_path):
+        return images_path, labels_path
+
+    print(f"Decoding {len(paths)} {split} images at {img_size}x{img_size} into {cache_dir}...")
+    os.makedirs(cache_dir, exist_ok=True)
+    # Labels as flow_from_directory assigns them, so the target is P(Normal) like the served model
+    images = np.lib.format.open_memmap(images_path + '.tmp', mode='w+', dtype=np.uint8,
+                                       shape=(len(paths), img_size, img_size, 3))
+    for i, path in enumerate(paths):
+        with Image.open(path) as img:
+            img = img.convert('RGB')
+            if rail_roi.ENABLED:
+                img = rail_roi.crop_to_rails(img)
+            images[i] = np.asarray(img.resize((img_size, img_size), Image.Resampling.LANCZOS))
+    images.flush()
+    del images
+    os.replace(images_path + '.tmp', images_path)
+    np.save(labels_path, labels)
+    return images_path, labels_path
+
+
+# ----------------------------------------------------------------------------
+# Study log
+# ----------------------------------------------------------------------------
+
+def append_record(study_dir, record):
+    """Append one JSON line under an exclusive lock, so concurrent trials never interleave"""
+    with open(os.path.join(study_dir, 'trials.jsonl'), 'a') as f:
+        fcntl.flock(f, fcntl.LOCK_EX)
+        f.write(json.dumps(dict(record, ts=time.time())) + '\n')
+        f.flush()
+        fcntl.flock(f, fcntl.LOCK_UN)
+
+
+def read_records(study_dir):
+    path = os.path.join(study_dir, 'trials.jsonl')
+    if not os.path.exists(path):
+        return []
+    records = []
+    with open(path) as f:
+        for line in f:
+            try:
+                records.append(json.loads(line))
+            except json.JSONDecodeError:
+                # A line cut short by a crash
+                continue
+    return records
+
+
+def finished_trials(records):
+    """trial -> its terminal record (complete, pruned or failed)"""
+    return {r['trial']: r for r in records if r['event'] in ('complete', 'pruned', 'failed')}
+
+
+def should_prune(records, run_id, epoch, best_value, warmup_epochs=3, min_trials=4):
+    """Median rule: prune when this run's best so far is below the median of other runs' best at this epoch"""
+    if epoch < warmup_epochs:
+        return False
+    best_by_run = {}
+    for r in records:
+        if r['event'] == 'epoch' and r['run'] != run_id and r['epoch'] <= epoch:
+            best_by_run[r['run']] = max(best_by_run.get(r['run'], float('-inf')), r['value'])
+    # Only runs that got as far as this epoch
+    reached = {r['run'] for r in records if r['event'] == 'epoch' and r['epoch'] == epoch and r['run'] != run_id}
+    others = [best_by_run[run] for run in reached]
+    if len(others) < min_trials:
+        return False
+    return best_value < float(np.median(others))
+
+
+# ----------------------------------------------------------------------------
+# Trials
+# ----------------------------------------------------------------------------
+
+def _init_worker(threads):
+    # Before TensorFlow is imported in this process, so every pool it creates is bounded
+    os.environ['OMP_NUM_THREADS'] = str(threads)
+    os.environ['TF_NUM_INTRAOP_THREADS'] = str(threads)
+    os.environ['TF_NUM_INTEROP_THREADS'] = '1'
+    os.environ.setdefault('TF_CPP_MIN_LOG_LEVEL', '2')
+    import tensorflow as tf
+    tf.config.threading.set_intra_op_parallelism_threads(threads)
+    tf.config.threading.set_inter_op_parallelism_threads(1)
+
+
+def _batches(images, labels, batch_size, shuffle, seed):
+    """Endless (x, y) batches from the memory-mapped cache, scaled like preprocess_input"""
+    rng = np.random.default_rng(seed)
+    while True:
+        order = rng.permutation(len(labels)) if shuffle else np.arange(len(labels))
+        for start in range(0, len(order), batch_size):
+            # Sorted indices read the memmap sequentially
+            index = np.sort(order[start:start + batch_size])
+            x = images[index].astype(np.float32) / 127.5 - 1.0
+            if shuffle:
+                flip = rng.random(len(index)) < 0.5
+                x[flip] = x[flip, :, ::-1]
+            yield x, labels[index]
+
+
+def run_trial(trial, params, data, study_dir, epochs, warmup_epochs, min_trials, pretrained=True):
+    """Train one configuration epoch by epoch, reporting validation AUC and pruning early; runs in a worker"""
+    import tensorflow as tf
+    sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), 'src', 'models'))
+    from train_model import build_model, focal_loss
+
+    run_id = uuid.uuid4().hex
+    started = time.time()
+    append_record(study_dir, {'trial': trial, 'run': run_id, 'event': 'start', 'params': params, 'pid': os.getpid()})
+
+    (train_x, train_y), (val_x, val_y) = [
+        (np.load(x, mmap_mode='r'), np.load(y)) for x, y in data[params['img_size']]
+    ]
+    tf.random.set_seed(trial)
+    model = build_model((params['img_size'], params['img_size'], 3), params['unfrozen_layers'],
+                        params['dropout'], dense_units=params['dense_units'],
+                        weights='imagenet' if pretrained else None)
+    loss = (focal_loss(params['focal_gamma'], params['focal_alpha']) if params['loss'] == 'focal'
+            else 'binary_crossentropy')
+    model.compile(optimizer=tf.keras.optimizers.Adam(params['learning_rate']), loss=loss,
+                  metrics=[tf.keras.metrics.AUC(name='auc')])
+
+    batch_size = params['batch_size']
+    train = _batches(train_x, train_y, batch_size, True, trial)
+    steps = max(1, -(-len(train_y) // batch_size))
+    val_steps = max(1, -(-len(val_y) // batch_size))
+    best, history = float('-inf'), []
+    for epoch in range(1, epochs + 1):
+        model.fit(train, steps_per_epoch=steps, epochs=1, shuffle=False, verbose=0)
+        value = float(model.evaluate(_batches(val_x, val_y, batch_size, False, 0), steps=val_steps,
+                                     verbose=0, return_dict=True)['auc'])
+        best = max(best, value)
+        history.append(round(value, 4))
+        append_record(study_dir, {'trial': trial, 'run': run_id, 'event': 'epoch', 'epoch': epoch, 'value': value})
+        if epoch < epochs and should_prune(read_records(study_dir), run_id, epoch, best, warmup_epochs, min_trials):
+            record = {'trial': trial, 'run': run_id, 'event': 'pruned', 'epoch': epoch, 'value': best,
+                      'params': params, 'history': history, 'seconds': round(time.time() - started, 1)}
+            append_record(study_dir, record)
+            return record
+
+    record = {'trial': trial, 'run': run_id, 'event': 'complete', 'epoch': epochs, 'value': best,
+              'params': params, 'history': history, 'seconds': round(time.time() - started, 1)}
+    append_record(study_dir, record)
+    return record
+
+
+# ----------------------------------------------------------------------------
+# Driver
+# ----------------------------------------------------------------------------
+
+def search(trials=24, workers=2, threads_per_trial=None, epochs=12, warmup_epochs=3, min_trials=4,
+           seed=42, study_dir=STUDY_DIR, data_dir=DATA_DIR, pretrained=True):
+    os.makedirs(study_dir, exist_ok=True)
+    threads_per_trial = threads_per_trial or max(1, (os.cpu_count() or 1) // workers)
+    done = finished_trials(read_records(study_dir))
+    pending = [t for t in range(trials) if t not in done]
+    print(f"🔎 Study {study_dir}: {len(done)} of {trials} trials already finished, {len(pending)} to run "
+          f"on {workers} workers x {threads_per_trial} threads")
+    if not pending:
+        return report(study_dir)
+
+    plans = {t: sample_params(seed, t) for t in pending}
+    # Decode every split once, in this process, before any trial starts
+    data = {size: (cached_split('train', size, data_dir), cached_split('validation', size, data_dir))
+            for size in sorted({p['img_size'] for p in plans.values()})}
+
+    # spawn, not fork: TensorFlow is not fork-safe; one trial per process releases its memory
+    context = multiprocessing.get_context('spawn')
+    with ProcessPoolExecutor(workers, mp_context=context, initializer=_init_worker,
+                             initargs=(threads_per_trial,), max_tasks_per_child=1) as pool:
+        futures = {pool.submit(run_trial, t, plans[t], data, study_dir, epochs, warmup_epochs,
+                               min_trials, pretrained): t for t in pending}
+        for future in as_completed(futures):
+            trial = futures[future]
+            try:
+                r = future.result()
+                mark = '✂️ ' if r['event'] == 'pruned' else '✅'
+                print(f"{mark} Trial {trial} {r['event']} at epoch {r['epoch']}: "
+                      f"best val AUC {r['value']:.4f} ({r['seconds']}s)")
+            except Exception as e:
+                append_record(study_dir, {'trial': trial, 'run': None, 'event': 'failed',
+                                          'params': plans[trial], 'error': str(e)})
+                print(f"❌ Trial {trial} failed: {e}")
+    return report(study_dir)
+
+
+def report(study_dir=STUDY_DIR, top=10):
+    """Print the leaderboard and write best.json; returns the best finished record"""
+    finished = list(finished_trials(read_records(study_dir)).values())
+    scored = sorted((r for r in finished if r['event'] != 'failed'), key=lambda r: -r['value'])
+    counts = {e: sum(r['event'] == e for r in finished) for e in ('complete', 'pruned', 'failed')}
+    print(f"\n{counts['complete']} complete, {counts['pruned']} pruned, {counts['failed']} failed")
+    print(f"{'Trial':>5} {'Status':<9} {'Epochs':>6} {'AUC':>7}  Params")
+    print("-" * 100)
+    for r in scored[:top]:
+        params = ', '.join(f"{k}={round(v, 6) if isinstance(v, float) else v}" for k, v in r['params'].items())
+        print(f"{r['trial']:>5} {r['event']:<9} {r['epoch']:>6} {r['value']:>7.4f}  {params}")
+
+    complete = [r for r in scored if r['event'] == 'complete']
+    best = complete[0] if complete else (scored[0] if scored else None)
+    if best:
+        with open(os.path.join(study_dir, 'best.json'), 'w') as f:
+            json.dump(best, f, indent=2)
+        print(f"\n✅ Best trial {best['trial']} (val AUC {best['value']:.4f}) written to "
+              f"{os.path.join(study_dir, 'best.json')}")
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Parallel hyperparameter search with median pruning")
+    parser.add_argument('--trials', type=int, default=24)
+    parser.add_argument('--workers', type=int, default=2, help="Trials run at once")
+    parser.add_argument('--threads-per-trial', type=int, help="Default: CPU cores / workers")
+    parser.add_argument('--epochs', type=int, default=12)
+    parser.add_argument('--warmup-epochs', type=int, default=3, help="Epochs before a trial can be pruned")
+    parser.add_argument('--min-trials', type=int, default=4, help="Other trials needed at an epoch to prune")
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--study', default=STUDY_DIR, help="Study directory; re-run to resume")
+    parser.add_argument('--data-dir', default=DATA_DIR)
+    parser.add_argument('--no-pretrained', action='store_true',
+                        help="Random backbone weights, for quick dry runs without downloading ImageNet weights")
+    parser.add_argument('--report', action='store_true', help="Only print the leaderboard")
+    args = parser.parse_args()
+
+    if args.report:
+        report(args.study)
+        return
+    search(args.trials, args.workers, args.threads_per_trial, args.epochs, args.warmup_epochs,
+           args.min_trials, args.seed, args.study, args.data_dir, not args.no_pretrained)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,269 @@
+"""
+Inference backends behind one interface.
+
+Every backend scores a float32 NHWC batch that has already been preprocessed
+(x / 127.5 - 1) and returns its (N, 1) P(Normal) output:
+
+    tflite       models/model.tflite   tf.lite.Interpreter (default)
+    onnxruntime  models/model.onnx     ONNX Runtime, CPU execution provider
+    openvino     models/model.xml      OpenVINO, CPU plugin
+
+The ONNX and OpenVINO files are exported next to the .tflite by
+convert_to_tflite.py --format, and are found by swapping the extension.
+INFERENCE_BACKEND selects one by name. With auto, every backend whose
+runtime is installed and whose file exists is benchmarked. Backends whose
+scores on data/processed/test don't match TFLite are rejected, and the
+fastest of the rest is used. The choice is cached next to the model,
+keyed by its hash, so workers and restarts don't repeat the work.
+"""
+import os
+import glob
+import json
+import time
+import hashlib
+import numpy as np
+
+TEST_DIR = os.path.join('data', 'processed', 'test')
+EXTENSIONS = {'tflite': '.tflite', 'onnxruntime': '.onnx', 'openvino': '.xml'}
+RUNTIME_MODULES = {'tflite': 'tensorflow', 'onnxruntime': 'onnxruntime', 'openvino': 'openvino'}
+
+# Scores are probabilities, so these are absolute differences in P(Normal)
+PARITY_MAX_DIFF = float(os.getenv('PARITY_MAX_DIFF', '0.05'))
+PARITY_MIN_AGREEMENT = float(os.getenv('PARITY_MIN_AGREEMENT', '0.99'))
+
+
+def tflite_interpreter_options(num_threads=None, shared_weights=False):
+    """
+    Keyword arguments for tf.lite.Interpreter.
+
+    Interpreters are always built from model_path, which memory-maps the
+    .tflite file read-only, so every worker process shares one page-cache copy
+    of the weights. The XNNPACK delegate repacks weights into private memory
+    per interpreter, though; shared_weights turns it off so kernels read the
+    weights straight from the shared mapping, trading some latency for
+    per-worker memory.
+    """
+    import tensorflow as tf
+    options = {}
+    if num_threads:
+        options['num_threads'] = num_threads
+    if shared_weights:
+        options['experimental_op_resolver_type'] = \
+            tf.lite.experimental.OpResolverType.BUILTIN_WITHOUT_DEFAULT_DELEGATES
+    return options
+
+
+class TFLiteBackend:
+    name = 'tflite'
+
+    def __init__(self, path, batch_sizes=(1,), num_threads=None, shared_weights=False):
+        import tensorflow as tf
+        self.path = path
+        # One interpreter per batch shape, so no batch ever triggers a re-allocation
+        self.interpreters = {}
+        for batch_size in batch_sizes:
+            interpreter = tf.lite.Interpreter(model_path=path,
+                                              **tflite_interpreter_options(num_threads, shared_weights))
+            details = interpreter.get_input_details()[0]
+            if batch_size != details['shape'][0]:
+                interpreter.resize_tensor_input(details['index'], [batch_size, *details['shape'][1:]])
+            interpreter.allocate_tensors()
+            self.interpreters[batch_size] = interpreter
+        first = next(iter(self.interpreters.values()))
+        self.input_index = first.get_input_details()[0]['index']
+        self.output_index = first.get_output_details()[0]['index']
+        self.input_shape = tuple(int(d) for d in first.get_input_details()[0]['shape'][1:])
+
+    def run(self, batch):
+        interpreter = self.interpreters[len(batch)]
+        interpreter.set_tensor(self.input_index, batch)
+        interpreter.invoke()
+        return interpreter.get_tensor(self.output_index)
+
+
+class OnnxRuntimeBackend:
+    name = 'onnxruntime'
+
+    def __init__(self, path, batch_sizes=(1,), num_threads=None, shared_weights=False):
+        import onnxruntime as ort
+        self.path = path
+        options = ort.SessionOptions()
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        if num_threads:
+            options.intra_op_num_threads = num_threads
+            options.inter_op_num_threads = 1
+        # The exported graph has a dynamic batch dimension, so one session serves every batch size
+        self.session = ort.InferenceSession(path, options, providers=['CPUExecutionProvider'])
+        model_input = self.session.get_inputs()[0]
+        self.input_name = model_input.name
+        self.input_shape = tuple(int(d) for d in model_input.shape[1:])
+
+    def run(self, batch):
+        return self.session.run(None, {self.input_name: batch})[0]
+
+
+class OpenVINOBackend:
+    name = 'openvino'
+
+    def __init__(self, path, batch_sizes=(1,), num_threads=None, shared_weights=False):
+        import openvino as ov
+        self.path = path
+        core = ov.Core()
+        config = {'PERFORMANCE_HINT': 'LATENCY'}
+        if num_threads:
+            config['INFERENCE_NUM_THREADS'] = num_threads
+        model = core.read_model(path)
+        self.input_shape = tuple(d.get_length() for d in model.inputs[0].get_partial_shape()[1:])
+        # Static shapes compile to faster CPU kernels than a dynamic batch dimension
+        self.requests = {}
+        for batch_size in batch_sizes:
+            # reshape() changes the model in place, so each batch size gets its own copy
+            static = model.clone()
+            static.reshape([batch_size, *self.input_shape])
+            self.requests[batch_size] = core.compile_model(static, 'CPU', config).create_infer_request()
+
+    def run(self, batch):
+        request = self.requests[len(batch)]
+        request.infer({0: batch})
+        return request.get_output_tensor(0).data.copy()
+
+
+BACKENDS = {b.name: b for b in (TFLiteBackend, OnnxRuntimeBackend, OpenVINOBackend)}
+
+
+def backend_path(model_path, name):
+    """The file a backend loads for a model, e.g. models/model.onnx for models/model.tflite"""
+    return os.path.splitext(model_path)[0] + EXTENSIONS[name]
+
+
+def runtime_installed(name):
+    import importlib.util
+    return importlib.util.find_spec(RUNTIME_MODULES[name]) is not None
+
+
+def available_backends(model_path):
+    return [name for name in BACKENDS
+            if runtime_installed(name) and os.path.exists(backend_path(model_path, name))]
+
+
+def create_backend(name, model_path, batch_sizes=(1,), num_threads=None, shared_weights=False):
+    if name not in BACKENDS:
+        raise ValueError(f"Unknown backend '{name}'; available: {', '.join(BACKENDS)}, auto")
+    return BACKENDS[name](backend_path(model_path, name), batch_sizes, num_threads, shared_weights)
+
+
+def load_backend(name, model_path, batch_sizes=(1,), num_threads=None, shared_weights=False):
+    """A backend by name, or the fastest parity-checked one for 'auto'"""
+    if name not in BACKENDS and name != 'auto':
+        raise ValueError(f"Unknown backend '{name}'; available: {', '.join(BACKENDS)}, auto")
+    if name == 'auto':
+        name = select_backend(model_path, num_threads)
+    elif name != 'tflite' and name not in available_backends(model_path):
+        print(f"⚠️  Backend {name} unavailable for {model_path} "
+              f"(runtime not installed or {backend_path(model_path, name)} missing); using tflite")
+        name = 'tflite'
+    return create_backend(name, model_path, batch_sizes, num_threads, shared_weights)
+
+
+# ----------------------------------------------------------------------------
+# Parity and benchmarking
+# ----------------------------------------------------------------------------
+
+def test_images(data_dir=TEST_DIR, limit=None):
+    from PIL import Image
+    from preprocessing import TARGET_SIZE, preprocess_image
+    paths = sorted(p for cls in ('Faulty', 'Normal') for p in glob.glob(os.path.join(data_dir, cls, '*')))
+    if limit:
+        # Spread the sample over both classes
+        paths = paths[::max(1, len(paths) // limit)][:limit]
+    images = np.empty((len(paths),) + TARGET_SIZE + (3,), dtype=np.float32)
+    for i, path in enumerate(paths):
+        with Image.open(path) as img:
+            preprocess_image(img, out=images[i:i + 1])
+    return images
+
+
+def score(backend, images):
+    return np.array([float(backend.run(images[i:i + 1])[0][0]) for i in range(len(images))])
+
+
+def parity_check(reference, candidate, images):
+    """How closely a backend's scores track the reference (TFLite) on the same inputs"""
+    ref, cand = score(reference, images), score(candidate, images)
+    diff = np.abs(ref - cand)
+    agreement = float(np.mean((ref >= 0.5) == (cand >= 0.5))) if len(ref) else 1.0
+    return {
+        'images': len(ref),
+        'max_abs_diff': round(float(diff.max()) if len(diff) else 0.0, 6),
+        'mean_abs_diff': round(float(diff.mean()) if len(diff) else 0.0, 6),
+        'class_agreement': round(agreement, 4),
+        'passed': bool((not len(diff) or diff.max() <= PARITY_MAX_DIFF) and agreement >= PARITY_MIN_AGREEMENT),
+    }
+
+
+def benchmark(backend, runs=20, batch_size=1):
+    """Median latency in ms of one batch, after a couple of warm-up runs"""
+    sample = np.random.default_rng(0).uniform(-1, 1, (batch_size, *backend.input_shape)).astype(np.float32)
+    for _ in range(2):
+        backend.run(sample)
+    times = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        backend.run(sample)
+        times.append((time.perf_counter() - start) * 1000)
+    return float(np.median(times))
+
+
+def compare_backends(model_path, num_threads=None, data_dir=TEST_DIR, parity_limit=None, runs=20):
+    """Latency and TFLite parity for every available backend of a model"""
+    images = test_images(data_dir, parity_limit)
+    reference = create_backend('tflite', model_path, num_threads=num_threads)
+    report = {}
+    for name in available_backends(model_path):
+        try:
+            backend = reference if name == 'tflite' else create_backend(name, model_path, num_threads=num_threads)
+            report[name] = {'latency_ms': round(benchmark(backend, runs), 3)}
+            report[name]['parity'] = parity_check(reference, backend, images) if name != 'tflite' else None
+        except Exception as e:
+            report[name] = {'error': str(e)}
+    return report
+
+
+def _model_hash(model_path):
+    digest = hashlib.sha256()
+    for name in BACKENDS:
+        path = backend_path(model_path, name)
+        if os.path.exists(path):
+            digest.update(name.encode())
+            with open(path, 'rb') as f:
+                for chunk in iter(lambda: f.read(1 << 20), b''):
+                    digest.update(chunk)
+    return digest.hexdigest()
+
+
+def select_backend(model_path, num_threads=None, parity_limit=64):
+    """Fastest backend that passes parity against TFLite; cached per model files and thread count"""
+    cache_path = os.path.join(os.path.dirname(model_path) or '.', 'backend_selection.json')
+    key = f"{_model_hash(model_path)}:{num_threads}:{','.join(available_backends(model_path))}"
+    if os.path.exists(cache_path):
+        with open(cache_path) as f:
+            cached = json.load(f)
+        if cached.get('key') == key:
+            return cached['backend']
+
+    report = compare_backends(model_path, num_threads, parity_limit=parity_limit)
+    eligible = {name: r['latency_ms'] for name, r in report.items()
+                if 'error' not in r and (r['parity'] is None or r['parity']['passed'])}
+    chosen = min(eligible, key=eligible.get) if eligible else 'tflite'
+    for name, r in report.items():
+        print(f"   {name:<12} {r}")
+    print(f"✅ Selected backend {chosen} for {model_path}")
+
+    try:
+        tmp = cache_path + '.tmp'
+        with open(tmp, 'w') as f:
+            json.dump({'key': key, 'backend': chosen, 'report': report}, f, indent=2)
+        os.replace(tmp, cache_path)
+    except OSError:
+        pass
+    return chosen
@@ -0,0 +1,352 @@
+"""
+Versioned TFLite model registry with zero-downtime hot reload.
+
+Layout under models/registry/:
+    registry.json            {"active": "v2", "history": ["v1"], "versions": {...}}
+    v1/model.tflite
+    v2/model.tflite
+
+registry.json is the single source of truth: the admin endpoints and the CLI
+below only rewrite it, and every server process watches it and swaps to the
+active version in the background. Without a registry the server falls back
+to the legacy models/model.tflite.
+
+Usage:
+    python model_registry.py list
+    python model_registry.py register models/student.tflite [--version v3] [--activate]
+    python model_registry.py activate v2
+    python model_registry.py rollback
+"""
+import os
+import json
+import time
+import shutil
+import hashlib
+import threading
+from contextlib import contextmanager
+from datetime import datetime, timezone
+
+import numpy as np
+
+import inference_backends
+from calibration import Calibration, calibration_path
+from preprocessing import preprocess_image
+
+REGISTRY_DIR = os.path.join('models', 'registry')
+REGISTRY_FILE = os.path.join(REGISTRY_DIR, 'registry.json')
+LEGACY_MODEL_PATH = os.path.join('models', 'model.tflite')
+LEGACY_VERSION = 'legacy'
+WATCH_INTERVAL_SECONDS = 5.0
+
+
+# ----------------------------------------------------------------------------
+# Registry file
+# ----------------------------------------------------------------------------
+
+def load_registry(registry_file=REGISTRY_FILE):
+    if not os.path.exists(registry_file):
+        return {'active': None, 'history': [], 'versions': {}}
+    with open(registry_file) as f:
+        return json.load(f)
+
+
+def save_registry(registry, registry_file=REGISTRY_FILE):
+    """Atomic write, so watchers never see a half-written file"""
+    os.makedirs(os.path.dirname(registry_file), exist_ok=True)
+    tmp = registry_file + '.tmp'
+    with open(tmp, 'w') as f:
+        json.dump(registry, f, indent=2)
+    os.replace(tmp, registry_file)
+
+
+def file_sha256(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def register_model(tflite_path, version=None, activate=False, registry_file=REGISTRY_FILE):
+    """Copy a .tflite file into the registry as a new immutable version"""
+    registry = load_registry(registry_file)
+    if version is None:
+        version = f"v{len(registry['versions']) + 1}"
+    if version in registry['versions']:
+        raise ValueError(f"Version {version} already registered")
+
+    version_dir = os.path.join(os.path.dirname(registry_file), version)
+    os.makedirs(version_dir, exist_ok=True)
+    dest = os.path.join(version_dir, 'model.tflite')
+    shutil.copy2(tflite_path, dest)
+    sha256 = file_sha256(dest)
+
+    # ONNX / OpenVINO exports of the same model travel with it (OpenVINO keeps weights in a .bin)
+    for name in inference_backends.EXTENSIONS:
+        export = inference_backends.backend_path(tflite_path, name)
+        if name != 'tflite' and os.path.exists(export):
+            shutil.copy2(export, inference_backends.backend_path(dest, name))
+            if name == 'openvino' and os.path.exists(os.path.splitext(export)[0] + '.bin'):
+                shutil.copy2(os.path.splitext(export)[0] + '.bin', os.path.join(version_dir, 'model.bin'))
+
+    # Carry over a calibration fitted for exactly this model file
+    calibration_file = calibration_path(tflite_path)
+    if os.path.exists(calibration_file):
+        with open(calibration_file) as f:
+            if json.load(f).get('model_sha256') == sha256:
+                shutil.copy2(calibration_file, calibration_path(dest))
+
+    registry['versions'][version] = {
+        'path': dest,
+        'source': tflite_path,
+        'sha256': sha256,
+        'registered_at': datetime.now(timezone.utc).isoformat(),
+    }
+    save_registry(registry, registry_file)
+    if activate:
+        activate_version(version, registry_file)
+    return version
+
+
+def activate_version(version, registry_file=REGISTRY_FILE):
+    registry = load_registry(registry_file)
+    if version not in registry['versions']:
+        raise ValueError(f"Unknown version {version}")
+    if registry['active'] and registry['active'] != version:
+        registry['history'].append(registry['active'])
+    registry['active'] = version
+    save_registry(registry, registry_file)
+    return version
+
+
+def rollback(registry_file=REGISTRY_FILE):
+    """Re-activate the previously active version"""
+    registry = load_registry(registry_file)
+    if not registry['history']:
+        raise ValueError("No previous version to roll back to")
+    registry['active'] = registry['history'].pop()
+    save_registry(registry, registry_file)
+    return registry['active']
+
+
+def resolve_active(registry_file=REGISTRY_FILE):
+    """(version, path) of the model that should be serving"""
+    registry = load_registry(registry_file)
+    active = registry.get('active')
+    if active:
+        return active, registry['versions'][active]['path']
+    return LEGACY_VERSION, LEGACY_MODEL_PATH
+
+
+# ----------------------------------------------------------------------------
+# Loaded models and hot swap
+# ----------------------------------------------------------------------------
+
+class LoadedModel:
+    """An inference backend for one model version, plus an in-flight counter for draining"""
+
+    def __init__(self, version, path, batch_sizes=(1,), backend='tflite', backend_options=None):
+        self.version = version
+        self.path = path
+        self.batch_sizes = tuple(batch_sizes)
+        self.backend = inference_backends.load_backend(backend, path, self.batch_sizes, **(backend_options or {}))
+        # Reusable preprocessed-input buffers, one per batch shape; fill under self.lock
+        self.input_buffers = {
+            batch_size: np.empty((batch_size, *self.backend.input_shape), dtype=np.float32)
+            for batch_size in self.batch_sizes
+        }
+        self.loaded_at = time.time()
+        self.calibration = Calibration.for_model(path)
+
+        # Interpreters and inference requests are not thread-safe
+        self.lock = threading.Lock()
+        self._in_flight = 0
+        self._drained = threading.Condition()
+
+    def score_batch(self, images):
+        """Raw scores for a list of input-sized RGB images, one invoke at batch size len(images)"""
+        with self.lock:
+            buffer = self.input_buffers[len(images)]
+            for i, image in enumerate(images):
+                preprocess_image(image, out=buffer[i:i + 1])
+            return self.backend.run(buffer)[:, 0].astype(float)
+
+    def warm_up(self, runs=1):
+        """
+        Synthetic invokes at every batch shape, so delegate setup, tensor
+        allocation and cold caches are paid before real traffic arrives
+        """
+        rng = np.random.default_rng(0)
+        for batch_size, buffer in self.input_buffers.items():
+            sample = rng.uniform(-1.0, 1.0, size=buffer.shape).astype(np.float32)
+            for _ in range(runs):
+                self.backend.run(sample)
+
+    def acquire(self):
+        with self._drained:
+            self._in_flight += 1
+
+    def release(self):
+        with self._drained:
+            self._in_flight -= 1
+            if self._in_flight == 0:
+                self._drained.notify_all()
+
+    def wait_drained(self, timeout=None):
+        with self._drained:
+            return self._drained.wait_for(lambda: self._in_flight == 0, timeout)
+
+
+class ModelManager:
+    """
+    Owns the active LoadedModel. New versions are loaded and warmed on a
+    background thread and swapped in with a single reference assignment;
+    requests already holding the old model finish on it before it is dropped.
+    """
+
+    def __init__(self, registry_file=REGISTRY_FILE, batch_sizes=(1,), warmup_runs=1, warmup_fn=None,
+                 backend='tflite', backend_options=None):
+        self.registry_file = registry_file
+        # Batch size 1 always exists; it serves single uploads
+        self.batch_sizes = tuple(sorted(set(batch_sizes) | {1}))
+        self.backend = backend
+        self.backend_options = backend_options or {}
+        self.warmup_runs = warmup_runs
+        # Optional extra warm-up through the caller's full request path
+        self.warmup_fn = warmup_fn
+        self.current = None
+        self.last_error = None
+        self.warmup_seconds = None
+        # Set once the first model has been loaded and warmed; stays set across swaps
+        self.ready = threading.Event()
+        self._swap_lock = threading.Lock()
+        self._load_lock = threading.Lock()
+        self._watcher = None
+        self._registry_mtime = None
+
+    @contextmanager
+    def use(self):
+        """Pin the active model for the duration of one request"""
+        with self._swap_lock:
+            model = self.current
+            if model is not None:
+                model.acquire()
+        try:
+            yield model
+        finally:
+            if model is not None:
+                model.release()
+
+    def load(self, version, path):
+        """Load, warm and atomically switch to a model version (blocking)"""
+        with self._load_lock:
+            if self.current is not None and self.current.version == version:
+                return self.current
+            try:
+                start = time.perf_counter()
+                model = LoadedModel(version, path, self.batch_sizes, self.backend, self.backend_options)
+                model.warm_up(self.warmup_runs)
+                if self.warmup_fn is not None:
+                    for _ in range(self.warmup_runs):
+                        self.warmup_fn(model)
+                warmup_seconds = time.perf_counter() - start
+            except Exception as e:
+                self.last_error = f"{version}: {e}"
+                print(f"❌ Error loading model {version} from {path}: {e}")
+                return None
+
+            with self._swap_lock:
+                previous, self.current = self.current, model
+            self.last_error = None
+            self.warmup_seconds = warmup_seconds
+            self.ready.set()
+            print(f"✅ Model {version} active ({path}, {model.backend.name}), warmed in {warmup_seconds:.2f}s "
+                  f"at batch sizes {list(self.batch_sizes)}")
+
+            if previous is not None:
+                previous.wait_drained(timeout=60)
+                print(f"Drained model {previous.version}")
+            return model
+
+    def load_active(self):
+        version, path = resolve_active(self.registry_file)
+        if not os.path.exists(path):
+            self.last_error = f"{version}: {path} not found"
+            print(f"⚠️  Model not found at {path}. Please run convert_to_tflite.py first.")
+            return None
+        return self.load(version, path)
+
+    def load_active_async(self):
+        thread = threading.Thread(target=self.load_active, name='model-loader', daemon=True)
+        thread.start()
+        return thread
+
+    def _watch(self, interval):
+        while True:
+            time.sleep(interval)
+            try:
+                mtime = os.path.getmtime(self.registry_file)
+            except OSError:
+                continue
+            if mtime != self._registry_mtime:
+                self._registry_mtime = mtime
+                version, _ = resolve_active(self.registry_file)
+                if self.current is None or self.current.version != version:
+                    print(f"Registry changed, switching to {version}")
+                    self.load_active()
+
+    def start_watcher(self, interval=WATCH_INTERVAL_SECONDS):
+        """Poll registry.json so every worker process follows activations and rollbacks"""
+        if self._watcher is None:
+            if os.path.exists(self.registry_file):
+                self._registry_mtime = os.path.getmtime(self.registry_file)
+            self._watcher = threading.Thread(target=self._watch, args=(interval,),
+                                             name='registry-watcher', daemon=True)
+            self._watcher.start()
+
+    def status(self):
+        registry = load_registry(self.registry_file)
+        return {
+            'active_version': self.current.version if self.current else None,
+            'backend': self.current.backend.name if self.current else None,
+            'ready': self.ready.is_set(),
+            'warmup_seconds': self.warmup_seconds,
+            'registry_active': registry.get('active') or LEGACY_VERSION,
+            'history': registry.get('history', []),
+            'versions': sorted(registry.get('versions', {})),
+            'last_error': self.last_error,
+        }
+
+
+if __name__ == '__main__':
+    import argparse
+    parser = argparse.ArgumentParser(description="Manage the versioned model registry")
+    sub = parser.add_subparsers(dest='command', required=True)
+    sub.add_parser('list')
+    reg = sub.add_parser('register')
+    reg.add_argument('tflite_path')
+    reg.add_argument('--version')
+    reg.add_argument('--activate', action='store_true')
+    act = sub.add_parser('activate')
+    act.add_argument('version')
+    sub.add_parser('rollback')
+    args = parser.parse_args()
+
+    try:
+        if args.command == 'list':
+            registry = load_registry()
+            for version, info in sorted(registry['versions'].items()):
+                marker = '*' if version == registry['active'] else ' '
+                print(f"{marker} {version:<10} {info['sha256'][:12]}  {info['registered_at']}  {info['source']}")
+            if not registry['versions']:
+                print(f"No registered versions; serving {LEGACY_MODEL_PATH}")
+        elif args.command == 'register':
+            version = register_model(args.tflite_path, args.version, args.activate)
+            print(f"✅ Registered {version}" + (" (active)" if args.activate else ""))
+        elif args.command == 'activate':
+            print(f"✅ Active version: {activate_version(args.version)}")
+        elif args.command == 'rollback':
+            print(f"✅ Rolled back to {rollback()}")
+    except ValueError as e:
+        print(f"❌ {e}")
+        exit(1)
@@ -0,0 +1,45 @@
+"""Image preprocessing shared by the server and the offline scoring tools"""
+import numpy as np
+from PIL import Image
+
+import rail_roi
+
+TARGET_SIZE = (300, 300)
+
+def resize_for_model(image: Image.Image, crop_rails=None):
+    """Decode, optionally crop to the rails (RAIL_ROI=1), and resize to the model's input size (300, 300), as RGB"""
+    crop_rails = rail_roi.ENABLED if crop_rails is None else crop_rails
+    # Always a full decode: JPEG draft (DCT-domain) downscaling would make
+    # serving see different pixels from training and evaluation, which decode
+    # at full size before resizing
+    
+    if crop_rails:
+        image = rail_roi.crop_to_rails(image)
+    
+    # Resize image to target size
+    image = image.resize(TARGET_SIZE, Image.Resampling.LANCZOS)
+    
+    # Convert to RGB if needed
+    if image.mode != 'RGB':
+        image = image.convert('RGB')
+    return image
+
+def preprocess_image(image: Image.Image, out=None):
+    """
+    Preprocess image for InceptionResNetV2 input (300, 300).
+    
+    Writes into `out` (a float32 (1, 300, 300, 3) buffer) when given, so the
+    serving path reuses one buffer per interpreter instead of allocating.
+    An RGB image already at the input size is taken as the output of
+    resize_for_model and is not resized (or cropped) again.
+    """
+    if out is None:
+        out = np.empty((1,) + TARGET_SIZE + (3,), dtype=np.float32)
+    if image.size != TARGET_SIZE or image.mode != 'RGB':
+        image = resize_for_model(image)
+    pixels = np.asarray(image)
+    
+    # InceptionResNetV2 preprocess_input, in place: x / 127.5 - 1
+    np.divide(pixels, 127.5, out=out[0], casting='unsafe')
+    out[0] -= 1.0
+    return out
@@ -0,0 +1,260 @@
+"""
+Embedded inspection-results store: SQLite in WAL mode, written in batches
+from a background thread so the request path only does a queue put.
+
+Every served prediction is kept with its metadata (time, site, camera, track
+segment, position, model version, raw score and verdict). Indexes cover time
+range, location and defect-only queries. Reads return rows in (ts, id) order
+with keyset pagination on that pair, which every index serves directly, so
+deep pages stay cheap and results can be streamed.
+
+Defect events (runs of consecutive detections merged by defect_events.py)
+go through the same writer into their own table.
+"""
+import os
+import json
+import time
+import queue
+import sqlite3
+import threading
+
+DEFAULT_DB_PATH = os.path.join('data', 'results.db')
+
+COLUMNS = (
+    'ts', 'site', 'camera_id', 'segment', 'frame_id', 'lat', 'lon', 'odometer_m',
+    'model_version', 'raw_score', 'probability_faulty', 'has_crack', 'operating_point',
+    'threshold', 'extra',
+)
+
+EVENT_COLUMNS = (
+    'event_id', 'stream', 'site', 'camera_id', 'segment', 'start_ts', 'end_ts', 'position_source',
+    'start_position_m', 'end_position_m', 'length_m', 'start_lat', 'start_lon', 'end_lat', 'end_lon',
+    'peak_probability', 'peak_ts', 'peak_frame_id', 'frame_count', 'model_version',
+)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS predictions (
+    id INTEGER PRIMARY KEY,
+    ts REAL NOT NULL,
+    site TEXT,
+    camera_id TEXT,
+    segment TEXT,
+    frame_id TEXT,
+    lat REAL,
+    lon REAL,
+    odometer_m REAL,
+    model_version TEXT,
+    raw_score REAL NOT NULL,
+    probability_faulty REAL,
+    has_crack INTEGER NOT NULL,
+    operating_point TEXT,
+    threshold REAL,
+    extra TEXT
+);
+-- SQLite ends every index with the rowid (id), so each of these is ordered by
+-- (..., ts, id) and serves the keyset pagination without a sort
+CREATE INDEX IF NOT EXISTS idx_predictions_ts ON predictions (ts);
+CREATE INDEX IF NOT EXISTS idx_predictions_segment_ts ON predictions (segment, ts);
+CREATE INDEX IF NOT EXISTS idx_predictions_camera_ts ON predictions (camera_id, ts);
+CREATE INDEX IF NOT EXISTS idx_predictions_site_ts ON predictions (site, ts);
+CREATE INDEX IF NOT EXISTS idx_predictions_defects ON predictions (ts) WHERE has_crack = 1;
+CREATE INDEX IF NOT EXISTS idx_predictions_odometer ON predictions (segment, odometer_m);
+
+CREATE TABLE IF NOT EXISTS defect_events (
+    id INTEGER PRIMARY KEY,
+    event_id TEXT NOT NULL UNIQUE,
+    stream TEXT,
+    site TEXT,
+    camera_id TEXT,
+    segment TEXT,
+    start_ts REAL NOT NULL,
+    end_ts REAL NOT NULL,
+    position_source TEXT,
+    start_position_m REAL,
+    end_position_m REAL,
+    length_m REAL,
+    start_lat REAL,
+    start_lon REAL,
+    end_lat REAL,
+    end_lon REAL,
+    peak_probability REAL NOT NULL,
+    peak_ts REAL,
+    peak_frame_id TEXT,
+    frame_count INTEGER NOT NULL,
+    model_version TEXT
+);
+CREATE INDEX IF NOT EXISTS idx_events_ts ON defect_events (start_ts);
+CREATE INDEX IF NOT EXISTS idx_events_segment_ts ON defect_events (segment, start_ts);
+CREATE INDEX IF NOT EXISTS idx_events_camera_ts ON defect_events (camera_id, start_ts);
+CREATE INDEX IF NOT EXISTS idx_events_site_ts ON defect_events (site, start_ts);
+"""
+
+
+def encode_cursor(ts, row_id):
+    """Opaque page cursor for the last row of a page; repr keeps the float exact"""
+    return f"{ts!r}:{row_id}"
+
+
+def decode_cursor(cursor):
+    """(ts, id) from encode_cursor; ValueError when malformed"""
+    ts, _, row_id = cursor.rpartition(':')
+    return float(ts), int(row_id)
+
+
+def _connect(path):
+    conn = sqlite3.connect(path, timeout=5.0, check_same_thread=False)
+    conn.execute('PRAGMA journal_mode=WAL')
+    # WAL + NORMAL: durable across process crashes, fsync only at checkpoints
+    conn.execute('PRAGMA synchronous=NORMAL')
+    conn.execute('PRAGMA busy_timeout=5000')
+    conn.row_factory = sqlite3.Row
+    return conn
+
+
+class ResultsStore:
+    def __init__(self, path=DEFAULT_DB_PATH, batch_size=500, flush_interval=0.5, max_queue=50_000):
+        self.path = path
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.dropped = 0
+        self.written = 0
+        self._queue = queue.Queue(maxsize=max_queue)
+        self._stop = threading.Event()
+
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        conn = _connect(path)
+        try:
+            conn.executescript(SCHEMA)
+        finally:
+            conn.close()
+
+        self._writer = threading.Thread(target=self._write_loop, name='results-writer', daemon=True)
+        self._writer.start()
+
+    # ------------------------------------------------------------------
+    # Writes
+    # ------------------------------------------------------------------
+
+    def record(self, **fields):
+        """Queue a prediction for writing; never blocks, drops (and counts) when the queue is full"""
+        fields.setdefault('ts', time.time())
+        extra = fields.pop('extra', None)
+        row = tuple(fields.get(c) for c in COLUMNS[:-1]) + (json.dumps(extra) if extra else None,)
+        self._put('predictions', row)
+
+    def record_event(self, event):
+        """Queue a closed defect event (a dict with EVENT_COLUMNS keys)"""
+        self._put('defect_events', tuple(event.get(c) for c in EVENT_COLUMNS))
+
+    def _put(self, table, row):
+        try:
+            self._queue.put_nowait((table, row))
+        except queue.Full:
+            self.dropped += 1
+
+    def _drain(self, first):
+        batch = [first]
+        while len(batch) < self.batch_size:
+            try:
+                batch.append(self._queue.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def _write_loop(self):
+        conn = _connect(self.path)
+        inserts = {
+            table: f"INSERT OR REPLACE INTO {table} ({', '.join(cols)}) VALUES ({', '.join('?' * len(cols))})"
+            for table, cols in (('predictions', COLUMNS), ('defect_events', EVENT_COLUMNS))
+        }
+        while not (self._stop.is_set() and self._queue.empty()):
+            try:
+                first = self._queue.get(timeout=self.flush_interval)
+            except queue.Empty:
+                continue
+            # Give a burst a moment to accumulate so it lands in one transaction
+            if self._queue.qsize() < self.batch_size and not self._stop.is_set():
+                time.sleep(min(self.flush_interval, 0.05))
+            batch = self._drain(first)
+            by_table = {}
+            for table, row in batch:
+                by_table.setdefault(table, []).append(row)
+            try:
+                with conn:
+                    for table, rows in by_table.items():
+                        conn.executemany(inserts[table], rows)
+                self.written += len(batch)
+            except sqlite3.Error as e:
+                self.dropped += len(batch)
+                print(f"❌ Results store write failed ({len(batch)} rows dropped): {e}")
+        conn.close()
+
+    def close(self, timeout=10.0):
+        """Flush queued rows and stop the writer"""
+        self._stop.set()
+        self._writer.join(timeout)
+
+    def stats(self):
+        return {'queued': self._queue.qsize(), 'written': self.written, 'dropped': self.dropped}
+
+    # ------------------------------------------------------------------
+    # Reads
+    # ------------------------------------------------------------------
+
+    def _where(self, start=None, end=None, site=None, camera_id=None, segment=None,
+               defects_only=False, after=None, ts_column='ts'):
+        clauses, params = [], []
+        for column, value in (('site', site), ('camera_id', camera_id), ('segment', segment)):
+            if value is not None:
+                clauses.append(f"{column} = ?")
+                params.append(value)
+        if start is not None:
+            clauses.append(f"{ts_column} >= ?")
+            params.append(start)
+        if end is not None:
+            clauses.append(f"{ts_column} < ?")
+            params.append(end)
+        if defects_only:
+            clauses.append("has_crack = 1")
+        if after is not None:
+            clauses.append(f"({ts_column}, id) > (?, ?)")
+            params.extend(after)
+        return (" WHERE " + " AND ".join(clauses)) if clauses else "", params
+
+    @staticmethod
+    def _row_dict(row):
+        result = dict(row)
+        result['has_crack'] = bool(result['has_crack'])
+        result['extra'] = json.loads(result['extra']) if result['extra'] else None
+        return result
+
+    def _page(self, table, limit, row_dict, ts_column='ts', **filters):
+        where, params = self._where(ts_column=ts_column, **filters)
+        conn = _connect(self.path)
+        try:
+            rows = conn.execute(f"SELECT * FROM {table}{where} ORDER BY {ts_column}, id LIMIT ?",
+                                params + [limit]).fetchall()
+        finally:
+            conn.close()
+        results = [row_dict(r) for r in rows]
+        next_cursor = encode_cursor(results[-1][ts_column], results[-1]['id']) if len(results) == limit else None
+        return results, next_cursor
+
+    def query(self, limit=100, cursor=None, **filters):
+        """One page of results in (ts, id) order, plus the cursor for the next page (None at the end)"""
+        after = decode_cursor(cursor) if cursor else None
+        return self._page('predictions', limit, self._row_dict, after=after, **filters)
+
+    def query_events(self, limit=100, cursor=None, **filters):
+        """One page of defect events in (start_ts, id) order, filtered on their start time"""
+        after = decode_cursor(cursor) if cursor else None
+        return self._page('defect_events', limit, dict, ts_column='start_ts', after=after, **filters)
+
+    def iter_query(self, page_size=1000, **filters):
+        """Every matching row in (ts, id) order, fetched page by page so memory stays bounded"""
+        cursor = filters.pop('cursor', None)
+        while True:
+            results, cursor = self.query(limit=page_size, cursor=cursor, **filters)
+            yield from results
+            if cursor is None:
+                return
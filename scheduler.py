@@ -0,0 +1,191 @@
+"""
+Priority- and deadline-aware scheduling in front of inference.
+
+Requests are queued by priority class, interactive (operator uploads from the
+frontend) ahead of bulk (frame streams from trains), and by earliest deadline
+within a class. A single dispatcher thread owns the invoke path. It takes one
+batch at a time, sized to a shape the model was allocated for, from the head
+class only. So a waiting interactive request pre-empts bulk work at the next
+batch boundary. Requests whose deadline has passed, or whose caller gave up,
+are dropped when dequeued and never reach invoke.
+"""
+import heapq
+import time
+import itertools
+import threading
+from collections import deque
+from concurrent.futures import Future, InvalidStateError
+
+import numpy as np
+
+PRIORITIES = ('interactive', 'bulk')
+
+
+class DeadlineExceeded(Exception):
+    pass
+
+
+class QueueFull(Exception):
+    pass
+
+
+class _Job:
+    __slots__ = ('payload', 'priority', 'deadline', 'enqueued', 'future', 'seq')
+
+    def __init__(self, payload, priority, deadline):
+        self.payload = payload
+        self.priority = priority
+        self.deadline = deadline
+        self.enqueued = time.monotonic()
+        self.future = Future()
+        self.seq = None
+
+
+class _ClassStats:
+    def __init__(self, window):
+        self.completed = 0
+        self.expired = 0
+        self.cancelled = 0
+        self.rejected = 0
+        self.failed = 0
+        self.wait_ms = deque(maxlen=window)
+        self.latency_ms = deque(maxlen=window)
+
+    def snapshot(self):
+        """Counters and copies of the latency windows; take it under the scheduler's lock"""
+        return dict(vars(self), wait_ms=list(self.wait_ms), latency_ms=list(self.latency_ms))
+
+    @staticmethod
+    def summary(snapshot, depth):
+        def pct(values, q):
+            return round(float(np.percentile(values, q)), 2) if values else None
+        return {
+            'queue_depth': depth,
+            'completed': snapshot['completed'],
+            'expired': snapshot['expired'],
+            'cancelled': snapshot['cancelled'],
+            'rejected': snapshot['rejected'],
+            'failed': snapshot['failed'],
+            'queue_wait_p50_ms': pct(snapshot['wait_ms'], 50),
+            'queue_wait_p95_ms': pct(snapshot['wait_ms'], 95),
+            'latency_p50_ms': pct(snapshot['latency_ms'], 50),
+            'latency_p95_ms': pct(snapshot['latency_ms'], 95),
+        }
+
+
+class InferenceScheduler:
+    def __init__(self, run_batch, batch_sizes=(1,), max_queue=256, latency_window=1000):
+        # run_batch(payloads) -> one result (or Exception instance) per payload
+        self.run_batch = run_batch
+        self.batch_sizes = sorted(set(batch_sizes) | {1})
+        self.max_queue = max_queue
+        self._heap = []
+        self._seq = itertools.count()
+        self._cond = threading.Condition()
+        self._depth = {p: 0 for p in PRIORITIES}
+        self._stats = {p: _ClassStats(latency_window) for p in PRIORITIES}
+        self._thread = None
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._dispatch_loop, name='inference-dispatcher', daemon=True)
+            self._thread.start()
+
+    def submit(self, payload, priority='interactive', deadline_s=None):
+        """
+        Queue a payload; returns a Future. deadline_s is a budget in seconds
+        from now, after which the request is dropped instead of run.
+        """
+        if priority not in PRIORITIES:
+            raise ValueError(f"Unknown priority '{priority}'; available: {', '.join(PRIORITIES)}")
+        job = _Job(payload, priority, None if deadline_s is None else time.monotonic() + deadline_s)
+        with self._cond:
+            if self._depth[priority] >= self.max_queue:
+                self._stats[priority].rejected += 1
+                raise QueueFull(f"{priority} queue is full ({self.max_queue} requests)")
+            self._push(job)
+            self._cond.notify()
+        return job.future
+
+    def _push(self, job):
+        deadline = job.deadline if job.deadline is not None else float('inf')
+        if job.seq is None:
+            job.seq = next(self._seq)
+        # Requeued jobs keep their original sequence number, so FIFO order within a class holds
+        heapq.heappush(self._heap, (PRIORITIES.index(job.priority), deadline, job.seq, job))
+        self._depth[job.priority] += 1
+
+    def _take_batch(self):
+        """Head-of-queue jobs of a single class, trimmed to an allocated batch size"""
+        with self._cond:
+            self._cond.wait_for(lambda: self._heap)
+            now = time.monotonic()
+            batch = []
+            while self._heap and len(batch) < self.batch_sizes[-1]:
+                job = self._heap[0][-1]
+                if batch and job.priority != batch[0].priority:
+                    break
+                heapq.heappop(self._heap)
+                self._depth[job.priority] -= 1
+                if job.future.cancelled():
+                    # The caller stopped waiting
+                    self._stats[job.priority].cancelled += 1
+                elif job.deadline is not None and now > job.deadline:
+                    self._stats[job.priority].expired += 1
+                    try:
+                        job.future.set_exception(DeadlineExceeded("Deadline passed while queued"))
+                    except InvalidStateError:
+                        pass
+                else:
+                    batch.append(job)
+
+            size = max((b for b in self.batch_sizes if b <= len(batch)), default=0)
+            for job in batch[size:]:
+                self._push(job)
+            return batch[:size]
+
+    def _dispatch_loop(self):
+        while True:
+            jobs = self._take_batch()
+            if not jobs:
+                continue
+            started = time.monotonic()
+            try:
+                results = self.run_batch([job.payload for job in jobs])
+            except Exception as e:
+                results = [e] * len(jobs)
+            finished = time.monotonic()
+
+            failed, completed = [], []
+            for job, result in zip(jobs, results):
+                try:
+                    if isinstance(result, Exception):
+                        failed.append(job)
+                        job.future.set_exception(result)
+                        continue
+                    job.future.set_result(result)
+                except InvalidStateError:
+                    # Cancelled by its caller while the batch was running
+                    continue
+                completed.append(job)
+
+            # Under the lock, so status() never reads a window while it is being appended to
+            with self._cond:
+                for job in failed:
+                    self._stats[job.priority].failed += 1
+                for job in completed:
+                    stats = self._stats[job.priority]
+                    stats.completed += 1
+                    stats.wait_ms.append((started - job.enqueued) * 1000)
+                    stats.latency_ms.append((finished - job.enqueued) * 1000)
+
+    def status(self):
+        with self._cond:
+            depth = dict(self._depth)
+            snapshots = {p: self._stats[p].snapshot() for p in PRIORITIES}
+        # Percentiles run on the copies, outside the lock the dispatcher needs
+        return {
+            'batch_sizes': self.batch_sizes,
+            'max_queue': self.max_queue,
+            'classes': {p: _ClassStats.summary(snapshots[p], depth[p]) for p in PRIORITIES},
+        }
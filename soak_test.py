@@ -0,0 +1,429 @@
+"""
+Soak test for memory growth and latency drift in the server.
+
+Drives /upload/ and /upload/batch/ from concurrent clients for hours with a
+mix of frames. The mix is every GIF and PNG in data/raw, a sample of its
+JPEGs, and each one re-encoded at typical camera frame sizes. Every
+--interval seconds it records a sample to a JSONL file:
+- RSS and PSS
+- traced Python allocations (size and block count)
+- the latency percentiles of that window
+- the gc object count, threads and open file descriptors
+
+The first --warmup seconds are excluded. When the run ends, the median of the
+first few samples is compared with the median of the last few, and the run
+fails if the growth passes any of these limits:
+- RSS growth: --max-rss-growth-mb
+- traced allocation growth: --max-traced-growth-mb
+- p95 latency drift: --max-p95-drift, as a ratio
+- error rate: --max-error-rate
+
+The tracemalloc snapshot diff names the source lines whose allocations grew.
+
+--mode inprocess (default) runs the app under a TestClient in this process,
+which is what makes tracemalloc possible. --mode http starts
+`uvicorn app:app` on a local port and measures the server's process tree, RSS
+only. Predictions go to a temporary RESULTS_DB unless one is set. Linux only
+(/proc).
+
+Usage:
+    python soak_test.py [--duration 4h] [--mode inprocess|http] [--concurrency 2] [--interval 60]
+                        [--max-rss-growth-mb 64] [--max-traced-growth-mb 16] [--max-p95-drift 1.5]
+"""
+import io
+import os
+import sys
+import gc
+import glob
+import json
+import time
+import random
+import argparse
+import tempfile
+import threading
+import subprocess
+import tracemalloc
+import numpy as np
+from PIL import Image
+
+from benchmark_workers import memory_mb, process_tree, wait_ready
+
+RAW_DIR = os.path.join('data', 'raw')
+FRAME_SIZES = ((640, 480), (1280, 720), (1920, 1080))
+MEDIA_TYPES = {'JPEG': 'image/jpeg', 'PNG': 'image/png', 'GIF': 'image/gif'}
+BATCH_FRAMES = 4
+
+
+def parse_duration(text):
+    """Seconds from '90', '90s', '30m' or '4h'"""
+    units = {'s': 1, 'm': 60, 'h': 3600}
+    if text[-1:].lower() in units:
+        return float(text[:-1]) * units[text[-1].lower()]
+    return float(text)
+
+
+# ----------------------------------------------------------------------------
+# Frames
+# ----------------------------------------------------------------------------
+
+def build_corpus(raw_dir=RAW_DIR, jpegs=16, seed=0):
+    """(name, bytes, content type) uploads: raw files as they are, plus re-encodings at camera frame sizes"""
+    rng = random.Random(seed)
+    paths = sorted(glob.glob(os.path.join(raw_dir, '*')))
+    other = [p for p in paths if not p.lower().endswith(('.jpg', '.jpeg'))]
+    jpeg = [p for p in paths if p.lower().endswith(('.jpg', '.jpeg'))]
+    chosen = other + rng.sample(jpeg, min(jpegs, len(jpeg)))
+
+    corpus = []
+    for path in chosen:
+        with Image.open(path) as img:
+            fmt = img.format
+            if fmt not in MEDIA_TYPES:
+                continue
+            with open(path, 'rb') as f:
+                corpus.append((os.path.basename(path), f.read(), MEDIA_TYPES[fmt]))
+            size = rng.choice(FRAME_SIZES)
+            buffer = io.BytesIO()
+            img.convert('RGB').resize(size, Image.Resampling.BILINEAR).save(buffer, fmt)
+        name = f"{os.path.splitext(os.path.basename(path))[0]}_{size[0]}x{size[1]}.{fmt.lower()}"
+        corpus.append((name, buffer.getvalue(), MEDIA_TYPES[fmt]))
+    return corpus
+
+
+# ----------------------------------------------------------------------------
+# Targets
+# ----------------------------------------------------------------------------
+
+class InProcessTarget:
+    """The app under a TestClient in this process, so tracemalloc sees its allocations"""
+    traced = True
+
+    def __init__(self, startup_timeout):
+        from fastapi.testclient import TestClient
+        import app as server
+        self.client = TestClient(server.app)
+        self.client.__enter__()  # runs the startup hooks
+        deadline = time.time() + startup_timeout
+        while self.client.get('/ready').status_code != 200:
+            if time.time() > deadline:
+                raise RuntimeError("app never became ready")
+            time.sleep(0.2)
+
+    def post(self, path, files):
+        return self.client.post(path, files=files)
+
+    def memory_mb(self):
+        return memory_mb([os.getpid()])
+
+    def process_stats(self):
+        return {
+            'gc_objects': len(gc.get_objects()),
+            'threads': threading.active_count(),
+            'open_fds': len(os.listdir('/proc/self/fd')),
+        }
+
+    def close(self):
+        self.client.__exit__(None, None, None)
+
+
+class HttpTarget:
+    """`uvicorn app:app` in a subprocess, measured over its whole process tree"""
+    traced = False
+
+    def __init__(self, port, workers, startup_timeout):
+        self.base_url = f'http://127.0.0.1:{port}'
+        self.server = subprocess.Popen(
+            [sys.executable, '-m', 'uvicorn', 'app:app', '--host', '127.0.0.1', '--port', str(port),
+             '--workers', str(workers), '--timeout-worker-healthcheck', '60', '--log-level', 'warning'],
+            env=dict(os.environ, WEB_CONCURRENCY=str(workers)),
+            stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+        )
+        self.local = threading.local()
+        if not wait_ready(self.base_url, workers, startup_timeout):
+            self.close()
+            raise RuntimeError(f"server on port {port} never became ready")
+
+    def post(self, path, files):
+        import requests
+        if not hasattr(self.local, 'session'):
+            self.local.session = requests.Session()
+        return self.local.session.post(self.base_url + path, files=files, timeout=60)
+
+    def memory_mb(self):
+        return memory_mb(process_tree(self.server.pid))
+
+    def process_stats(self):
+        threads = fds = 0
+        for pid in process_tree(self.server.pid):
+            try:
+                with open(f'/proc/{pid}/status') as f:
+                    threads += next(int(line.split()[1]) for line in f if line.startswith('Threads:'))
+                fds += len(os.listdir(f'/proc/{pid}/fd'))
+            except (OSError, StopIteration):
+                continue
+        return {'threads': threads, 'open_fds': fds}
+
+    def close(self):
+        self.server.terminate()
+        try:
+            self.server.wait(timeout=30)
+        except subprocess.TimeoutExpired:
+            self.server.kill()
+
+
+# ----------------------------------------------------------------------------
+# Load and sampling
+# ----------------------------------------------------------------------------
+
+class Load:
+    """Client threads posting frames until stopped; latencies are collected per sampling window"""
+
+    def __init__(self, target, corpus, concurrency, batch_fraction, seed=0):
+        self.target = target
+        self.corpus = corpus
+        self.batch_fraction = batch_fraction
+        self.lock = threading.Lock()
+        self.window = []
+        self.requests = self.errors = self.frames = 0
+        self.stop = threading.Event()
+        self.threads = [threading.Thread(target=self._client, args=(random.Random(seed + i),), daemon=True)
+                        for i in range(concurrency)]
+
+    def start(self):
+        for thread in self.threads:
+            thread.start()
+
+    def _client(self, rng):
+        while not self.stop.is_set():
+            frames = rng.sample(self.corpus, BATCH_FRAMES) if rng.random() < self.batch_fraction \
+                else [rng.choice(self.corpus)]
+            path = '/upload/batch/' if len(frames) > 1 else '/upload/'
+            field = 'files' if len(frames) > 1 else 'file'
+            start = time.perf_counter()
+            try:
+                r = self.target.post(path, [(field, frame) for frame in frames])
+                body = r.json()
+                results = body.get('results', [body])
+                failed = r.status_code != 200 or body.get('error') or any(x.get('error') for x in results)
+            except Exception:
+                failed = True
+            elapsed = (time.perf_counter() - start) * 1000
+            with self.lock:
+                self.requests += 1
+                self.frames += len(frames)
+                if failed:
+                    self.errors += 1
+                else:
+                    # Per frame, so batch requests don't skew the percentiles
+                    self.window.append(elapsed / len(frames))
+
+    def drain(self):
+        with self.lock:
+            window, self.window = self.window, []
+            return window, self.requests, self.errors
+
+    def close(self):
+        self.stop.set()
+        for thread in self.threads:
+            thread.join(timeout=120)
+
+
+def traced_allocations():
+    """(MB, blocks) allocated by Python code other than this harness and tracemalloc itself"""
+    snapshot = tracemalloc.take_snapshot().filter_traces([
+        tracemalloc.Filter(False, tracemalloc.__file__),
+        tracemalloc.Filter(False, __file__),
+    ])
+    stats = snapshot.statistics('filename')
+    return snapshot, sum(s.size for s in stats) / (1024 * 1024), sum(s.count for s in stats)
+
+
+def take_sample(target, load, started, last):
+    window, requests_total, errors_total = load.drain()
+    if target.traced:
+        # Only live objects count, not cycles still waiting for the collector
+        gc.collect()
+    rss, pss = target.memory_mb()
+    sample = {
+        'type': 'sample',
+        'elapsed_s': round(time.time() - started, 1),
+        'requests': requests_total,
+        'errors': errors_total,
+        'window_requests': requests_total - last['requests'],
+        'window_errors': errors_total - last['errors'],
+        'p50_ms': round(float(np.percentile(window, 50)), 2) if window else None,
+        'p95_ms': round(float(np.percentile(window, 95)), 2) if window else None,
+        'p99_ms': round(float(np.percentile(window, 99)), 2) if window else None,
+        'max_ms': round(float(max(window)), 2) if window else None,
+        'rss_mb': round(rss, 1),
+        'pss_mb': round(pss, 1),
+        **target.process_stats(),
+    }
+    snapshot = None
+    if tracemalloc.is_tracing():
+        snapshot, traced_mb, blocks = traced_allocations()
+        sample['traced_mb'] = round(traced_mb, 2)
+        sample['traced_blocks'] = blocks
+    return sample, snapshot
+
+
+# ----------------------------------------------------------------------------
+# Verdict
+# ----------------------------------------------------------------------------
+
+def _median(samples, key):
+    values = [s[key] for s in samples if s.get(key) is not None]
+    return float(np.median(values)) if values else None
+
+
+def evaluate_growth(samples, limits):
+    """Growth between the first and last few post-warm-up samples, and which limits it breaks"""
+    k = max(1, min(3, len(samples) // 4))
+    head, tail = samples[:k], samples[-k:]
+    hours = (samples[-1]['elapsed_s'] - samples[0]['elapsed_s']) / 3600 if len(samples) > 1 else 0
+    rss_slope = None
+    if len(samples) > 2 and hours > 0:
+        t = np.array([s['elapsed_s'] for s in samples]) / 3600
+        rss_slope = float(np.polyfit(t, [s['rss_mb'] for s in samples], 1)[0])
+
+    growth = {
+        'samples': len(samples),
+        'compared': k,
+        'rss_growth_mb': round(_median(tail, 'rss_mb') - _median(head, 'rss_mb'), 1),
+        'rss_slope_mb_per_hour': round(rss_slope, 2) if rss_slope is not None else None,
+        'p95_start_ms': _median(head, 'p95_ms'),
+        'p95_end_ms': _median(tail, 'p95_ms'),
+    }
+    for key in ('gc_objects', 'threads', 'open_fds'):
+        if key in samples[0]:
+            growth[f'{key}_growth'] = int(_median(tail, key) - _median(head, key))
+    total_requests = samples[-1]['requests'] - samples[0]['requests'] + samples[0]['window_requests']
+    total_errors = samples[-1]['errors'] - samples[0]['errors'] + samples[0]['window_errors']
+    growth['error_rate'] = round(total_errors / max(total_requests, 1), 4)
+    if growth['p95_start_ms'] and growth['p95_end_ms']:
+        growth['p95_drift'] = round(growth['p95_end_ms'] / growth['p95_start_ms'], 3)
+    if 'traced_mb' in samples[0]:
+        growth['traced_growth_mb'] = round(_median(tail, 'traced_mb') - _median(head, 'traced_mb'), 2)
+        growth['traced_blocks_growth'] = int(_median(tail, 'traced_blocks') - _median(head, 'traced_blocks'))
+
+    failures = []
+    if growth['rss_growth_mb'] > limits['max_rss_growth_mb']:
+        failures.append(f"RSS grew {growth['rss_growth_mb']} MB > {limits['max_rss_growth_mb']:g} MB")
+    if growth.get('traced_growth_mb', 0) > limits['max_traced_growth_mb']:
+        failures.append(f"traced allocations grew {growth['traced_growth_mb']} MB "
+                        f"> {limits['max_traced_growth_mb']:g} MB")
+    if growth.get('p95_drift', 1.0) > limits['max_p95_drift']:
+        failures.append(f"p95 latency drifted x{growth['p95_drift']} > x{limits['max_p95_drift']:g}")
+    if growth['error_rate'] > limits['max_error_rate']:
+        failures.append(f"error rate {growth['error_rate']:.2%} > {limits['max_error_rate']:.2%}")
+    return growth, failures
+
+
+def top_growth(baseline, final, limit=10):
+    """Source lines whose live allocations grew most between two snapshots"""
+    return [{'where': str(stat.traceback[0]), 'size_diff_kb': round(stat.size_diff / 1024, 1),
+             'count_diff': stat.count_diff}
+            for stat in final.compare_to(baseline, 'lineno')[:limit] if stat.size_diff > 0]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Soak-test the server for memory growth and latency drift")
+    parser.add_argument('--duration', default='1h', help="Total run time, e.g. 900, 30m, 4h")
+    parser.add_argument('--warmup', default='2m', help="Time excluded from the growth checks")
+    parser.add_argument('--interval', default='60', help="Seconds between samples")
+    parser.add_argument('--mode', choices=('inprocess', 'http'), default='inprocess')
+    parser.add_argument('--concurrency', type=int, default=2)
+    parser.add_argument('--batch-fraction', type=float, default=0.1,
+                        help=f"Share of requests sent to /upload/batch/ with {BATCH_FRAMES} frames")
+    parser.add_argument('--workers', type=int, default=1, help="uvicorn workers (http mode)")
+    parser.add_argument('--port', type=int, default=8092)
+    parser.add_argument('--raw-dir', default=RAW_DIR)
+    parser.add_argument('--jpegs', type=int, default=16, help="JPEGs sampled from the raw directory")
+    parser.add_argument('--trace-frames', type=int, default=1, help="tracemalloc traceback depth")
+    parser.add_argument('--no-tracemalloc', action='store_true')
+    parser.add_argument('--max-rss-growth-mb', type=float, default=64.0)
+    parser.add_argument('--max-traced-growth-mb', type=float, default=16.0)
+    parser.add_argument('--max-p95-drift', type=float, default=1.5)
+    parser.add_argument('--max-error-rate', type=float, default=0.01)
+    parser.add_argument('--startup-timeout', type=float, default=300.0)
+    parser.add_argument('--output', default='soak_results.jsonl')
+    args = parser.parse_args()
+
+    duration, warmup, interval = (parse_duration(args.duration), parse_duration(args.warmup),
+                                  parse_duration(args.interval))
+    limits = {'max_rss_growth_mb': args.max_rss_growth_mb, 'max_traced_growth_mb': args.max_traced_growth_mb,
+              'max_p95_drift': args.max_p95_drift, 'max_error_rate': args.max_error_rate}
+    # Keep hours of soak predictions out of the real results database
+    os.environ.setdefault('RESULTS_DB', os.path.join(tempfile.mkdtemp(prefix='soak-'), 'results.db'))
+
+    corpus = build_corpus(args.raw_dir, args.jpegs)
+    kinds = sorted({ctype.split('/')[1] for _, _, ctype in corpus})
+    print(f"Corpus: {len(corpus)} frames ({', '.join(kinds)}), "
+          f"{sum(len(data) for _, data, _ in corpus) / (1024 * 1024):.1f} MB")
+
+    print(f"Starting the app ({args.mode})...")
+    target = InProcessTarget(args.startup_timeout) if args.mode == 'inprocess' \
+        else HttpTarget(args.port, args.workers, args.startup_timeout)
+    if target.traced and not args.no_tracemalloc:
+        # Started after the model is loaded, so only the request path is traced
+        tracemalloc.start(args.trace_frames)
+
+    load = Load(target, corpus, args.concurrency, args.batch_fraction)
+    samples, baseline_snapshot, snapshot = [], None, None
+    started = time.time()
+    last = {'requests': 0, 'errors': 0}
+    print(f"\n{'Elapsed':>8} {'Req':>7} {'Err':>5} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} "
+          f"{'RSS MB':>8} {'Traced MB':>10} {'Blocks':>9}")
+    print("-" * 82)
+    try:
+        with open(args.output, 'w') as out:
+            load.start()
+            while time.time() - started < duration:
+                time.sleep(min(interval, max(0.0, duration - (time.time() - started))))
+                sample, snapshot = take_sample(target, load, started, last)
+                last = sample
+                sample['warmup'] = sample['elapsed_s'] <= warmup
+                out.write(json.dumps(sample) + '\n')
+                out.flush()
+                if not sample['warmup']:
+                    samples.append(sample)
+                    if baseline_snapshot is None:
+                        baseline_snapshot = snapshot
+                print(f"{sample['elapsed_s']:>7.0f}s {sample['requests']:>7} {sample['errors']:>5} "
+                      f"{sample['p50_ms'] or 0:>8.1f} {sample['p95_ms'] or 0:>8.1f} {sample['p99_ms'] or 0:>8.1f} "
+                      f"{sample['rss_mb']:>8.1f} {sample.get('traced_mb', '-'):>10} "
+                      f"{sample.get('traced_blocks', '-'):>9}{'  (warm-up)' if sample['warmup'] else ''}")
+
+            load.close()
+            if not samples:
+                print("❌ No samples after warm-up; run longer than --warmup")
+                exit(1)
+            growth, failures = evaluate_growth(samples, limits)
+            summary = {'type': 'summary', 'mode': args.mode, 'concurrency': args.concurrency,
+                       'duration_s': duration, 'warmup_s': warmup, 'limits': limits,
+                       'growth': growth, 'failures': failures, 'passed': not failures}
+            if baseline_snapshot is not None and snapshot is not None:
+                summary['top_growth'] = top_growth(baseline_snapshot, snapshot)
+            out.write(json.dumps(summary) + '\n')
+    finally:
+        load.close()
+        target.close()
+
+    print(f"\nRSS {growth['rss_growth_mb']:+.1f} MB"
+          + (f" ({growth['rss_slope_mb_per_hour']:+.1f} MB/h)" if growth['rss_slope_mb_per_hour'] is not None else "")
+          + (f", traced {growth['traced_growth_mb']:+.2f} MB / {growth['traced_blocks_growth']:+d} blocks"
+             if 'traced_growth_mb' in growth else "")
+          + (f", p95 x{growth['p95_drift']:.2f}" if 'p95_drift' in growth else "")
+          + f", errors {growth['error_rate']:.2%}")
+    for entry in summary.get('top_growth', [])[:5]:
+        print(f"   {entry['size_diff_kb']:>+9.1f} KB {entry['count_diff']:>+7} blocks  {entry['where']}")
+    print(f"Samples and summary written to {args.output}")
+    if failures:
+        for failure in failures:
+            print(f"❌ {failure}")
+        exit(1)
+    print("✅ No growth beyond the limits")
+
+
+if __name__ == '__main__':
+    main()
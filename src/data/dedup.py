@@ -0,0 +1,204 @@
+import os
+import glob
+import json
+import argparse
+from itertools import combinations
+from collections import defaultdict
+
+import numpy as np
+from PIL import Image
+
+HASH_SIZE = 8          # 8x8 DCT coefficients -> 64-bit hash
+HIGHFREQ_FACTOR = 4    # hash is computed from a 32x32 thumbnail
+MAX_DISTANCE = 6       # Hamming distance at which two images count as near-duplicates
+BANDS = 4              # Multi-index bands of 16 bits, each probed within MAX_DISTANCE // BANDS bits
+MAX_PROBE_RADIUS = 2   # Above this the probe set per band grows combinatorially (C(16, 3) = 560 flips)
+
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.gif')
+
+
+def _dct_matrix(n):
+    """Orthonormal DCT-II matrix of size n x n"""
+    k = np.arange(n)[:, None]
+    i = np.arange(n)[None, :]
+    m = np.cos(np.pi * (2 * i + 1) * k / (2 * n)) * np.sqrt(2.0 / n)
+    m[0, :] = np.sqrt(1.0 / n)
+    return m
+
+
+_DCT = _dct_matrix(HASH_SIZE * HIGHFREQ_FACTOR)
+
+
+def phash(image: Image.Image):
+    """64-bit perceptual hash (DCT of a 32x32 grayscale thumbnail)"""
+    size = HASH_SIZE * HIGHFREQ_FACTOR
+    gray = image.convert('L').resize((size, size), Image.Resampling.LANCZOS)
+    pixels = np.asarray(gray, dtype=np.float64)
+
+    dct = _DCT @ pixels @ _DCT.T
+    low = dct[:HASH_SIZE, :HASH_SIZE].flatten()
+    # Compare against the median of the AC terms so the DC term doesn't dominate
+    bits = low > np.median(low[1:])
+
+    value = 0
+    for bit in bits:
+        value = (value << 1) | int(bit)
+    return value
+
+
+def hash_file(path):
+    """Perceptual hash of an image file, or None if it can't be decoded"""
+    try:
+        with Image.open(path) as img:
+            return phash(img)
+    except Exception as e:
+        print(f"⚠️  Could not hash {path}: {e}")
+        return None
+
+
+def hamming(a, b):
+    return bin(a ^ b).count('1')
+
+
+def check_bands(bands, max_distance=MAX_DISTANCE):
+    """
+    Raise ValueError unless `bands` splits the hash into equal chunks and keeps
+    the probe radius small. Uneven chunks would leave high bits unindexed,
+    breaking the pigeonhole guarantee, and a wide radius makes probing slower
+    than comparing every pair.
+    """
+    bits = HASH_SIZE * HASH_SIZE
+    if bands < 1 or bits % bands:
+        raise ValueError(f"bands must divide {bits}, got {bands}")
+    if max_distance // bands > MAX_PROBE_RADIUS:
+        raise ValueError(f"max_distance {max_distance} with {bands} bands probes "
+                         f"{max_distance // bands} bits per band; use at least "
+                         f"{max_distance // (MAX_PROBE_RADIUS + 1) + 1} bands")
+
+
+def band_keys(h, bands=BANDS):
+    """(band, chunk) bucket keys of a hash split into `bands` equal chunks"""
+    band_bits = HASH_SIZE * HASH_SIZE // bands
+    mask = (1 << band_bits) - 1
+    return [(band, (h >> (band * band_bits)) & mask) for band in range(bands)]
+
+
+def probe_keys(h, max_distance=MAX_DISTANCE, bands=BANDS):
+    """
+    Bucket keys that must be looked up to find every hash within max_distance
+    of h (multi-index hashing). If two hashes differ in at most max_distance
+    bits, then by pigeonhole some band differs in at most max_distance // bands
+    bits. So probing each band's chunk and its neighbours within that radius
+    misses no pair, while wide bands keep buckets sparse.
+    """
+    band_bits = HASH_SIZE * HASH_SIZE // bands
+    radius = max_distance // bands
+    flips = [0] + [sum(1 << bit for bit in combo)
+                   for r in range(1, radius + 1) for combo in combinations(range(band_bits), r)]
+    return [(band, chunk ^ flip) for band, chunk in band_keys(h, bands) for flip in flips]
+
+
+class _UnionFind:
+    def __init__(self, n):
+        self.parent = list(range(n))
+
+    def find(self, x):
+        while self.parent[x] != x:
+            self.parent[x] = self.parent[self.parent[x]]
+            x = self.parent[x]
+        return x
+
+    def union(self, a, b):
+        ra, rb = self.find(a), self.find(b)
+        if ra != rb:
+            self.parent[rb] = ra
+
+
+def find_duplicate_clusters(paths, max_distance=MAX_DISTANCE, bands=BANDS):
+    """
+    Group images into near-duplicate clusters.
+
+    Hashes are bucketed by `bands` wide chunks, and each image is compared only
+    with the images found by probe_keys. That finds the same clusters as an
+    all-pairs comparison, and with 16-bit chunks the candidates per image stay
+    near constant as the dataset grows.
+
+    Returns (clusters, hashes) where clusters is a list of path lists (every
+    input path appears in exactly one cluster, singletons included) and
+    hashes maps path -> hash.
+    """
+    check_bands(bands, max_distance)
+    hashes = {}
+    for path in paths:
+        h = hash_file(path)
+        if h is not None:
+            hashes[path] = h
+
+    keys = list(hashes)
+    buckets = defaultdict(list)
+    uf = _UnionFind(len(keys))
+    for idx, path in enumerate(keys):
+        h = hashes[path]
+        # Compare against the images indexed so far, then index this one
+        candidates = {other for key in probe_keys(h, max_distance, bands) for other in buckets.get(key, ())}
+        for other in candidates:
+            if hamming(h, hashes[keys[other]]) <= max_distance:
+                uf.union(other, idx)
+        for key in band_keys(h, bands):
+            buckets[key].append(idx)
+
+    groups = defaultdict(list)
+    for idx, path in enumerate(keys):
+        groups[uf.find(idx)].append(path)
+
+    clusters = [sorted(members) for members in groups.values()]
+    # Undecodable files still need a split, so keep them as singletons
+    clusters.extend([p] for p in paths if p not in hashes)
+    return clusters, hashes
+
+
+def audit_splits(processed_dir, max_distance=MAX_DISTANCE, bands=BANDS):
+    """Report near-duplicate clusters that span more than one split of processed_dir"""
+    split_of = {}
+    for split in sorted(os.listdir(processed_dir)):
+        split_dir = os.path.join(processed_dir, split)
+        if not os.path.isdir(split_dir):
+            continue
+        for path in glob.glob(os.path.join(split_dir, '*', '*')):
+            if path.lower().endswith(IMAGE_EXTENSIONS):
+                split_of[path] = split
+
+    clusters, _ = find_duplicate_clusters(list(split_of), max_distance, bands)
+    leaks = [c for c in clusters if len({split_of[p] for p in c}) > 1]
+
+    print(f"Audited {len(split_of)} images in {processed_dir}")
+    print(f"Near-duplicate clusters: {sum(1 for c in clusters if len(c) > 1)}")
+    if leaks:
+        print(f"❌ {len(leaks)} clusters leak across splits:")
+        for cluster in leaks:
+            for path in cluster:
+                print(f"   [{split_of[path]}] {path}")
+            print()
+    else:
+        print("✅ No near-duplicates shared between splits.")
+
+    return leaks
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Near-duplicate audit for the image dataset")
+    parser.add_argument('--processed-dir', default=os.path.join('data', 'processed'))
+    parser.add_argument('--max-distance', type=int, default=MAX_DISTANCE)
+    parser.add_argument('--bands', type=int, default=BANDS)
+    parser.add_argument('--json', help="Write the leaking clusters to this file")
+    args = parser.parse_args()
+    try:
+        check_bands(args.bands, args.max_distance)
+    except ValueError as e:
+        parser.error(str(e))
+
+    leaks = audit_splits(args.processed_dir, args.max_distance, args.bands)
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(leaks, f, indent=2)
+    exit(1 if leaks else 0)
@@ -1,10 +1,12 @@
 import os
+import json
 import shutil
 import random
 import glob
 
-def prepare_data():
-    base_dir = "data"
+from dedup import find_duplicate_clusters
+
+def prepare_data(drop_duplicates=False, base_dir="data"):
     raw_dir = os.path.join(base_dir, "raw")
     processed_dir = os.path.join(base_dir, "processed")
     
@@ -12,8 +14,10 @@ def prepare_data():
     splits = ['train', 'validation', 'test']
     classes = ['Faulty', 'Normal']
     
-    # Create directories
+    # Start from empty split directories: files left by an earlier split
+    # would otherwise end up in two splits at once
     for split in splits:
+        shutil.rmtree(os.path.join(processed_dir, split), ignore_errors=True)
         for cls in classes:
             os.makedirs(os.path.join(processed_dir, split, cls), exist_ok=True)
             
@@ -33,24 +37,61 @@ def prepare_data():
     print(f"Faulty images: {len(faulty_images)}")
     print(f"Normal images: {len(normal_images)}")
     
+    # Group near-duplicates so a cluster never straddles two splits
+    clusters, _ = find_duplicate_clusters(faulty_images + normal_images)
+    duplicates = [c for c in clusters if len(c) > 1]
+    print(f"Near-duplicate clusters: {len(duplicates)} covering {sum(len(c) for c in duplicates)} images")
+    
+    # Clusters holding both classes are label conflicts; they all go to train
+    # so neither copy can end up being scored in validation or test
+    class_images = {'Faulty': set(faulty_images), 'Normal': set(normal_images)}
+    conflicts = [c for c in duplicates if set(c) & class_images['Faulty'] and set(c) & class_images['Normal']]
+    pinned = {img for c in conflicts for img in c}
+    for cluster in conflicts:
+        print(f"⚠️  Label conflict, pinned to train: {', '.join(os.path.basename(p) for p in cluster)}")
+    
+    report = {'drop_duplicates': drop_duplicates, 'clusters': duplicates,
+              'label_conflicts': conflicts, 'removed': []}
+    
+    def group(images):
+        members = set(images) - pinned
+        groups = [[img for img in c if img in members] for c in clusters]
+        groups = [g for g in groups if g]
+        if drop_duplicates:
+            # Keep the first member of each cluster, drop the rest
+            for g in groups:
+                report['removed'].extend(g[1:])
+            groups = [g[:1] for g in groups]
+        return sorted(groups)
+    
+    faulty_groups = group(faulty_images)
+    normal_groups = group(normal_images)
+    
     # Shuffle
     random.seed(42)
-    random.shuffle(faulty_images)
-    random.shuffle(normal_images)
+    random.shuffle(faulty_groups)
+    random.shuffle(normal_groups)
     
     # Split ratios
     train_ratio = 0.7
     val_ratio = 0.15
     # test_ratio = 0.15 (remaining)
     
-    def split_and_copy(images, class_name):
-        n = len(images)
+    def split_and_copy(groups, class_name):
+        n = sum(len(g) for g in groups) + len(pinned & class_images[class_name])
         n_train = int(n * train_ratio)
         n_val = int(n * val_ratio)
         
-        train_imgs = images[:n_train]
-        val_imgs = images[n_train:n_train+n_val]
-        test_imgs = images[n_train+n_val:]
+        # Fill splits cluster by cluster, so sizes are approximate
+        train_imgs = [img for img in sorted(pinned) if img in class_images[class_name]]
+        val_imgs, test_imgs = [], []
+        for cluster in groups:
+            if len(train_imgs) < n_train:
+                train_imgs.extend(cluster)
+            elif len(val_imgs) < n_val:
+                val_imgs.extend(cluster)
+            else:
+                test_imgs.extend(cluster)
         
         for img in train_imgs:
             shutil.copy(img, os.path.join(processed_dir, 'train', class_name, os.path.basename(img)))
@@ -63,10 +104,25 @@ def prepare_data():
             
         print(f"[{class_name}] Train: {len(train_imgs)}, Val: {len(val_imgs)}, Test: {len(test_imgs)}")
 
-    split_and_copy(faulty_images, 'Faulty')
-    split_and_copy(normal_images, 'Normal')
+    split_and_copy(faulty_groups, 'Faulty')
+    split_and_copy(normal_groups, 'Normal')
+    
+    if report['removed']:
+        print(f"Removed {len(report['removed'])} near-duplicates:")
+        for img in report['removed']:
+            print(f"  - {os.path.basename(img)}")
+    
+    report_path = os.path.join(processed_dir, 'dedup_report.json')
+    with open(report_path, 'w') as f:
+        json.dump(report, f, indent=2)
+    print(f"Dedup report written to {report_path}")
     
     print("Data preparation complete.")
 
 if __name__ == "__main__":
-    prepare_data()
+    import argparse
+    parser = argparse.ArgumentParser(description="Split data/raw into train/validation/test")
+    parser.add_argument('--drop-duplicates', action='store_true',
+                        help="Keep one image per near-duplicate cluster instead of grouping them")
+    args = parser.parse_args()
+    prepare_data(drop_duplicates=args.drop_duplicates)
@@ -1,5 +1,9 @@
 import tensorflow as tf
 import os
+import sys
+import time
+import argparse
+import numpy as np
 from tensorflow.keras.layers import (
     Dense, Dropout, GlobalAveragePooling2D,
     BatchNormalization, Input
@@ -9,10 +13,12 @@ from tensorflow.keras.applications.inception_resnet_v2 import preprocess_input
 from tensorflow.keras.models import Model
 from tensorflow.keras.optimizers import Adam
 from tensorflow.keras.regularizers import l2
-from tensorflow.keras.preprocessing.image import ImageDataGenerator
+from tensorflow.keras.preprocessing.image import ImageDataGenerator, load_img, img_to_array
 from tensorflow.keras.callbacks import ReduceLROnPlateau, EarlyStopping, ModelCheckpoint
 import tensorflow.keras.backend as K
 
+PROFILE_LOGDIR = os.path.join('logs', 'profile_train_model')
+
 def focal_loss(gamma=2.0, alpha=0.25):
     """Focal loss - must match training definition"""
     def focal_loss_fixed(y_true, y_pred):
@@ -62,33 +68,35 @@ def load_dataset(train_dir, val_dir, test_dir, batch_size=32, img_size=(300, 300
 
     return train_ds, val_ds, test_ds
 
-def build_model(input_shape=(300, 300, 3)):
+def build_model(input_shape=(300, 300, 3), unfrozen_layers=150, dropout=0.2, l2_weight=0.0001,
+                dense_units=1024, weights="imagenet"):
     inputs = Input(shape=input_shape)
     
     base_model = InceptionResNetV2(
         include_top=False,
-        weights="imagenet",
+        weights=weights,
         input_tensor=inputs
     )
     
     # Freeze base model first
     base_model.trainable = False
     
-    # Unfreeze last 150 layers for fine-tuning
-    for layer in base_model.layers[-150:]:
-        layer.trainable = True
+    # Unfreeze the last layers for fine-tuning
+    if unfrozen_layers:
+        for layer in base_model.layers[-unfrozen_layers:]:
+            layer.trainable = True
 
     x = base_model.output
     x = GlobalAveragePooling2D()(x)
 
     # Reduced regularization
-    x = Dense(1024, activation='swish', kernel_regularizer=l2(0.0001))(x)
+    x = Dense(dense_units, activation='swish', kernel_regularizer=l2(l2_weight))(x)
     x = BatchNormalization()(x)
-    x = Dropout(0.2)(x)
+    x = Dropout(dropout)(x)
 
-    x = Dense(512, activation='swish', kernel_regularizer=l2(0.0001))(x)
+    x = Dense(dense_units // 2, activation='swish', kernel_regularizer=l2(l2_weight))(x)
     x = BatchNormalization()(x)
-    x = Dropout(0.2)(x)
+    x = Dropout(dropout)(x)
 
     x = Dense(256, activation='swish')(x)
     x = BatchNormalization()(x)
@@ -98,8 +106,76 @@ def build_model(input_shape=(300, 300, 3)):
     model = Model(inputs, outputs)
     return model
 
+def profile_training(train_ds, val_ds, model, epochs=1, logdir=PROFILE_LOGDIR, max_steps=None):
+    """
+    Run a few epochs of the ImageDataGenerator pipeline and rank where the time goes.
+
+    Batches are assembled the way flow_from_directory does it, one stage at a
+    time: PIL decode + resize, the random ImageDataGenerator transforms, then
+    preprocess_input. Each batch then goes through the compiled train step.
+    The first step traces the graph, so it is reported on its own and left out
+    of the stage shares.
+    """
+    sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
+    from training_profiler import StageProfiler
+
+    profiler = StageProfiler(logdir)
+    datagen = train_ds.image_data_generator
+    labels = train_ds.classes.astype(np.float32)
+    steps = 0
+    profiler.start_trace()
+    try:
+        for epoch in range(epochs):
+            print(f"Profiling epoch {epoch + 1}/{epochs}")
+            order = np.random.permutation(len(train_ds.filepaths))
+            for start in range(0, len(order), train_ds.batch_size):
+                if max_steps is not None and steps >= max_steps:
+                    break
+                index = order[start:start + train_ds.batch_size]
+                with profiler.stage("PIL decode + resize"):
+                    images = [img_to_array(load_img(train_ds.filepaths[i], target_size=train_ds.target_size))
+                              for i in index]
+                with profiler.stage("ImageDataGenerator transforms"):
+                    images = [datagen.apply_transform(x, datagen.get_random_transform(x.shape)) for x in images]
+                with profiler.stage("preprocess_input"):
+                    batch = np.stack([datagen.standardize(x) for x in images])
+
+                if steps == 0:
+                    # Graph tracing and first-call allocation, not steady-state work
+                    first = time.perf_counter()
+                    model.train_on_batch(batch, labels[index])
+                    profiler.add("first step (tracing)", time.perf_counter() - first)
+                else:
+                    with profiler.stage("train step"):
+                        model.train_on_batch(batch, labels[index])
+                steps += 1
+
+            with profiler.stage("validation"):
+                model.evaluate(val_ds, verbose=0)
+    finally:
+        profiler.stop_trace()
+
+    print("\n" + profiler.summary())
+    profiler.save()
+    print(f"\nTensorBoard trace and summary written to {logdir}")
+    print(f"View with: tensorboard --logdir {logdir}")
+    return profiler
+
 def main():
+    parser = argparse.ArgumentParser(description="Train the production crack model on data/processed")
+    parser.add_argument('--profile', action='store_true',
+                        help="Profile data loading, augmentation and the train step instead of full training")
+    parser.add_argument('--profile-epochs', type=int, default=1)
+    parser.add_argument('--profile-steps', type=int, default=None, help="Stop each epoch after N batches")
+    parser.add_argument('--profile-logdir', default=PROFILE_LOGDIR)
+    args = parser.parse_args()
+
     base_dir = "data/processed"
+    if os.getenv("RAIL_ROI", "0") == "1":
+        # Rail-cropped copy, matching the crop the server applies with RAIL_ROI=1
+        base_dir = "data/processed_roi"
+        if not os.path.isdir(base_dir):
+            raise SystemExit(f"{base_dir} not found; run `python rail_roi.py crop-dataset` first")
     train_dir = os.path.join(base_dir, "train")
     val_dir = os.path.join(base_dir, "validation")
     test_dir = os.path.join(base_dir, "test")
@@ -123,6 +199,10 @@ def main():
     loss_fn = focal_loss(gamma=2.0, alpha=0.25)
     model.compile(optimizer=optimizer, loss=loss_fn, metrics=["accuracy"])
     
+    if args.profile:
+        profile_training(train_ds, val_ds, model, args.profile_epochs, args.profile_logdir, args.profile_steps)
+        return
+    
     # Callbacks
     reduce_lr = ReduceLROnPlateau(monitor="val_loss", factor=0.3, patience=2, min_lr=1e-6)
     early_stopping = EarlyStopping(monitor="val_loss", patience=15, restore_best_weights=True)
@@ -0,0 +1,102 @@
+import io
+import os
+import sys
+import json
+
+import numpy as np
+from PIL import Image
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import active_learning  # noqa: E402
+from active_learning import FrameMiner  # noqa: E402
+
+
+def image(seed, fmt='JPEG', size=(96, 96)):
+    pixels = np.random.default_rng(seed).integers(0, 256, (12, 12, 3), dtype=np.uint8)
+    buf = io.BytesIO()
+    Image.fromarray(pixels).resize(size, Image.NEAREST).save(buf, fmt)
+    buf.seek(0)
+    return buf
+
+
+def verdict(probability_faulty, threshold=0.5, score_std=None):
+    result = {'has_crack': probability_faulty >= threshold, 'raw_score': 1 - probability_faulty,
+              'probability_faulty': probability_faulty, 'threshold': threshold}
+    if score_std is not None:
+        result['tta'] = {'score_std': score_std}
+    return result
+
+
+def miner(tmp_path, **kwargs):
+    os.makedirs(tmp_path / 'raw', exist_ok=True)
+    return FrameMiner(queue_dir=str(tmp_path / 'queue'), raw_dir=str(tmp_path / 'raw'), **kwargs)
+
+
+def test_priority_from_threshold_margin_and_tta_spread(tmp_path):
+    m = miner(tmp_path, band=0.1, min_disagreement=0.1)
+    try:
+        assert m.priority(verdict(0.95)) is None
+        assert m.priority(verdict(0.5)) == 1.0
+        assert m.priority(verdict(0.55)) == 0.5
+        # Confident but the TTA views disagree
+        assert m.priority(verdict(0.95, score_std=0.15)) == 0.75
+        assert m.priority(verdict(0.55, score_std=0.3)) == 1.0
+    finally:
+        m.close()
+
+
+def test_candidates_are_queued_once_and_near_duplicates_dropped(tmp_path):
+    os.makedirs(tmp_path / 'raw')
+    with open(tmp_path / 'raw' / 'cracked_1.jpg', 'wb') as f:
+        f.write(image(99).getvalue())
+
+    m = miner(tmp_path)
+    assert not m.offer(image(1), verdict(0.99))            # confident: not a candidate
+    assert m.offer(image(2), verdict(0.52), frame_id='a')
+    assert m.offer(image(2, 'PNG'), verdict(0.5))           # same frame, re-encoded
+    assert m.offer(image(99), verdict(0.5))                 # already labelled in data/raw
+    m.close()
+
+    stats = m.stats()
+    assert stats['queued'] == 1 and stats['duplicates'] == 2
+    (meta,) = active_learning.queued(m.queue_dir)
+    assert meta['name'].startswith('cracked_mined_') and meta['name'].endswith('.jpg')
+    assert meta['frame_id'] == 'a' and meta['probability_faulty'] == 0.52
+    assert os.path.exists(os.path.join(m.queue_dir, meta['name']))
+
+
+def test_full_queue_evicts_the_lowest_priority_frame(tmp_path):
+    m = miner(tmp_path, capacity=2)
+    for seed, p in ((1, 0.58), (2, 0.55), (3, 0.51)):
+        m.offer(image(seed), verdict(p))
+    m.close()
+    assert m.stats()['evicted'] == 1
+    assert [q['probability_faulty'] for q in active_learning.queued(m.queue_dir)] == [0.51, 0.55]
+    # Lower than everything queued: turned away on the request path
+    assert not m.offer(image(4), verdict(0.59))
+    assert m.counts['below_queue'] == 1
+
+    # A restart picks the queue back up from the sidecars
+    restarted = miner(tmp_path, capacity=2)
+    restarted.close()
+    assert restarted.stats()['queue_size'] == 2 and restarted.stats()['lowest_priority'] == 0.5
+
+
+def test_relabelled_frames_are_promoted_into_raw(tmp_path):
+    m = miner(tmp_path)
+    m.offer(image(1), verdict(0.45))
+    m.close()
+    (meta,) = active_learning.queued(m.queue_dir)
+    assert meta['name'].startswith('normal_mined_')
+
+    name = active_learning.relabel(meta['name'], 'cracked', m.queue_dir)
+    assert name == 'cracked' + meta['name'][len('normal'):]
+    active_learning.promote(queue_dir=m.queue_dir, raw_dir=str(tmp_path / 'raw'))
+
+    assert os.listdir(tmp_path / 'raw') == [name]
+    assert active_learning.queued(m.queue_dir) == []
+    with open(os.path.join(m.queue_dir, 'promoted.jsonl')) as f:
+        (line,) = [json.loads(line) for line in f]
+    assert line['label'] == 'cracked' and line['predicted'] == 'normal'
@@ -0,0 +1,48 @@
+import io
+import os
+import sys
+
+import pytest
+from PIL import Image
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+app = pytest.importorskip('app')
+from fastapi.testclient import TestClient  # noqa: E402
+
+
+@pytest.fixture
+def client():
+    # No lifespan: nothing is loaded, but the scheduler has to run to answer
+    app.inference_scheduler.start()
+    return TestClient(app.app)
+
+
+def jpeg(size=(64, 64)):
+    buf = io.BytesIO()
+    Image.new('RGB', size, (128, 128, 128)).save(buf, 'JPEG')
+    return buf.getvalue()
+
+
+def test_upload_before_the_model_loads_is_503_with_retry_after(client):
+    r = client.post('/upload/', files={'file': ('f.jpg', jpeg(), 'image/jpeg')})
+    assert r.status_code == 503
+    assert r.headers['retry-after'] == app.MODEL_RETRY_AFTER
+    assert r.json()['error'] is True
+
+
+def test_batch_frames_before_the_model_loads_are_marked_503(client):
+    r = client.post('/upload/batch/', files=[('files', ('a.jpg', jpeg(), 'image/jpeg')),
+                                             ('files', ('b.jpg', jpeg(), 'image/jpeg'))])
+    assert r.status_code == 200
+    assert [res['status'] for res in r.json()['results']] == [503, 503]
+
+
+@pytest.mark.parametrize('path', ['/upload/', '/upload/batch/', '/explain/'])
+def test_oversized_uploads_are_refused_before_reading(client, monkeypatch, path):
+    monkeypatch.setattr(app, 'MAX_UPLOAD_BYTES', 1024)
+    field = 'files' if path.endswith('batch/') else 'file'
+    r = client.post(path, files={field: ('f.jpg', jpeg((512, 512)) + b'\0' * 2048, 'image/jpeg')})
+    assert r.status_code == 413
+    assert r.json()['error'] is True
@@ -0,0 +1,106 @@
+import os
+import sys
+import hashlib
+
+import numpy as np
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import calibration  # noqa: E402
+from calibration import Calibration, calibration_path, operating_points, threshold_sweep  # noqa: E402
+
+
+def write_model(directory, content):
+    path = os.path.join(directory, 'model.tflite')
+    with open(path, 'wb') as f:
+        f.write(content)
+    return path
+
+
+def test_probability_faulty_per_method():
+    assert Calibration().probability_faulty(0.8) == pytest.approx(0.2)
+    # Platt with a=1, b=0 is the identity on P(Faulty)
+    assert Calibration('platt', {'a': 1.0, 'b': 0.0}).probability_faulty(0.8) == pytest.approx(0.2)
+    assert Calibration('platt', {'a': 1.0, 'b': 1.0}).probability_faulty(0.8) > 0.2
+    isotonic = Calibration('isotonic', {'x': [0.0, 0.5, 1.0], 'y': [0.0, 0.9, 1.0]})
+    assert isotonic.probability_faulty(0.75) == pytest.approx(0.45)
+
+
+def test_resolve_prefers_the_request_then_the_site_then_the_default():
+    cal = Calibration(operating_points={'default': {'threshold': 0.5}, 'high-recall': {'threshold': 0.2},
+                                        'balanced': {'threshold': 0.4}},
+                      default_point='balanced', sites={'depot-a': 'high-recall'})
+    assert cal.resolve() == ('balanced', 0.4)
+    assert cal.resolve(site='depot-a') == ('high-recall', 0.2)
+    assert cal.resolve(operating_point='default', site='depot-a') == ('default', 0.5)
+    with pytest.raises(ValueError):
+        cal.resolve(operating_point='nope')
+
+
+def test_operating_points_meet_their_targets():
+    rng = np.random.default_rng(0)
+    labels = np.r_[np.ones(200), np.zeros(800)].astype(np.int64)
+    probs = np.clip(np.r_[rng.normal(0.7, 0.15, 200), rng.normal(0.3, 0.15, 800)], 0, 1)
+    points = operating_points(probs, labels, target_recall=0.95, target_precision=0.9)
+
+    def measured(threshold):
+        predicted = probs >= threshold
+        tp = np.sum(predicted & (labels == 1))
+        return tp / max(predicted.sum(), 1), tp / labels.sum()
+
+    precision, recall = measured(points['high-recall']['threshold'])
+    assert recall >= 0.95 and recall == pytest.approx(points['high-recall']['recall'], abs=1e-4)
+    precision, recall = measured(points['high-precision']['threshold'])
+    assert precision >= 0.9
+    thresholds, _, _, f1 = threshold_sweep(probs, labels)
+    assert points['balanced']['f1'] == pytest.approx(f1.max(), abs=1e-4)
+    assert points['high-recall']['threshold'] <= points['balanced']['threshold'] <= \
+        points['high-precision']['threshold']
+
+
+def test_for_model_ignores_a_calibration_fitted_for_other_bytes(tmp_path, monkeypatch, capsys):
+    monkeypatch.setattr(calibration, 'LEGACY_THRESHOLD_PATH', str(tmp_path / 'none.npy'))
+    model = write_model(str(tmp_path), b'model one')
+    fitted = Calibration(operating_points={'default': {'threshold': 0.3}})
+    fitted.save(calibration_path(model), model_sha256=hashlib.sha256(b'model one').hexdigest())
+    assert Calibration.for_model(model).resolve() == ('default', 0.3)
+
+    # Rebuilt in place: the calibration beside it no longer applies
+    write_model(str(tmp_path), b'model two')
+    assert Calibration.for_model(model).resolve() == ('default', 0.5)
+    assert 'fitted for another model' in capsys.readouterr().out
+
+    # Calibrations written before hashes were recorded are still used
+    fitted.save(calibration_path(model))
+    assert Calibration.for_model(model).resolve() == ('default', 0.3)
+
+
+def test_promote_refits_the_calibration_of_the_replaced_model(tmp_path, monkeypatch):
+    import build_models
+    output = write_model(str(tmp_path), b'old build')
+    artifact = str(tmp_path / 'new.tflite')
+    with open(artifact, 'wb') as f:
+        f.write(b'new build')
+    Calibration('platt', {'a': 1.0, 'b': 0.0}, sites={'depot-a': 'default'}).save(
+        calibration_path(output), model_sha256=hashlib.sha256(b'old build').hexdigest())
+
+    def fake_refit(model_path, previous, data_dir):
+        refitted = Calibration('platt', {'a': 2.0, 'b': 0.0}, sites=previous.sites)
+        return refitted, hashlib.sha256(open(model_path, 'rb').read()).hexdigest(), np.zeros(10)
+    monkeypatch.setattr(build_models, 'refit', fake_refit)
+
+    assert build_models.promote(artifact, output)
+    refreshed = Calibration.load(calibration_path(output))
+    assert refreshed.model_sha256 == hashlib.sha256(b'new build').hexdigest()
+    assert refreshed.params == {'a': 2.0, 'b': 0.0} and refreshed.sites == {'depot-a': 'default'}
+
+    # When refitting fails the stale file is removed rather than left to shift thresholds
+    def failing_refit(*args):
+        raise FileNotFoundError('no validation split')
+    monkeypatch.setattr(build_models, 'refit', failing_refit)
+    with open(artifact, 'wb') as f:
+        f.write(b'third build')
+    assert build_models.promote(artifact, output)
+    assert not os.path.exists(calibration_path(output))
@@ -0,0 +1,125 @@
+import os
+import re
+import sys
+import json
+import asyncio
+
+import httpx
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import verdict_format  # noqa: E402
+from crack_client import AsyncCrackDetectionClient  # noqa: E402
+
+
+def batch_server(compact, refusals):
+    """A /upload/batch/ handler that turns each frame away (503, then 504) refusals[frame_id] times"""
+    calls = []
+
+    def handler(request):
+        body = request.content.decode('latin-1')
+        metadata = json.loads(re.search(r'name="metadata"\r\n\r\n(.*?)\r\n--', body, re.S).group(1))
+        calls.append([m['frame_id'] for m in metadata])
+        results = []
+        for m in metadata:
+            left = refusals.get(m['frame_id'], 0)
+            if left:
+                refusals[m['frame_id']] = left - 1
+                results.append({'error': True, 'message': 'busy', 'status': 503 if left % 2 else 504})
+            else:
+                results.append({'has_crack': False, 'raw_score': 0.9, 'probability_faulty': 0.1,
+                                'threshold': 0.5, 'frame_id': m['frame_id']})
+        if compact:
+            return httpx.Response(200, content=verdict_format.encode_batch(results),
+                                  headers={'content-type': verdict_format.MEDIA_TYPE})
+        return httpx.Response(200, json={'results': results, 'count': len(results)})
+    return handler, calls
+
+
+@pytest.mark.parametrize('compact', [False, True])
+def test_frames_refused_inside_a_batch_are_resubmitted(compact):
+    handler, calls = batch_server(compact, {'f1': 1, 'f3': 2})
+
+    async def run():
+        client = AsyncCrackDetectionClient('http://test', compact=compact, backoff=0.0)
+        await client.http.aclose()
+        client.http = httpx.AsyncClient(transport=httpx.MockTransport(handler))
+        async with client:
+            metadata = [{'frame_id': f'f{i}'} for i in range(4)]
+            return await client.predict_batch([b'\xff\xd8'] * 4, metadata)
+
+    verdicts = asyncio.run(run())
+    assert [v.get('error') for v in verdicts] == [None] * 4
+    assert [v['frame_id'] for v in verdicts] == ['f0', 'f1', 'f2', 'f3']
+    assert calls == [['f0', 'f1', 'f2', 'f3'], ['f1', 'f3'], ['f3']]
+
+
+def test_compact_error_records_keep_their_status():
+    records = verdict_format.decode_batch(verdict_format.encode_batch([
+        {'error': True, 'message': 'queue full', 'status': 503},
+        {'error': True, 'message': 'deadline', 'status': 504},
+        {'error': True, 'message': 'not an image'},
+    ]))
+    assert [r.get('status') for r in records] == [503, 504, None]
+
+
+async def mock_client(handler, **kwargs):
+    client = AsyncCrackDetectionClient('http://test', compact=False, backoff=0.0, max_retries=1, **kwargs)
+    await client.http.aclose()
+    client.http = httpx.AsyncClient(transport=httpx.MockTransport(handler))
+    return client
+
+
+def upload_server(state):
+    """An /upload/ handler that is still loading its model, then serves verdicts (or refuses non-images)"""
+    def handler(request):
+        if state['loading']:
+            return httpx.Response(503, headers={'Retry-After': '0'},
+                                  json={'error': True, 'message': 'Model is still loading, try again shortly.'})
+        if b'not-an-image' in request.content:
+            return httpx.Response(200, json={'error': True, 'message': 'Invalid file type. Please upload an image.'})
+        state['served'] += 1
+        return httpx.Response(200, json={'has_crack': False, 'raw_score': 0.9, 'probability_faulty': 0.1})
+    return handler
+
+
+def test_frames_are_spooled_while_the_model_loads_and_kept_until_a_verdict(tmp_path):
+    state = {'loading': True, 'served': 0}
+    spool_dir = str(tmp_path / 'spool')
+
+    async def run():
+        async with await mock_client(upload_server(state), spool_dir=spool_dir) as client:
+            assert await client.predict(b'\xff\xd8 frame-1', filename='f1.jpg') is None
+            assert await client.predict(b'not-an-image', filename='f2.jpg') is None
+            assert await client.predict(b'\xff\xd8 frame-3', filename='f3.jpg') is None
+            assert len(client.spool.pending()) == 3
+
+            # A drain while the model still loads must not lose anything
+            assert await client.drain_spool() == 0
+            assert len(client.spool.pending()) == 3
+
+            state['loading'] = False
+            sent = await client.drain_spool()
+            return sent, client.spool.pending()
+
+    sent, pending = asyncio.run(run())
+    assert sent == 2 and state['served'] == 2
+    assert pending == []
+    # The refused frame is set aside on disk rather than deleted
+    assert len([f for f in os.listdir(spool_dir) if f.endswith('.rejected')]) == 1
+
+
+def test_batch_frames_still_refused_after_retries_are_spooled(tmp_path):
+    handler, calls = batch_server(False, {'f1': 5})
+
+    async def run():
+        async with await mock_client(handler, spool_dir=str(tmp_path / 'spool')) as client:
+            client.batch_available = True
+            verdicts = await client.predict_batch([b'\xff\xd8'] * 2, [{'frame_id': 'f0'}, {'frame_id': 'f1'}])
+            return verdicts, client.spool.pending()
+
+    verdicts, pending = asyncio.run(run())
+    assert verdicts[0]['frame_id'] == 'f0' and verdicts[1] is None
+    assert len(pending) == 1
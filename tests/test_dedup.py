@@ -0,0 +1,82 @@
+import io
+import os
+import sys
+import glob
+import random
+
+import pytest
+from PIL import Image, ImageEnhance
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT, 'src', 'data'))
+
+import dedup  # noqa: E402
+from dedup import MAX_DISTANCE, check_bands, find_duplicate_clusters, hamming  # noqa: E402
+
+
+def test_variants_of_one_image_cluster_together_and_apart_from_others(tmp_path):
+    sources = sorted(p for p in glob.glob(os.path.join(ROOT, 'data', 'raw', '*.jpg')))[:4]
+    paths = []
+    for n, source in enumerate(sources):
+        with Image.open(source) as img:
+            img = img.convert('RGB')
+            variants = {
+                'orig': img,
+                'small': img.resize((img.width // 2, img.height // 2)),
+                'bright': ImageEnhance.Brightness(img).enhance(1.1),
+            }
+            for name, variant in variants.items():
+                buffer = io.BytesIO()
+                variant.save(buffer, 'JPEG', quality=70)
+                path = tmp_path / f"{n}_{name}.jpg"
+                path.write_bytes(buffer.getvalue())
+                paths.append(str(path))
+
+    clusters, hashes = find_duplicate_clusters(paths)
+    assert sorted(sorted(os.path.basename(p).split('_')[0] for p in c) for c in clusters) == \
+        [[str(n)] * 3 for n in range(len(sources))]
+    for a in paths:
+        for b in paths:
+            same = os.path.basename(a)[0] == os.path.basename(b)[0]
+            assert (hamming(hashes[a], hashes[b]) <= MAX_DISTANCE) == same
+
+
+def test_clusters_match_all_pairs_comparison(monkeypatch):
+    rng = random.Random(0)
+    hashes = {}
+    for n in range(60):
+        base = rng.getrandbits(64)
+        hashes[f"{n}"] = base
+        # Neighbours at the threshold and just past it, with flips packed into one band or spread out
+        for k, distance in enumerate((MAX_DISTANCE, MAX_DISTANCE + 1)):
+            bits = rng.sample(range(48, 64), distance) if n % 2 else rng.sample(range(64), distance)
+            hashes[f"{n}-{k}"] = base ^ sum(1 << b for b in bits)
+    monkeypatch.setattr(dedup, 'hash_file', hashes.get)
+
+    clusters, _ = find_duplicate_clusters(list(hashes))
+
+    # Connected components of the all-pairs graph
+    names = list(hashes)
+    component = {name: {name} for name in names}
+    for i, a in enumerate(names):
+        for b in names[i + 1:]:
+            if hamming(hashes[a], hashes[b]) <= MAX_DISTANCE and component[a] is not component[b]:
+                merged = component[a] | component[b]
+                for name in merged:
+                    component[name] = merged
+    expected = {frozenset(c) for c in component.values()}
+    assert {frozenset(c) for c in clusters} == expected
+    assert all(any(f"{n}" in c and f"{n}-0" in c for c in expected) for n in range(60))
+
+
+@pytest.mark.parametrize('bands', [0, 1, 2, 3, 5, 7])
+def test_bands_that_break_the_index_are_rejected(bands):
+    with pytest.raises(ValueError):
+        check_bands(bands, MAX_DISTANCE)
+    with pytest.raises(ValueError):
+        find_duplicate_clusters([], bands=bands)
+
+
+@pytest.mark.parametrize('bands', [4, 8, 16])
+def test_bands_that_divide_the_hash_are_accepted(bands):
+    check_bands(bands, MAX_DISTANCE)
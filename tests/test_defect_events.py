@@ -0,0 +1,23 @@
+import os
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from defect_events import DefectEventAggregator, replay  # noqa: E402
+from results_store import ResultsStore  # noqa: E402
+
+
+def test_replay_follows_capture_time_not_insertion_order(tmp_path):
+    store = ResultsStore(str(tmp_path / 'results.db'))
+    # One crack seen in 10 consecutive frames 0.1 m apart, stored by two workers in turn
+    frames = [(1000.0 + i * 0.01, i * 0.1) for i in range(10)]
+    for ts, odometer_m in frames[1::2] + frames[::2]:
+        store.record(ts=ts, site='depot', camera_id='cam-1', segment='S12', odometer_m=odometer_m,
+                     raw_score=0.1, probability_faulty=0.9, has_crack=True)
+    store.close()
+
+    events = []
+    aggregator = DefectEventAggregator(events.append, gap_m=0.15, idle_timeout_s=float('inf'))
+    assert replay(store, aggregator, segment='S12') == 10
+    assert [(e['frame_count'], e['start_position_m'], e['end_position_m']) for e in events] == [(10, 0.0, 0.9)]
@@ -0,0 +1,63 @@
+import os
+import sys
+import json
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from frame_sampler import FrameSampler  # noqa: E402
+
+
+def test_rate_falls_under_backlog_and_recovers_with_headroom():
+    sampler = FrameSampler(camera_fps=120, target_queue_depth=16, decrease=0.5, increase_fps=10, interval_s=1.0)
+    assert sampler.update(queue_depth=40, now=0.0) == pytest.approx(60)
+    # Within the interval nothing changes
+    assert sampler.update(queue_depth=40, now=0.5) == pytest.approx(60)
+    assert sampler.update(queue_depth=40, now=1.0) == pytest.approx(30)
+    assert sampler.update(queue_depth=10, now=2.0) == pytest.approx(30)  # between half and target: steady
+    assert sampler.update(queue_depth=0, now=3.0) == pytest.approx(40)
+    for t in range(4, 20):
+        sampler.update(queue_depth=0, now=float(t))
+    assert sampler.rate == 120
+    assert [d['reason'] for d in sampler.decisions[:3]] == ['backlog', 'backlog', 'headroom']
+
+
+def test_coverage_floor_holds_under_overload(tmp_path, capsys):
+    log_path = str(tmp_path / 'sampling.jsonl')
+    sampler = FrameSampler(camera_fps=120, footprint_m=0.5, min_overlap=0.2, decrease=0.5,
+                           interval_s=1.0, log_path=log_path)
+    # 0.4 m spacing at 6 m/s is every 8th camera frame
+    sampler.update(speed_mps=6.0, queue_depth=100, now=0.0)
+    for t in range(1, 10):
+        sampler.update(queue_depth=100, now=float(t))
+    assert sampler.floor_rate == pytest.approx(15)
+    assert sampler.rate == pytest.approx(15)
+    assert sampler.overlap() >= sampler.min_overlap - 1e-9
+    assert sampler.decisions[-1]['reason'] == 'coverage-limited'
+    # Warned once when it first hit the floor, not on every interval
+    assert capsys.readouterr().out.count('coverage floor') == 1
+    with open(log_path) as f:
+        assert [json.loads(line)['reason'] for line in f] == [d['reason'] for d in sampler.decisions]
+
+
+def test_offer_keeps_frames_one_period_apart():
+    sampler = FrameSampler(camera_fps=120)
+    sampler.rate = 30
+    kept = [i for i in range(120) if sampler.offer(timestamp=i / 120)]
+    assert kept == list(range(0, 120, 4))
+    assert sampler.stats()['offered'] == 120 and sampler.stats()['kept'] == 30
+
+
+def test_odometer_forces_frames_so_coverage_has_no_gaps():
+    sampler = FrameSampler(camera_fps=120, footprint_m=0.5, min_overlap=0.2)
+    # A rate far below what 10 m/s needs, and no speed known up front
+    sampler.rate = 2
+    positions = [i * 10 / 120 for i in range(240)]
+    kept = [m for i, m in enumerate(positions) if sampler.offer(timestamp=i / 120, odometer_m=m)]
+    gaps = [b - a for a, b in zip(kept, kept[1:])]
+    assert max(gaps) <= sampler.max_spacing_m + 1e-9
+    assert sampler.forced > 0
+    # The odometer also fed the speed estimate
+    assert sampler.speed_mps > 5
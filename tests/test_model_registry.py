@@ -0,0 +1,67 @@
+import os
+import sys
+import json
+import hashlib
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import model_registry  # noqa: E402
+from calibration import Calibration, calibration_path  # noqa: E402
+
+
+def write_model(directory, content, calibration_for=None):
+    """A stand-in model file, optionally with a calibration.json fitted for the given bytes"""
+    os.makedirs(directory, exist_ok=True)
+    path = os.path.join(directory, 'model.tflite')
+    with open(path, 'wb') as f:
+        f.write(content)
+    if calibration_for is not None:
+        Calibration(operating_points={'default': {'threshold': 0.3}}).save(
+            calibration_path(path), model_sha256=hashlib.sha256(calibration_for).hexdigest())
+    return path
+
+
+def test_register_records_the_hash_of_the_copied_file(tmp_path):
+    registry_file = str(tmp_path / 'registry' / 'registry.json')
+    source = write_model(str(tmp_path / 'build'), b'model one')
+
+    version = model_registry.register_model(source, registry_file=registry_file)
+    info = model_registry.load_registry(registry_file)['versions'][version]
+    assert version == 'v1'
+    assert info['sha256'] == hashlib.sha256(b'model one').hexdigest()
+    assert info['sha256'] == model_registry.file_sha256(info['path'])
+    with pytest.raises(ValueError):
+        model_registry.register_model(source, version='v1', registry_file=registry_file)
+
+
+def test_calibration_travels_only_with_the_model_it_was_fitted_for(tmp_path):
+    registry_file = str(tmp_path / 'registry' / 'registry.json')
+    fitted = write_model(str(tmp_path / 'fitted'), b'model one', calibration_for=b'model one')
+    # Model rebuilt in place after calibrating: the calibration.json beside it is stale
+    stale = write_model(str(tmp_path / 'stale'), b'model two', calibration_for=b'model one')
+
+    v1 = model_registry.register_model(fitted, registry_file=registry_file)
+    v2 = model_registry.register_model(stale, registry_file=registry_file)
+    versions = model_registry.load_registry(registry_file)['versions']
+
+    copied = calibration_path(versions[v1]['path'])
+    assert os.path.exists(copied)
+    with open(copied) as f:
+        assert json.load(f)['model_sha256'] == versions[v1]['sha256']
+    assert not os.path.exists(calibration_path(versions[v2]['path']))
+
+
+def test_activate_and_rollback_resolve_the_registered_paths(tmp_path):
+    registry_file = str(tmp_path / 'registry' / 'registry.json')
+    assert model_registry.resolve_active(registry_file) == (model_registry.LEGACY_VERSION,
+                                                            model_registry.LEGACY_MODEL_PATH)
+    v1 = model_registry.register_model(write_model(str(tmp_path / 'a'), b'a'), activate=True,
+                                       registry_file=registry_file)
+    v2 = model_registry.register_model(write_model(str(tmp_path / 'b'), b'b'), activate=True,
+                                       registry_file=registry_file)
+    assert model_registry.resolve_active(registry_file)[0] == v2
+    assert model_registry.rollback(registry_file) == v1
+    assert model_registry.resolve_active(registry_file)[1].endswith(os.path.join(v1, 'model.tflite'))
@@ -0,0 +1,36 @@
+import os
+import glob
+import shutil
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT, 'src', 'data'))
+
+from prepare_data import prepare_data  # noqa: E402
+
+
+def split_files(processed_dir):
+    files = {}
+    for split in ('train', 'validation', 'test'):
+        for path in glob.glob(os.path.join(processed_dir, split, '*', '*')):
+            files.setdefault(os.path.basename(path), []).append(split)
+    return files
+
+
+def test_rerun_keeps_splits_disjoint(tmp_path):
+    raw = sorted(glob.glob(os.path.join(ROOT, 'data', 'raw', '*')))
+    raw_dir = tmp_path / 'raw'
+    raw_dir.mkdir()
+    for path in raw[::3]:
+        shutil.copy(path, raw_dir)
+    prepare_data(base_dir=str(tmp_path))
+
+    # New raw files reshuffle the clusters, so most images change split on the re-run
+    for path in raw[1::3]:
+        shutil.copy(path, raw_dir)
+    prepare_data(base_dir=str(tmp_path))
+
+    files = split_files(tmp_path / 'processed')
+    assert {name: splits for name, splits in files.items() if len(splits) > 1} == {}
+    assert set(files) == {os.path.basename(p) for p in glob.glob(str(raw_dir / '*'))
+                          if 'cracked' in os.path.basename(p).lower() or 'normal' in os.path.basename(p).lower()}
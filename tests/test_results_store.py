@@ -0,0 +1,68 @@
+import os
+import sys
+import sqlite3
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from results_store import ResultsStore, decode_cursor  # noqa: E402
+
+FILTERS = [
+    {},
+    {'start': 10.0, 'end': 20.0},
+    {'site': 'depot'},
+    {'camera_id': 'cam-1', 'start': 10.0},
+    {'segment': 'A12'},
+    {'defects_only': True, 'start': 10.0},
+    {'site': 'depot', 'defects_only': True},
+]
+
+
+@pytest.fixture
+def store(tmp_path):
+    store = ResultsStore(str(tmp_path / 'results.db'))
+    # Out of time order, with ties on ts, as late uploads arrive
+    for i, ts in enumerate([5.0, 3.0, 3.0, 9.0, 1.0, 3.0, 7.0, 1.0, 5.0, 2.0]):
+        store.record(ts=ts, site='depot', camera_id=f"cam-{i % 2}", segment='A12',
+                     raw_score=0.5, has_crack=i % 3 == 0)
+    store.close()
+    return store
+
+
+def test_pages_cover_every_row_in_ts_order(store):
+    rows, cursor = [], None
+    while True:
+        page, cursor = store.query(limit=3, cursor=cursor)
+        rows.extend(page)
+        if cursor is None:
+            break
+    keys = [(r['ts'], r['id']) for r in rows]
+    assert keys == sorted(keys)
+    assert len(set(keys)) == 10
+    assert [r['id'] for r in store.iter_query(page_size=4, site='depot')] == [k[1] for k in keys]
+
+
+def test_malformed_cursor_is_rejected(store):
+    with pytest.raises(ValueError):
+        store.query(cursor='not-a-cursor')
+    assert decode_cursor('0.1:7') == (0.1, 7)
+
+
+@pytest.mark.parametrize('filters', FILTERS)
+@pytest.mark.parametrize('after', [None, (3.0, 2)])
+def test_pages_are_served_from_an_index_without_sorting(store, filters, after):
+    for table, ts_column in (('predictions', 'ts'), ('defect_events', 'start_ts')):
+        if table == 'defect_events' and 'defects_only' in filters:
+            continue
+        where, params = store._where(ts_column=ts_column, after=after, **filters)
+        conn = sqlite3.connect(store.path)
+        try:
+            plan = [row[3] for row in conn.execute(
+                f"EXPLAIN QUERY PLAN SELECT * FROM {table}{where} ORDER BY {ts_column}, id LIMIT ?",
+                params + [100])]
+        finally:
+            conn.close()
+        assert not any('TEMP B-TREE' in step for step in plan), plan
+        assert any('USING INDEX' in step for step in plan), plan
@@ -0,0 +1,44 @@
+import os
+import sys
+import threading
+
+import numpy as np
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import scheduler  # noqa: E402
+
+
+def lock_is_free(lock):
+    """Whether another thread could take the lock right now"""
+    free = []
+
+    def probe():
+        free.append(lock.acquire(blocking=False))
+        if free[0]:
+            lock.release()
+    thread = threading.Thread(target=probe)
+    thread.start()
+    thread.join()
+    return free[0]
+
+
+def test_status_computes_percentiles_on_copies_outside_the_lock(monkeypatch):
+    sched = scheduler.InferenceScheduler(lambda payloads: payloads, batch_sizes=(1, 4), latency_window=64)
+    sched.start()
+    for i in range(100):
+        assert sched.submit(i, 'bulk').result(timeout=5) == i
+
+    percentile = np.percentile
+    calls = []
+
+    def checked_percentile(values, q):
+        # The dispatcher appends to the live deques; only a copy is safe to read without the lock
+        calls.append((type(values), lock_is_free(sched._cond)))
+        return percentile(values, q)
+
+    monkeypatch.setattr(scheduler.np, 'percentile', checked_percentile)
+    status = sched.status()
+    assert calls and set(calls) == {(list, True)}
+    assert status['classes']['bulk']['completed'] == 100
@@ -0,0 +1,61 @@
+import os
+import sys
+import uuid
+
+import numpy as np
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import verdict_format  # noqa: E402
+
+
+def result(**overrides):
+    base = {'has_crack': True, 'class': 'Faulty', 'raw_score': 0.125, 'probability_faulty': 0.8734,
+            'threshold': 0.42, 'model_version': 'v3', 'frame_id': 'cam-1/000123',
+            'event': {'event_id': uuid.UUID(int=7).hex}}
+    base.update(overrides)
+    return base
+
+
+def test_verdict_round_trip_keeps_every_field():
+    data = verdict_format.encode_verdict(result(tta={'variants': 5}))
+    verdict, offset = verdict_format.decode_verdict(data)
+    assert offset == len(data)
+    assert verdict['has_crack'] is True and verdict['class'] == 'Faulty' and verdict['tta'] is True
+    # Scores travel as float32
+    for key in ('raw_score', 'probability_faulty', 'threshold'):
+        assert verdict[key] == pytest.approx(float(np.float32(result()[key])))
+    assert verdict['event_id'] == uuid.UUID(int=7).hex
+    assert (verdict['model_version'], verdict['frame_id']) == ('v3', 'cam-1/000123')
+
+
+def test_normal_frame_without_event_or_ids():
+    data = verdict_format.encode_verdict(result(has_crack=False, event={}, model_version=None, frame_id=None))
+    verdict, _ = verdict_format.decode_verdict(data)
+    assert verdict['has_crack'] is False and verdict['class'] == 'Normal' and verdict['tta'] is False
+    assert verdict['event_id'] is None and verdict['frame_id'] is None and verdict['model_version'] == ''
+    assert len(data) == verdict_format.HEADER.size
+
+
+def test_batch_round_trip_with_an_error_record():
+    results = [result(frame_id='a'), {'error': True, 'message': 'Invalid file type.'}, result(frame_id='c')]
+    verdicts = verdict_format.decode_batch(verdict_format.encode_batch(results))
+    assert [v.get('frame_id') for v in verdicts] == ['a', None, 'c']
+    assert verdicts[1] == {'error': True, 'message': 'Invalid file type.', 'frame_id': None}
+    assert verdict_format.decode_batch(verdict_format.encode_batch([])) == []
+
+
+def test_long_strings_are_cut_to_255_bytes():
+    verdict, _ = verdict_format.decode_verdict(verdict_format.encode_verdict(result(frame_id='x' * 300)))
+    assert verdict['frame_id'] == 'x' * 255
+
+
+def test_records_of_another_format_are_rejected():
+    data = bytearray(verdict_format.encode_verdict(result()))
+    data[2] = verdict_format.VERSION + 1
+    with pytest.raises(ValueError):
+        verdict_format.decode_verdict(bytes(data))
+    with pytest.raises(ValueError):
+        verdict_format.decode_verdict(b'XX' + bytes(data[2:]))
@@ -17,6 +17,11 @@ from sklearn.model_selection import train_test_split
 from sklearn.utils import shuffle
 from sklearn.utils.class_weight import compute_class_weight
 import glob
+import time
+import argparse
+from contextlib import nullcontext
+
+import rail_roi
 
 # Set random seeds for reproducibility
 np.random.seed(42)
@@ -28,15 +33,27 @@ BATCH_SIZE = 16  # Reduced for better gradient updates
 EPOCHS_CRACK = 100
 TRACK_IMAGES_DIR = 'TrackImages'
 CRACK_MODEL_PATH = 'crack_model.keras'
+PROFILE_LOGDIR = os.path.join('logs', 'profile')
+
+# Set by --profile; when None the stage() wrappers are no-ops
+profiler = None
+
+def stage(name):
+    """Profiler stage context, or a no-op when profiling is off"""
+    return profiler.stage(name) if profiler is not None else nullcontext()
 
 def load_and_preprocess_image(image_path, target_size=(IMG_SIZE, IMG_SIZE)):
     """Load and preprocess an image"""
     try:
-        img = Image.open(image_path)
-        if img.mode != 'RGB':
-            img = img.convert('RGB')
-        img = img.resize(target_size, Image.Resampling.LANCZOS)
-        img_array = np.array(img, dtype=np.float32) / 255.0
+        with stage("decode (PIL)"):
+            img = Image.open(image_path)
+            if img.mode != 'RGB':
+                img = img.convert('RGB')
+            if rail_roi.ENABLED:
+                # Same crop as serving, so the model learns on rail-framed inputs
+                img = rail_roi.crop_to_rails(img)
+            img = img.resize(target_size, Image.Resampling.LANCZOS)
+            img_array = np.array(img, dtype=np.float32) / 255.0
         return img_array
     except Exception as e:
         print(f"Error loading {image_path}: {e}")
@@ -172,12 +189,13 @@ def create_crack_dataset():
             
             # IMPROVED: Add augmented versions of cracked images
             # Apply edge enhancement to make cracks more visible
-            img_uint8 = (img * 255).astype(np.uint8)
-            # Enhance edges
-            gray = cv2.cvtColor(img_uint8, cv2.COLOR_RGB2GRAY)
-            edges = cv2.Canny(gray, 50, 150)
-            edges_3ch = cv2.cvtColor(edges, cv2.COLOR_GRAY2RGB)
-            enhanced = cv2.addWeighted(img_uint8, 0.7, edges_3ch, 0.3, 0)
+            with stage("canny edge augmentation"):
+                img_uint8 = (img * 255).astype(np.uint8)
+                # Enhance edges
+                gray = cv2.cvtColor(img_uint8, cv2.COLOR_RGB2GRAY)
+                edges = cv2.Canny(gray, *rail_roi.CANNY_THRESHOLDS)
+                edges_3ch = cv2.cvtColor(edges, cv2.COLOR_GRAY2RGB)
+                enhanced = cv2.addWeighted(img_uint8, 0.7, edges_3ch, 0.3, 0)
             cracked_images.append(enhanced.astype(np.float32) / 255.0)
     
     normal_images = []
@@ -403,7 +421,113 @@ def train_crack_model():
     
     return model
 
+def _timed(fn, *args):
+    """Run a compiled function and wait for its result; returns seconds"""
+    start = time.perf_counter()
+    result = fn(*args)
+    tf.nest.map_structure(lambda t: t.numpy() if hasattr(t, 'numpy') else t, result)
+    return time.perf_counter() - start
+
+def profile_crack_training(epochs=1, logdir=PROFILE_LOGDIR, breakdown_every=4):
+    """
+    Run a few epochs of crack-model training and rank where the time goes.
+
+    Every step runs the compiled train step, which is timed as a whole. The
+    first step traces the graph, so it is reported on its own and left out
+    of the stage statistics. On every breakdown_every-th step, three compiled
+    (tf.function) forward passes run on the same batch:
+    - augmentation alone
+    - augmentation + backbone
+    - the full forward pass + loss
+    Differences between these give the augmentation, backbone and head shares.
+    The train step minus the full forward pass gives backward + update. The
+    per-stage times are scaled to every step, so the stage shares add up to
+    the train step time.
+    """
+    global profiler
+    from training_profiler import StageProfiler
+    
+    profiler = StageProfiler(logdir)
+    profiler.start_trace()
+    try:
+        with stage("dataset build (total)"):
+            X_train, X_val, y_train, y_val = create_crack_dataset()
+        
+        model, base_model = create_improved_model(name="crack_detector", use_deeper=True)
+        augmentation = model.get_layer("data_augmentation")
+        loss_fn = keras.losses.BinaryCrossentropy()
+        
+        @tf.function
+        def augment(x):
+            return augmentation(x, training=True)
+        
+        @tf.function
+        def augment_backbone(x):
+            x = augmentation(x, training=True)
+            return base_model(keras.applications.inception_resnet_v2.preprocess_input(x * 255.0), training=False)
+        
+        @tf.function
+        def forward(x, y):
+            return loss_fn(y, model(x, training=True))
+        
+        steps, parts = 0, {'augmentation layers': [], 'backbone forward': [], 'head forward': [],
+                           'backward + update': []}
+        step_seconds = []
+        for epoch in range(epochs):
+            print(f"Profiling epoch {epoch + 1}/{epochs}")
+            for start in range(0, len(X_train), BATCH_SIZE):
+                x = tf.convert_to_tensor(X_train[start:start + BATCH_SIZE])
+                y = tf.convert_to_tensor(y_train[start:start + BATCH_SIZE].reshape(-1, 1), tf.float32)
+                
+                step = _timed(model.train_on_batch, x, y)
+                if steps == 0:
+                    # Graph tracing and first-call allocation, not steady-state work
+                    profiler.add("first step (tracing)", step)
+                    for fn, args in ((augment, (x,)), (augment_backbone, (x,)), (forward, (x, y))):
+                        _timed(fn, *args)
+                    steps += 1
+                    continue
+                steps += 1
+                step_seconds.append(step)
+                
+                if (steps - 2) % breakdown_every == 0:
+                    aug = _timed(augment, x)
+                    features = _timed(augment_backbone, x)
+                    full = _timed(forward, x, y)
+                    parts['augmentation layers'].append(aug)
+                    parts['backbone forward'].append(max(features - aug, 0.0))
+                    parts['head forward'].append(max(full - features, 0.0))
+                    parts['backward + update'].append(max(step - full, 0.0))
+            
+            with stage("validation"):
+                model.evaluate(X_val, y_val, batch_size=BATCH_SIZE, verbose=0)
+        
+        if step_seconds:
+            profiler.add("train step (total)", sum(step_seconds), calls=len(step_seconds))
+            # Mean share of each part over the sampled steps, applied to every measured step
+            sampled = sum(sum(v) for v in parts.values()) or 1.0
+            for name, seconds in parts.items():
+                if seconds:
+                    profiler.add(name, sum(step_seconds) * sum(seconds) / sampled, calls=len(step_seconds))
+    finally:
+        profiler.stop_trace()
+    
+    print("\n" + profiler.summary())
+    profiler.save()
+    print(f"\nTensorBoard trace and summary written to {logdir}")
+    print(f"View with: tensorboard --logdir {logdir}")
+    return profiler
+
 if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Train the crack detection model")
+    parser.add_argument('--profile', action='store_true',
+                        help="Profile data loading, augmentation and backbone instead of full training")
+    parser.add_argument('--profile-epochs', type=int, default=1)
+    parser.add_argument('--profile-logdir', default=PROFILE_LOGDIR)
+    parser.add_argument('--profile-breakdown-every', type=int, default=4,
+                        help="Break the train step into stages on every Nth step")
+    args = parser.parse_args()
+    
     print("=" * 60)
     print("CRACK DETECTION MODEL TRAINING")
     print("=" * 60)
@@ -413,6 +537,10 @@ if __name__ == '__main__':
         print(f"❌ Error: {TRACK_IMAGES_DIR} directory not found!")
         exit(1)
     
+    if args.profile:
+        profile_crack_training(args.profile_epochs, args.profile_logdir, args.profile_breakdown_every)
+        exit(0)
+    
     # Train crack detection model (crack vs non-crack)
     crack_model = train_crack_model()
     
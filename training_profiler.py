@@ -0,0 +1,108 @@
+"""
+Per-stage timing and host-memory profiler for the training pipelines.
+
+Stages are wrapped with `profiler.stage(name)`; each one is also emitted as a
+TensorFlow trace annotation, so it shows up by name in the TensorBoard
+Profile tab when a trace is being recorded.
+"""
+import os
+import json
+import time
+import resource
+from collections import OrderedDict
+from contextlib import contextmanager
+
+import tensorflow as tf
+
+
+def current_rss_mb():
+    """Resident set size of this process in MB"""
+    try:
+        with open('/proc/self/statm') as f:
+            pages = int(f.read().split()[1])
+        return pages * os.sysconf('SC_PAGE_SIZE') / (1024 * 1024)
+    except (OSError, ValueError):
+        # No procfs (macOS): fall back to the peak, which is the best we have
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak / (1024 * 1024) if os.uname().sysname == 'Darwin' else peak / 1024
+
+
+class StageProfiler:
+    def __init__(self, logdir=None):
+        self.logdir = logdir
+        self.stats = OrderedDict()
+        self.peak_rss_mb = current_rss_mb()
+        self._tracing = False
+
+    @contextmanager
+    def stage(self, name):
+        """Time a block of work and record the change in host RSS"""
+        rss_before = current_rss_mb()
+        start = time.perf_counter()
+        with tf.profiler.experimental.Trace(name):
+            yield
+        elapsed = time.perf_counter() - start
+        rss_after = current_rss_mb()
+
+        entry = self.stats.setdefault(name, {'calls': 0, 'seconds': 0.0, 'rss_delta_mb': 0.0})
+        entry['calls'] += 1
+        entry['seconds'] += elapsed
+        entry['rss_delta_mb'] += rss_after - rss_before
+        self.peak_rss_mb = max(self.peak_rss_mb, rss_after)
+
+    def add(self, name, seconds, calls=1):
+        """Record a stage whose time was derived rather than measured directly"""
+        entry = self.stats.setdefault(name, {'calls': 0, 'seconds': 0.0, 'rss_delta_mb': 0.0})
+        entry['calls'] += calls
+        entry['seconds'] += seconds
+
+    def start_trace(self):
+        if self.logdir and not self._tracing:
+            os.makedirs(self.logdir, exist_ok=True)
+            tf.profiler.experimental.start(self.logdir)
+            self._tracing = True
+
+    def stop_trace(self):
+        if self._tracing:
+            tf.profiler.experimental.stop()
+            self._tracing = False
+
+    def ranked(self):
+        return sorted(self.stats.items(), key=lambda kv: kv[1]['seconds'], reverse=True)
+
+    def summary(self):
+        """Table of stages ranked by total time"""
+        # "(total)" stages wrap other stages and "(tracing)" is one-off graph building,
+        # so both are left out of the shares
+        unshared = ('(total)', '(tracing)')
+        total = sum(s['seconds'] for name, s in self.stats.items() if not name.endswith(unshared)) or 1.0
+        lines = [
+            f"{'Stage':<32} {'Calls':>7} {'Total (s)':>10} {'Mean (ms)':>10} {'Share':>7} {'RSS Δ (MB)':>11}",
+            "-" * 82,
+        ]
+        for name, s in self.ranked():
+            mean_ms = s['seconds'] / s['calls'] * 1000 if s['calls'] else 0.0
+            share = "-" if name.endswith(unshared) else f"{s['seconds'] / total:.1%}"
+            lines.append(
+                f"{name:<32} {s['calls']:>7} {s['seconds']:>10.2f} {mean_ms:>10.2f} "
+                f"{share:>7} {s['rss_delta_mb']:>11.1f}"
+            )
+        lines.append("-" * 82)
+        lines.append(f"Peak host RSS: {self.peak_rss_mb:.1f} MB")
+        return "\n".join(lines)
+
+    def save(self):
+        """Write the summary as JSON plus TensorBoard scalars next to the trace"""
+        if not self.logdir:
+            return
+        os.makedirs(self.logdir, exist_ok=True)
+        with open(os.path.join(self.logdir, 'stage_summary.json'), 'w') as f:
+            json.dump({'stages': self.stats, 'peak_rss_mb': self.peak_rss_mb}, f, indent=2)
+
+        writer = tf.summary.create_file_writer(self.logdir)
+        with writer.as_default():
+            for step, (name, s) in enumerate(self.ranked()):
+                tf.summary.scalar(f"stage_seconds/{name}", s['seconds'], step=0)
+                tf.summary.text("stage_rank", f"{step + 1}. {name}", step=step)
+            tf.summary.text("stage_summary", "```\n" + self.summary() + "\n```", step=0)
+        writer.flush()
@@ -0,0 +1,88 @@
+"""
+Test-time augmentation and ensembling for borderline frames.
+
+When the first-pass calibrated P(Faulty) falls inside an uncertainty band,
+the frame is re-scored on a set of cheap variants (flips, small crops). All
+variants for a model are stacked into one batch and scored with a single
+invoke on an interpreter allocated at that batch size. The primary model
+scores only the extra variants, since its first pass already covers the
+original frame. Each ensemble member, for example a TFLite export of
+final_model.h5, scores the original plus every variant in one invoke. The
+final score is the mean of all raw scores.
+"""
+import time
+import numpy as np
+from PIL import Image, ImageOps
+
+from preprocessing import TARGET_SIZE
+
+
+def _crop(box):
+    """Crop a fraction box (left, top, right, bottom) and resize back to the input size"""
+    def apply(image):
+        w, h = image.size
+        region = image.crop((int(box[0] * w), int(box[1] * h), int(box[2] * w), int(box[3] * h)))
+        return region.resize(TARGET_SIZE, Image.Resampling.LANCZOS)
+    return apply
+
+
+VARIANTS = {
+    'hflip': ImageOps.mirror,
+    'vflip': ImageOps.flip,
+    'crop_center': _crop((0.05, 0.05, 0.95, 0.95)),
+    'crop_tl': _crop((0.0, 0.0, 0.9, 0.9)),
+    'crop_br': _crop((0.1, 0.1, 1.0, 1.0)),
+}
+DEFAULT_VARIANTS = ('hflip', 'vflip', 'crop_center', 'crop_tl', 'crop_br')
+
+
+def parse_variants(spec):
+    names = tuple(n.strip() for n in spec.split(',') if n.strip())
+    unknown = [n for n in names if n not in VARIANTS]
+    if unknown:
+        raise ValueError(f"Unknown TTA variants: {', '.join(unknown)}; available: {', '.join(VARIANTS)}")
+    return names
+
+
+class TestTimeAugmenter:
+    def __init__(self, variants=DEFAULT_VARIANTS, band=(0.35, 0.65), ensemble=()):
+        self.variants = tuple(variants)
+        self.band = band
+        # Extra LoadedModels allocated at batch size len(variants) + 1
+        self.ensemble = list(ensemble)
+
+    @property
+    def primary_batch_size(self):
+        return len(self.variants)
+
+    @property
+    def ensemble_batch_size(self):
+        return len(self.variants) + 1
+
+    def should_refine(self, probability_faulty):
+        return self.band[0] <= probability_faulty <= self.band[1]
+
+    def refine(self, model, resized, first_pass_score):
+        """Mean raw score over variants and ensemble members, plus a cost report"""
+        start = time.perf_counter()
+        variants = [VARIANTS[name](resized) for name in self.variants]
+
+        scores = {model.version: [first_pass_score]}
+        invokes = 0
+        if variants:
+            scores[model.version].extend(model.score_batch(variants).tolist())
+            invokes += 1
+        for member in self.ensemble:
+            scores[member.version] = member.score_batch([resized] + variants).tolist()
+            invokes += 1
+
+        all_scores = [s for model_scores in scores.values() for s in model_scores]
+        return float(np.mean(all_scores)), {
+            'first_pass_score': first_pass_score,
+            'variants': list(self.variants),
+            'models': list(scores),
+            'scores_by_model': {k: [round(s, 4) for s in v] for k, v in scores.items()},
+            'score_std': round(float(np.std(all_scores)), 4),
+            'extra_invokes': invokes,
+            'added_ms': round((time.perf_counter() - start) * 1000, 2),
+        }
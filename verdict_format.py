@@ -0,0 +1,113 @@
+"""
+Compact binary verdict records, shared by the server and crack_client.py.
+
+Sent instead of JSON when the request's Accept header names MEDIA_TYPE.
+Each verdict carries only what a high-rate uploader needs: the raw score,
+calibrated P(Faulty), the threshold applied, the class and the IDs. It is a
+fixed 35-byte little-endian header followed by three short UTF-8 strings:
+
+    offset  size  field
+    0       2     magic b'CV'
+    2       1     format version (1)
+    3       1     flags: bit 0 has_crack, bit 1 re-scored with TTA, bit 2 error,
+                  bit 3 queue full (503), bit 4 deadline passed (504)
+    4       4     raw_score           float32, P(Normal)
+    8       4     probability_faulty  float32, calibrated
+    12      4     threshold           float32
+    16      16    event_id            UUID bytes, zero when not part of an event
+    32      1     length of model_version
+    33      1     length of frame_id
+    34      1     length of error message
+    35      ...   model_version, frame_id, error message
+
+A batch response is a uint32 record count followed by the records; a frame
+that failed inside a batch is an error record with NaN scores, flagged when
+the failure is worth retrying (queue full or deadline passed). A request that
+fails as a whole is answered in JSON, so clients check the Content-Type.
+"""
+import struct
+import uuid
+
+MEDIA_TYPE = 'application/vnd.crack-verdict'
+MAGIC = b'CV'
+VERSION = 1
+HEADER = struct.Struct('<2sBBfff16sBBB')
+COUNT = struct.Struct('<I')
+
+FLAG_HAS_CRACK = 1
+FLAG_TTA = 2
+FLAG_ERROR = 4
+FLAG_QUEUE_FULL = 8
+FLAG_DEADLINE = 16
+# Per-frame HTTP status of a retryable batch failure, carried as a flag
+STATUS_FLAGS = {503: FLAG_QUEUE_FULL, 504: FLAG_DEADLINE}
+NAN = float('nan')
+
+
+def _short(text):
+    return (text or '').encode('utf-8')[:255]
+
+
+def encode_verdict(result):
+    """Pack a /upload/ result dict (or a per-frame error dict) into one record"""
+    model_version = _short(result.get('model_version'))
+    frame_id = _short(result.get('frame_id'))
+    if result.get('error'):
+        message = _short(result.get('message'))
+        flags = FLAG_ERROR | STATUS_FLAGS.get(result.get('status'), 0)
+        return HEADER.pack(MAGIC, VERSION, flags, NAN, NAN, NAN, bytes(16),
+                           len(model_version), len(frame_id), len(message)) + model_version + frame_id + message
+
+    event_id = result.get('event', {}).get('event_id')
+    flags = (FLAG_HAS_CRACK if result['has_crack'] else 0) | (FLAG_TTA if 'tta' in result else 0)
+    return HEADER.pack(
+        MAGIC, VERSION, flags, result['raw_score'], result['probability_faulty'], result['threshold'],
+        uuid.UUID(event_id).bytes if event_id else bytes(16), len(model_version), len(frame_id), 0
+    ) + model_version + frame_id
+
+
+def encode_batch(results):
+    return COUNT.pack(len(results)) + b''.join(encode_verdict(r) for r in results)
+
+
+def decode_verdict(data, offset=0):
+    """(verdict dict, offset just past the record)"""
+    magic, version, flags, raw_score, p_faulty, threshold, event_id, *lengths = \
+        HEADER.unpack_from(data, offset)
+    if magic != MAGIC or version != VERSION:
+        raise ValueError(f"Not a version {VERSION} verdict record")
+    offset += HEADER.size
+    strings = []
+    for length in lengths:
+        strings.append(bytes(data[offset:offset + length]).decode('utf-8', errors='ignore'))
+        offset += length
+    model_version, frame_id, message = strings
+
+    if flags & FLAG_ERROR:
+        error = {'error': True, 'message': message, 'frame_id': frame_id or None}
+        for status, flag in STATUS_FLAGS.items():
+            if flags & flag:
+                error['status'] = status
+        return error, offset
+
+    has_crack = bool(flags & FLAG_HAS_CRACK)
+    return {
+        'has_crack': has_crack,
+        'class': 'Faulty' if has_crack else 'Normal',
+        'raw_score': raw_score,
+        'probability_faulty': p_faulty,
+        'threshold': threshold,
+        'tta': bool(flags & FLAG_TTA),
+        'event_id': uuid.UUID(bytes=bytes(event_id)).hex if any(event_id) else None,
+        'model_version': model_version,
+        'frame_id': frame_id or None,
+    }, offset
+
+
+def decode_batch(data):
+    (count,), offset = COUNT.unpack_from(data, 0), COUNT.size
+    verdicts = []
+    for _ in range(count):
+        verdict, offset = decode_verdict(data, offset)
+        verdicts.append(verdict)
+    return verdicts